@@ -0,0 +1,102 @@
+"""
+Cache kết quả /seo-advisor theo "dấu vân tay" nội dung audit.
+
+Cùng một báo cáo audit thường được gửi lại mỗi lần người dùng mở trang. Khóa cache là
+sha256 của audit ở dạng chuẩn hoá (bỏ các id thay đổi giữa các lần gửi, không phụ thuộc
+thứ tự khóa hay thứ tự failed_elements) cùng model đang dùng; giá trị là
+SEOAdvisorResponse đã serialize sẵn nên lần trúng cache không cần deserialize hay gọi Gemini.
+Hết hạn theo TTL, vượt kích thước thì bỏ mục ít dùng nhất (LRU).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+ADVISOR_CACHE_TTL = int(os.getenv("ADVISOR_CACHE_TTL", "86400"))
+ADVISOR_CACHE_MAX_ENTRIES = int(os.getenv("ADVISOR_CACHE_MAX_ENTRIES", "500"))
+
+# Các id thay đổi giữa các lần gửi cùng một audit. user_id được giữ trong khóa vì lời khuyên
+# còn phụ thuộc lịch sử tư vấn theo (user_id, url) trong advisor_history
+VOLATILE_FIELDS = ("id",)
+VOLATILE_ELEMENT_FIELDS = ("id", "audit_repost_id")
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def fingerprint(data: dict, model: str) -> str | None:
+    """Khóa nội dung của audit (dict JSON thô); None nếu dữ liệu không đúng dạng để cache."""
+    if not isinstance(data, dict) or not isinstance(data.get("failed_elements", []), list):
+        return None
+
+    audit = {key: value for key, value in data.items() if key not in VOLATILE_FIELDS and key != "failed_elements"}
+    elements = []
+    for element in data.get("failed_elements", []):
+        if not isinstance(element, dict):
+            return None
+        elements.append(_canonical({key: value for key, value in element.items()
+                                    if key not in VOLATILE_ELEMENT_FIELDS}))
+    elements.sort()
+
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(_canonical(audit).encode("utf-8"))
+    for element in elements:
+        digest.update(b"\0")
+        digest.update(element.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AdvisorCache:
+    def __init__(self, max_entries: int = ADVISOR_CACHE_MAX_ENTRIES, ttl: int = ADVISOR_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # fingerprint -> (JSON đã serialize, hạn dùng)
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str | None) -> str | None:
+        if key is None or self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        metrics.incr("advisor_cache_hits" if entry is not None else "advisor_cache_misses")
+        return entry[0] if entry is not None else None
+
+    def put(self, key: str | None, body: str):
+        if key is None or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (body, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = AdvisorCache()
+
+
+def hit_rate() -> float:
+    hits = metrics.get("advisor_cache_hits")
+    total = hits + metrics.get("advisor_cache_misses")
+    return round(hits / total, 4) if total else 0.0
+
+
+metrics.register_gauge("advisor_cache_hit_rate", hit_rate)
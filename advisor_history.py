@@ -0,0 +1,52 @@
+"""
+Lịch sử tư vấn SEO (SQLite) cho từng (user_id, url).
+
+Mỗi nhóm lỗi (element, description, status) của lần audit gần nhất được lưu cùng chữ ký
+của phần tóm tắt đã gửi cho Gemini và lời khuyên nhận được. Ở lần audit sau, nhóm có
+cùng chữ ký dùng lại lời khuyên cũ; chỉ nhóm mới hoặc đã thay đổi mới phải hỏi lại
+Gemini, còn nhóm đã được khắc phục (không còn trong audit) bị xoá.
+"""
+import json
+import os
+import time
+
+from sqlite_store import SQLiteStore
+
+ADVISOR_HISTORY_DB = os.getenv(
+    "ADVISOR_HISTORY_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "advisor_history.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS advisor_history (
+    user_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    advice TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, url, group_key)
+);
+"""
+
+_store = SQLiteStore(ADVISOR_HISTORY_DB, SCHEMA)
+
+
+def load(user_id: int, url: str) -> dict[str, tuple[str, dict]]:
+    """group_key -> (chữ ký, lời khuyên) của lần tư vấn trước."""
+    rows = _store.connect().execute(
+        "SELECT group_key, signature, advice FROM advisor_history WHERE user_id = ? AND url = ?",
+        (user_id, url)).fetchall()
+    return {row["group_key"]: (row["signature"], json.loads(row["advice"])) for row in rows}
+
+
+def save(user_id: int, url: str, groups: dict[str, tuple[str, dict]]):
+    """Thay toàn bộ lịch sử của (user_id, url) bằng `groups`: nhóm không còn xuất hiện bị xoá."""
+    now = time.time()
+    conn = _store.connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM advisor_history WHERE user_id = ? AND url = ?", (user_id, url))
+        conn.executemany(
+            "INSERT INTO advisor_history (user_id, url, group_key, signature, advice, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, url, key, signature, json.dumps(advice, ensure_ascii=False), now)
+             for key, (signature, advice) in groups.items()])
@@ -0,0 +1,162 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import metrics
+from retrieval import fold_diacritics
+
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# Ngưỡng Jaccard (trên trigram ký tự) để coi hai câu hỏi là gần trùng
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+
+_NON_WORD_RE = re.compile(r"[^\w]+", re.UNICODE)
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def normalize_question(question: str) -> str:
+    """'  Sứ mệnh của GCCN là gì?? ' -> 'su menh cua gccn la gi'"""
+    folded = fold_diacritics(question).lower()
+    return " ".join(_NON_WORD_RE.sub(" ", folded).split())
+
+
+def numbers(normalized: str) -> tuple[str, ...]:
+    """Các số trong câu hỏi: 'hoi nghi trung uong 8 nam 1941' -> ('8', '1941')."""
+    return tuple(_NUMBER_RE.findall(normalized))
+
+
+def shingles(normalized: str) -> frozenset[str]:
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+@dataclass
+class CacheEntry:
+    bucket: tuple[str, str]
+    question: str
+    shingles: frozenset[str]
+    numbers: tuple[str, ...]
+    answer: dict
+    expires_at: float
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời theo (corpus, phiên bản corpus, câu hỏi đã chuẩn hoá).
+    Ngoài khớp chính xác, câu hỏi gần trùng được tìm qua chỉ mục ngược trigram
+    trong cùng corpus/phiên bản. Hết hạn theo TTL, vượt kích thước thì bỏ mục ít dùng nhất (LRU).
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: int = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: OrderedDict[tuple[str, str, str], CacheEntry] = OrderedDict()
+        # (corpus, version) -> trigram -> tập khóa chứa trigram đó
+        self._postings: dict[tuple[str, str], dict[str, set]] = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        postings = self._postings.get(entry.bucket)
+        if postings is None:
+            return
+        for shingle in entry.shingles:
+            keys = postings.get(shingle)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del postings[shingle]
+        if not postings:
+            del self._postings[entry.bucket]
+
+    def _live(self, key, now: float) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _find_similar(self, bucket, question_shingles, question_numbers, now: float) -> CacheEntry | None:
+        postings = self._postings.get(bucket)
+        if not postings:
+            return None
+
+        overlap: dict = {}
+        for shingle in question_shingles:
+            for key in postings.get(shingle, ()):
+                overlap[key] = overlap.get(key, 0) + 1
+
+        best_key, best_score = None, 0.0
+        for key, shared in overlap.items():
+            entry = self._entries[key]
+            # Hai câu hỏi chỉ khác nhau một con số (năm, số hiệu hội nghị...) là hai câu hỏi khác nhau
+            if entry.numbers != question_numbers:
+                continue
+            score = shared / (len(question_shingles) + len(entry.shingles) - shared)
+            if score > best_score:
+                best_key, best_score = key, score
+
+        if best_key is None or best_score < self.similarity:
+            return None
+        return self._live(best_key, now)
+
+    def get(self, corpus: str, version: str, question: str) -> dict | None:
+        if self.max_entries <= 0:
+            return None
+
+        normalized = normalize_question(question)
+        bucket = (corpus, version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live((corpus, version, normalized), now)
+            if entry is not None:
+                metrics.incr("answer_cache_hits")
+                return entry.answer
+
+            entry = self._find_similar(bucket, shingles(normalized), numbers(normalized), now)
+            if entry is not None:
+                metrics.incr("answer_cache_hits")
+                metrics.incr("answer_cache_near_duplicate_hits")
+                return entry.answer
+
+        metrics.incr("answer_cache_misses")
+        return None
+
+    def put(self, corpus: str, version: str, question: str, answer: dict):
+        if self.max_entries <= 0:
+            return
+
+        normalized = normalize_question(question)
+        key = (corpus, version, normalized)
+        entry = CacheEntry((corpus, version), normalized, shingles(normalized), numbers(normalized), answer,
+                           time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            postings = self._postings.setdefault(entry.bucket, {})
+            for shingle in entry.shingles:
+                postings.setdefault(shingle, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def hit_rate() -> float:
+    hits = metrics.get("answer_cache_hits")
+    total = hits + metrics.get("answer_cache_misses")
+    return round(hits / total, 4) if total else 0.0
+
+
+metrics.register_gauge("answer_cache_hit_rate", hit_rate)
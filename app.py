@@ -1,19 +1,25 @@
 from dataclasses import asdict
+import json
+import math
 import sys
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flasgger import Swagger, swag_from
-import google.generativeai as genai
 from deserialize import deserialize_to_dataclass
-from keyword_utils import generate_and_send_keywords
-from rank_tracking import rank_tracking, update_rank_tracking, RankTrackingRequest, UpdateRankTrackingRequest
+from keyword_utils import KEYWORD_BATCH_MAX_SEEDS, generate_and_send_keywords, generate_keywords_batch
+from rank_tracking import rank_tracking, track_keywords, update_rank_tracking, RankTrackingRequest, UpdateRankTrackingRequest, RANK_TRACKING_MAX_KEYWORDS
 from top_ranking import top_ranking
-from seo_advisor import seo_advisor, AuditRequestModel
+from seo_advisor import seo_advisor, AuditRequestModel, FEATURE as SEO_ADVISOR_FEATURE
 from content_optimization import optimize_content as optimize_content_func
+from content_optimization import optimize_content_stream
 from content_optimization import ContentOptimizationRequest
 from functools import wraps
-from chat_box import ask_gemini as gemini_service
-from chat_box_hcm import ask_gemini as gemini_service_hcm
-from chat_box_vrn import ask_gemini as gemini_service_vrn
+import chat_engine
+from llm_scheduler import LLMOverloadedError
+from resilience import CircuitOpenError
+import advisor_cache
+import model_registry
+import metrics
+import outbox
 
 import os
 
@@ -33,7 +39,10 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # FLASK_INTERNAL_API_KEY = "super-secret-ai-key"
 # FLASK_INTERNAL_API_KEY = os.getenv("FLASK_INTERNAL_API_KEY")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Client Gemini được tạo lazily ở lần gọi đầu tiên (xem model_registry)
+model_registry.configure(GEMINI_API_KEY)
+# Gửi nốt các lệnh ghi backend còn tồn trong outbox từ lần chạy trước
+outbox.start_worker()
 
 # def require_internal_api_key(f):
 #     @wraps(f)
@@ -44,6 +53,48 @@ genai.configure(api_key=GEMINI_API_KEY)
 #         return f(*args, **kwargs)
 #     return decorated
 
+def unavailable_response(e):
+    """Quota Gemini bão hoà hoặc upstream bị ngắt mạch: từ chối sớm bằng 503 thay vì để request treo."""
+    retry_after = max(1, min(60, math.ceil(e.retry_after)))
+    return jsonify({"error": "Service Unavailable", "message": str(e)}), 503, {"Retry-After": str(retry_after)}
+
+# --- Streaming (Server-Sent Events) ---
+def wants_stream(data):
+    """Streaming là tuỳ chọn: bật bằng ?stream=1, "stream": true trong body hoặc Accept: text/event-stream."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    if isinstance(data, dict) and data.get('stream') is True:
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(data, event=None):
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+def sse_response(chunks):
+    """
+    Chuyển một generator (các đoạn văn bản, phần tử cuối là dict kết quả)
+    thành SSE: mỗi đoạn là một event "data", kết quả cuối là event "done".
+    """
+    def generate():
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, dict):
+                    yield sse_event(chunk, event='done')
+                else:
+                    yield sse_event({"text": chunk})
+        except Exception as e:
+            print(f"Error while streaming response: {e}", file=sys.stderr)
+            yield sse_event({"error": str(e)}, event='error')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # BE
 @app.route('/generate-seo-keywords', methods=['POST'])
 def generate_seo_keywords():
@@ -62,7 +113,7 @@ def generate_seo_keywords():
               example: seo
     responses:
       200:
-        description: Keywords generated and sent successfully.
+        description: Keywords generated and queued for the external API.
       400:
         description: Invalid input.
       500:
@@ -78,10 +129,56 @@ def generate_seo_keywords():
         result = generate_and_send_keywords(input_keyword)
         return jsonify(result), 200
 
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
 # BE
+@app.route('/generate-seo-keywords/batch', methods=['POST'])
+def generate_seo_keywords_batch():
+    """
+    Generates SEO keywords for many seed keywords and streams one NDJSON line per seed.
+    ---
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            input_keywords:
+              type: array
+              items:
+                type: string
+              example: ["seo", "content marketing", "backlink"]
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: One JSON object per seed as soon as it is ready, then a summary line with "done" true.
+      400:
+        description: Missing or too many input keywords.
+    """
+    data = request.get_json(silent=True) or {}
+    input_keywords = data.get("input_keywords")
+
+    if not isinstance(input_keywords, list) or not input_keywords:
+        return jsonify({"error": "Missing 'input_keywords' list in request body."}), 400
+    if len(input_keywords) > KEYWORD_BATCH_MAX_SEEDS:
+        return jsonify({"error": f"At most {KEYWORD_BATCH_MAX_SEEDS} input keywords per request."}), 400
+
+    def generate():
+        try:
+            for line in generate_keywords_batch(input_keywords):
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error while streaming keyword batch: {e}", file=sys.stderr)
+            yield json.dumps({"done": True, "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/rank-tracking', methods=['POST'])
 def generate_rank_tracking():
     """
@@ -102,7 +199,7 @@ def generate_rank_tracking():
               example: 0
     responses:
       200:
-        description: Keywords generated and sent successfully.
+        description: Keywords generated and queued for the external API.
       400:
         description: Invalid input.
       500:
@@ -120,31 +217,87 @@ def generate_rank_tracking():
         result = rank_tracking(input_keyword, user)
         return jsonify(result), 200
 
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
 
-@app.route('/top-ranking', methods=['POST'])
-def generate_top_ranking():
+@app.route('/rank-tracking/batch', methods=['POST'])
+def generate_rank_tracking_batch():
     """
-    Generates Rank Tracking and sends them to external API.
+    Tracks the ranks of many keywords for one user with a single Gemini prompt per token budget.
     ---
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            user_id:
+              type: integer
+              example: 0
+            input_keywords:
+              type: array
+              items:
+                type: string
+              example: ["seo", "content marketing", "backlink"]
     responses:
       200:
-        description: Keywords generated and sent successfully.
+        description: Ranks per keyword, keywords without an estimate, and the outbox status of the bulk write.
       400:
         description: Invalid input.
       500:
         description: Internal server error.
     """
     try:
-        result = top_ranking()  # Assuming this function does not require any input parameters
-        return jsonify(result), 200
+        data = request.get_json(silent=True) or {}
+        input_keywords = data.get('input_keywords')
+        user = data.get('user_id')
 
+        if not isinstance(input_keywords, list) or not input_keywords or not user:
+            return jsonify({"error": "Missing 'input_keywords' list or 'user_id' in request body."}), 400
+        if len(input_keywords) > RANK_TRACKING_MAX_KEYWORDS:
+            return jsonify({"error": f"At most {RANK_TRACKING_MAX_KEYWORDS} input keywords per request."}), 400
+
+        return jsonify(track_keywords(input_keywords, user)), 200
+
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
-# BE
+
+@app.route('/top-ranking', methods=['GET', 'POST'])
+def generate_top_ranking():
+    """
+    Returns the current top 10 trending keywords.
+    The list is regenerated in the background and served from memory; use
+    If-None-Match / If-Modified-Since on GET to receive 304 when nothing changed.
+    ---
+    responses:
+      200:
+        description: Current top ranking keywords, with ETag and Last-Modified headers.
+      304:
+        description: Not modified since the client's copy.
+      500:
+        description: Internal server error.
+    """
+    try:
+        snapshot = top_ranking()
+        response = jsonify(snapshot.result)
+        response.set_etag(snapshot.etag)
+        response.last_modified = snapshot.generated_at
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return jsonify({"error": f"API Error: {str(e)}"}), 500
+
+
 @app.route('/seo-advisor', methods=['POST'])
 def generate_seo_advisor():
     """
@@ -198,6 +351,7 @@ def generate_seo_advisor():
                   current_value:
                     type: string
                     example: "Example Title"
+                    nullable: true
                   status:
                     type: string
                     example: "not pass"
@@ -246,6 +400,13 @@ def generate_seo_advisor():
                 "details": "Ensure 'Content-Type: application/json' header is set and the body is valid JSON."
             }), 400
         
+        # Audit đã được tư vấn (cùng nội dung, chỉ khác id): trả kết quả đã serialize,
+        # không deserialize và không gọi Gemini
+        cache_key = advisor_cache.fingerprint(data, model_registry.model_name(SEO_ADVISOR_FEATURE))
+        cached_body = advisor_cache.cache.get(cache_key)
+        if cached_body is not None:
+            return Response(cached_body, status=200, mimetype="application/json")
+
         # --- SỬ DỤNG deserialize_to_dataclass Ở ĐÂY ---
         try:
             request_data = deserialize_to_dataclass(AuditRequestModel, data)
@@ -256,10 +417,12 @@ def generate_seo_advisor():
                 "details": str(e)
             }), 400
         
-        seo_response_entity = seo_advisor(request_data)
+        seo_response_entity = seo_advisor(request_data, cache_key=cache_key)
 
         return jsonify(asdict(seo_response_entity)), 200
 
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         print(f"An unhandled internal server error occurred: {e}", file=sys.stderr)
         import traceback
@@ -322,6 +485,8 @@ def update_rank_tracking_with_id():
             "details": result
         }), 200
 
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
@@ -363,6 +528,10 @@ def optimize_content():
             include_citation:
               type: boolean
               example: true
+            stream:
+              type: boolean
+              example: false
+              description: Trả kết quả dạng Server-Sent Events; điểm số nằm trong event "done" cuối cùng.
     responses:
       200:
         description: Optimization successful.
@@ -398,6 +567,9 @@ def optimize_content():
         except Exception as e:  # Bắt lỗi khi tạo ContentOptimizationRequest
             return jsonify({"error": f"Invalid input data for ContentOptimizationRequest: {str(e)}"}), 400
 
+        if wants_stream(data):
+            return sse_response(optimize_content_stream(request_data))
+
         # Gọi hàm xử lý chính (tôi giả định hàm của bạn tên là optimize_content_func
         # để tránh trùng tên với endpoint Flask)
         # <--- Đổi tên hàm thành optimize_content_func
@@ -405,16 +577,16 @@ def optimize_content():
 
         return jsonify(result), 200
 
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         # Ghi log lỗi ra console để debug
         print(f"Error in /optimize-content: {str(e)}")
         return jsonify({"error": f"API Error: {str(e)}"}), 500
 
 # --- Gemini Chat Endpoint ---
-@app.route('/ask_gemini', methods=['POST'])
-@swag_from({
-    'tags': ['Gemini AI Chat'],
-    'parameters': [
+def ask_spec(tag, example, with_corpus=False):
+    parameters = [
         {
             'name': 'body',
             'in': 'body',
@@ -424,33 +596,54 @@ def optimize_content():
                 'properties': {
                     'question': {
                         'type': 'string',
-                        'example': 'Sứ mệnh của giai cấp công nhân thể hiện ở những khía cạnh nào?'
+                        'example': example
+                    },
+                    'stream': {
+                        'type': 'boolean',
+                        'example': False,
+                        'description': 'Trả câu trả lời dạng Server-Sent Events'
                     }
                 },
                 'required': ['question']
             }
         }
-    ],
-    'consumes': ['application/json'],
-    'produces': ['application/json'],
-    'responses': {
-        200: {
-            'description': 'Phản hồi từ AI',
-            'examples': {
-                'application/json': {
-                    'answer': 'Chào bạn! Tôi có thể giúp gì?'
+    ]
+    if with_corpus:
+        parameters.insert(0, {
+            'name': 'corpus',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Tên corpus, ví dụ: default, hcm, vrn'
+        })
+
+    return {
+        'tags': [tag],
+        'parameters': parameters,
+        'consumes': ['application/json'],
+        'produces': ['application/json'],
+        'responses': {
+            200: {
+                'description': 'Phản hồi từ AI',
+                'examples': {
+                    'application/json': {
+                        'answer': 'Chào bạn! Tôi có thể giúp gì?'
+                    }
                 }
+            },
+            400: {
+                'description': 'Thiếu dữ liệu question'
+            },
+            404: {
+                'description': 'Không tìm thấy corpus'
+            },
+            500: {
+                'description': 'Lỗi nội bộ server'
             }
-        },
-        400: {
-            'description': 'Thiếu dữ liệu question'
-        },
-        500: {
-            'description': 'Lỗi nội bộ server'
         }
     }
-})
-def ask_gemini():
+
+def handle_ask(corpus):
     data = request.get_json(silent=True)
     if not data or 'question' not in data:
         return jsonify({"error": "Vui lòng cung cấp 'question' trong request body."}), 400
@@ -458,114 +651,88 @@ def ask_gemini():
     user_question = data.get('question')
 
     try:
-        response = gemini_service(user_question)
-        return jsonify(response)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/ask_gemini_hcm', methods=['POST'])
-@swag_from({
-    'tags': ['Gemini AI Chat HCM'],
-    'parameters': [
-        {
-            'name': 'body',
-            'in': 'body',
-            'required': True,
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'question': {
-                        'type': 'string',
-                        'example': ''
-                    }
-                },
-                'required': ['question']
-            }
-        }
-    ],
-    'consumes': ['application/json'],
-    'produces': ['application/json'],
-    'responses': {
-        200: {
-            'description': 'Phản hồi từ AI',
-            'examples': {
-                'application/json': {
-                    'answer': 'Chào bạn! Tôi có thể giúp gì?'
-                }
-            }
-        },
-        400: {
-            'description': 'Thiếu dữ liệu question'
-        },
-        500: {
-            'description': 'Lỗi nội bộ server'
-        }
-    }
-})
-def ask_gemini_hcm():
-    data = request.get_json(silent=True)
-    if not data or 'question' not in data:
-        return jsonify({"error": "Vui lòng cung cấp 'question' trong request body."}), 400
+        chat_engine.registry.get(corpus)
+    except KeyError:
+        return jsonify({
+            "error": f"Không tìm thấy corpus '{corpus}'.",
+            "available": chat_engine.registry.names()
+        }), 404
 
-    user_question = data.get('question')
+    if wants_stream(data):
+        return sse_response(chat_engine.ask_stream(corpus, user_question))
 
     try:
-        response = gemini_service_hcm(user_question)
+        response = chat_engine.ask(corpus, user_question)
         return jsonify(response)
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/ask/<corpus>', methods=['POST'])
+@swag_from(ask_spec('Gemini AI Chat', 'Sứ mệnh của giai cấp công nhân thể hiện ở những khía cạnh nào?', with_corpus=True))
+def ask_corpus(corpus):
+    return handle_ask(corpus)
+
+# Các route cũ được giữ lại cho front-end hiện tại
+@app.route('/ask_gemini', methods=['POST'])
+@swag_from(ask_spec('Gemini AI Chat', 'Sứ mệnh của giai cấp công nhân thể hiện ở những khía cạnh nào?'))
+def ask_gemini():
+    return handle_ask('default')
+
+@app.route('/ask_gemini_hcm', methods=['POST'])
+@swag_from(ask_spec('Gemini AI Chat HCM', ''))
+def ask_gemini_hcm():
+    return handle_ask('hcm')
+
 @app.route('/ask_gemini_vnr', methods=['POST'])
-@swag_from({
-    'tags': ['Gemini AI Chat VRN'],
-    'parameters': [
-        {
-            'name': 'body',
-            'in': 'body',
-            'required': True,
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'question': {
-                        'type': 'string',
-                        'example': ''
-                    }
-                },
-                'required': ['question']
-            }
-        }
-    ],
-    'consumes': ['application/json'],
-    'produces': ['application/json'],
-    'responses': {
-        200: {
-            'description': 'Phản hồi từ AI',
-            'examples': {
-                'application/json': {
-                    'answer': 'Chào bạn! Tôi có thể giúp gì?'
-                }
-            }
-        },
-        400: {
-            'description': 'Thiếu dữ liệu question'
-        },
-        500: {
-            'description': 'Lỗi nội bộ server'
-        }
-    }
-})
+@swag_from(ask_spec('Gemini AI Chat VRN', ''))
 def ask_gemini_vrn():
-    data = request.get_json(silent=True)
-    if not data or 'question' not in data:
-        return jsonify({"error": "Vui lòng cung cấp 'question' trong request body."}), 400
+    return handle_ask('vrn')
 
-    user_question = data.get('question')
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns in-process counters (cache hit rate, ...).
+    ---
+    responses:
+      200:
+        description: Current metric values.
+    """
+    return jsonify(metrics.snapshot()), 200
 
-    try:
-        response = gemini_service_vrn(user_question)
-        return jsonify(response)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route('/outbox', methods=['GET'])
+def get_outbox_summary():
+    """
+    Returns the number of backend writes per kind and delivery state.
+    ---
+    responses:
+      200:
+        description: Counts grouped by kind and status (pending, sending, delivered, failed).
+    """
+    return jsonify(outbox.summary()), 200
+
+@app.route('/outbox/<outbox_id>', methods=['GET'])
+def get_outbox_status(outbox_id):
+    """
+    Returns the delivery state of the backend writes queued by one request.
+    ---
+    parameters:
+      - name: outbox_id
+        in: path
+        type: string
+        required: true
+        description: The outbox_id returned in external_api_status.
+    responses:
+      200:
+        description: Per-item delivery state.
+      404:
+        description: Unknown outbox_id.
+    """
+    status = outbox.batch_status(outbox_id)
+    if status is None:
+        return jsonify({"error": f"Không tìm thấy outbox_id '{outbox_id}'."}), 404
+    return jsonify(status), 200
 
 def main():
     app.run(debug=True, port=5001)
@@ -0,0 +1,206 @@
+"""
+ASGI entry point cho môi trường production (xem gunicorn.conf.py).
+
+Các route gọi Gemini/backend nhiều nhất được phục vụ trực tiếp bằng asyncio
+(client Gemini async), nên một tiến trình giữ được hàng trăm request đang chờ
+Gemini; lệnh ghi sang backend đi qua outbox và được gửi ở nền. Các route còn lại (Swagger, /seo-advisor, /update-rank-tracking, ...)
+được chuyển tiếp sang Flask app qua lớp WSGI.
+"""
+import json
+import math
+import sys
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import chat_engine
+from app import app as flask_app
+from content_optimization import ContentOptimizationRequest, optimize_content_async, optimize_content_stream_async
+from llm_scheduler import LLMOverloadedError
+from resilience import CircuitOpenError
+from keyword_utils import generate_and_send_keywords_async
+from rank_tracking import rank_tracking_async
+from top_ranking import top_ranking_async
+
+LEGACY_CHAT_ROUTES = {
+    "/ask_gemini": "default",
+    "/ask_gemini_hcm": "hcm",
+    "/ask_gemini_vnr": "vrn",
+}
+
+
+def unavailable_response(e: LLMOverloadedError | CircuitOpenError) -> JSONResponse:
+    retry_after = max(1, min(60, math.ceil(e.retry_after)))
+    return JSONResponse({"error": "Service Unavailable", "message": str(e)}, status_code=503,
+                        headers={"Retry-After": str(retry_after)})
+
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def wants_stream(request: Request, data) -> bool:
+    if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    if isinstance(data, dict) and data.get("stream") is True:
+        return True
+    return request.headers.get("accept", "").startswith("text/event-stream")
+
+
+def sse_event(data, event=None) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+def sse_response(chunks) -> StreamingResponse:
+    async def generate():
+        try:
+            async for chunk in chunks:
+                if isinstance(chunk, dict):
+                    yield sse_event(chunk, event="done")
+                else:
+                    yield sse_event({"text": chunk})
+        except Exception as e:
+            print(f"Error while streaming response: {e}", file=sys.stderr)
+            yield sse_event({"error": str(e)}, event="error")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def ask(request: Request):
+    corpus = request.path_params.get("corpus") or LEGACY_CHAT_ROUTES[request.url.path]
+
+    data = await read_json(request)
+    if not data or "question" not in data:
+        return JSONResponse({"error": "Vui lòng cung cấp 'question' trong request body."}, status_code=400)
+
+    user_question = data.get("question")
+
+    try:
+        chat_engine.registry.get(corpus)
+    except KeyError:
+        return JSONResponse({
+            "error": f"Không tìm thấy corpus '{corpus}'.",
+            "available": chat_engine.registry.names()
+        }, status_code=404)
+
+    if wants_stream(request, data):
+        return sse_response(chat_engine.ask_stream_async(corpus, user_question))
+
+    try:
+        return JSONResponse(await chat_engine.ask_async(corpus, user_question))
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def generate_seo_keywords(request: Request):
+    try:
+        data = await read_json(request) or {}
+        input_keyword = data.get("input_keyword")
+
+        if not input_keyword:
+            return JSONResponse({"error": "Missing 'input_keyword' in request body."}, status_code=400)
+
+        result = await generate_and_send_keywords_async(input_keyword)
+        return JSONResponse(result)
+
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JSONResponse({"error": f"API Error: {str(e)}"}, status_code=500)
+
+
+async def generate_rank_tracking(request: Request):
+    try:
+        data = await read_json(request) or {}
+        input_keyword = data.get("input_keyword")
+        user = data.get("user_id")
+
+        if not input_keyword or not user:
+            return JSONResponse({"error": "Missing 'input_keyword' or 'user_id' in request body."}, status_code=400)
+
+        result = await rank_tracking_async(input_keyword, user)
+        return JSONResponse(result)
+
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JSONResponse({"error": f"API Error: {str(e)}"}, status_code=500)
+
+
+async def generate_top_ranking(request: Request):
+    try:
+        snapshot = await top_ranking_async()
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JSONResponse({"error": f"API Error: {str(e)}"}, status_code=500)
+
+    headers = {
+        "ETag": f'"{snapshot.etag}"',
+        "Last-Modified": snapshot.last_modified,
+        "Cache-Control": "no-cache",
+    }
+    if request.method == "GET" and snapshot.not_modified(request.headers.get("if-none-match"),
+                                                         request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(snapshot.result, headers=headers)
+
+
+async def optimize_content(request: Request):
+    data = await read_json(request)
+    if not data:
+        return JSONResponse({"error": "Missing input data."}, status_code=400)
+
+    try:
+        request_data = ContentOptimizationRequest(
+            id=data.get('id'),
+            user_id=data.get('user_id'),
+            keyword=data.get('keyword'),
+            content=data.get('content'),
+            content_length=data.get('content_length'),
+            optimization_level=data.get('optimization_level'),
+            readability_level=data.get('readability_level'),
+            include_citation=data.get('include_citation')
+        )
+    except Exception as e:
+        return JSONResponse({"error": f"Invalid input data for ContentOptimizationRequest: {str(e)}"}, status_code=400)
+
+    if wants_stream(request, data):
+        return sse_response(optimize_content_stream_async(request_data))
+
+    try:
+        return JSONResponse(await optimize_content_async(request_data))
+    except (LLMOverloadedError, CircuitOpenError) as e:
+        return unavailable_response(e)
+    except Exception as e:
+        print(f"Error in /optimize-content: {str(e)}")
+        return JSONResponse({"error": f"API Error: {str(e)}"}, status_code=500)
+
+
+routes = [
+    Route("/ask/{corpus}", ask, methods=["POST"]),
+    *(Route(path, ask, methods=["POST"]) for path in LEGACY_CHAT_ROUTES),
+    Route("/generate-seo-keywords", generate_seo_keywords, methods=["POST"]),
+    Route("/rank-tracking", generate_rank_tracking, methods=["POST"]),
+    Route("/top-ranking", generate_top_ranking, methods=["GET", "POST"]),
+    Route("/optimize-content", optimize_content, methods=["POST"]),
+    # Mọi route khác do Flask app xử lý
+    Mount("/", app=WSGIMiddleware(flask_app)),
+]
+
+app = Starlette(routes=routes)
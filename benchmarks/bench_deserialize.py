@@ -0,0 +1,98 @@
+"""
+So sánh bộ deserialize đã biên dịch với cách làm đệ quy cũ trên audit lớn.
+
+    python benchmarks/bench_deserialize.py [--elements 5000] [--repeat 20]
+
+Chạy hoàn toàn cục bộ, không gọi Gemini hay backend.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deserialize import compile_converter, deserialize_to_dataclass, legacy_deserialize_to_dataclass
+from seo_advisor import AuditRequestModel, SEOAdvisorResponse
+
+
+def make_audit(elements: int) -> dict:
+    statuses = ["not pass", "warning", "opportunity"]
+    return {
+        "id": 1,
+        "user_id": 1,
+        "url": "https://example.com",
+        "overall_score": 72,
+        "critical_issue": elements // 3,
+        "warning": elements // 3,
+        "opportunity": elements // 3,
+        "passed_check": "12",
+        "failed_elements": [{
+            "id": i,
+            "url": f"https://example.com/page-{i % 250}",
+            "element": ["title", "meta_description", "h1", "img_alt"][i % 4],
+            "current_value": f"value {i}",
+            "status": statuses[i % 3],
+            "important": i % 5,
+            "description": f"Issue {i % 40}",
+            "audit_repost_id": None if i % 7 == 0 else 1,
+        } for i in range(elements)],
+    }
+
+
+def make_response(issues: int) -> dict:
+    def issue(i):
+        return {
+            "issue_type": f"Issue {i}",
+            "importance": "High",
+            "fix_steps": ["Step 1", "Step 2", "Step 3"],
+            "affected_urls": [f"https://example.com/page-{j}" for j in range(5)],
+            "example_error_detail": {"element": "title", "current_value": f"value {i}"},
+        }
+
+    return {
+        "summary": {"url": "https://example.com", "overall_score": 72, "critical_issues_count": issues,
+                    "warning_count": issues, "opportunity_count": issues},
+        "advice": {"critical_issues": [issue(i) for i in range(issues)],
+                   "warnings": [issue(i) for i in range(issues)],
+                   "opportunities": [issue(i) for i in range(issues)]},
+        "next_steps_message": "Fix the critical issues first.",
+    }
+
+
+def bench(label: str, func, cls, data: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(cls, data)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"{label:>28}: best of {repeat}: {best * 1000:8.2f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--elements", type=int, default=5000, help="Số failed_elements trong audit")
+    parser.add_argument("--issues", type=int, default=200, help="Số issue mỗi nhóm trong SEOAdvisorResponse")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # Lần biên dịch đầu tiên được đo riêng, các lần gọi sau dùng converter đã cache
+    started = time.perf_counter()
+    compile_converter(AuditRequestModel)
+    compile_converter(SEOAdvisorResponse)
+    print(f"{'compile (once)':>28}: {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+    for name, cls, data in (
+        (f"AuditRequestModel x{args.elements}", AuditRequestModel, make_audit(args.elements)),
+        (f"SEOAdvisorResponse x{args.issues * 3}", SEOAdvisorResponse, make_response(args.issues)),
+    ):
+        print(name)
+        legacy = bench("legacy (recursive)", legacy_deserialize_to_dataclass, cls, data, args.repeat)
+        compiled = bench("compiled", deserialize_to_dataclass, cls, data, args.repeat)
+        print(f"{'speedup':>28}: {legacy / compiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
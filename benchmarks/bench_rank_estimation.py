@@ -0,0 +1,101 @@
+"""
+So sánh thông lượng (keyword/giây) giữa hai backend ước lượng thứ hạng.
+
+    python benchmarks/bench_rank_estimation.py [--size 100000] [--gemini-size 200]
+
+Backend Gemini chỉ chạy khi có GEMINI_API_KEY; backend simulator chạy hoàn toàn cục bộ.
+Không gửi gì tới backend ngoài: đo bước ước lượng, và với simulator đo thêm cả đường
+đầy đủ của /update-rank-tracking (ước lượng + dựng các dòng kết quả, trừ outbox).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import model_registry
+from rank_simulator import make_rng, simulate_ranks
+from rank_tracking import RANK_ESTIMATORS, UpdateRankTrackingRequest, assemble_rank_rows
+
+
+def make_requests(size: int) -> list[UpdateRankTrackingRequest]:
+    # Trộn đủ các nhóm thứ hạng: chưa xếp hạng, top 20, 21-100, > 100
+    old_ranks = [0, 3, 15, 42, 87, 150, 900]
+    return [
+        UpdateRankTrackingRequest(input_keyword=f"keyword {i}", id=str(i), old_rank=old_ranks[i % len(old_ranks)])
+        for i in range(size)
+    ]
+
+
+def bench(name: str, size: int, repeat: int):
+    requests_list = make_requests(size)
+    estimator = RANK_ESTIMATORS[name]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results, _ = estimator(requests_list)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"{name:>10}: {size:>7} keywords, best of {repeat}: {best * 1000:10.1f} ms "
+          f"({size / best:,.0f} keywords/s, {len(results)} estimated)")
+
+
+def bench_full_path(name: str, size: int, repeat: int):
+    """Ước lượng + dựng dòng gửi backend và thứ hạng trả trong response, như update_rank_tracking."""
+    requests_list = make_requests(size)
+    estimator = RANK_ESTIMATORS[name]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results, _ = estimator(requests_list)
+        rows, _, _ = assemble_rank_rows(requests_list, results)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"{'full path':>10}: {size:>7} keywords, best of {repeat}: {best * 1000:10.1f} ms "
+          f"({size / best:,.0f} keywords/s, {len(rows)} rows)")
+
+
+def bench_vectorized(size: int, repeat: int):
+    """Chỉ đo phần tính toán trên mảng NumPy, không tính chi phí dựng object kết quả."""
+    old_ranks = np.array([item.old_rank for item in make_requests(size)], dtype=np.int64)
+    rng = make_rng(0)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        simulate_ranks(old_ranks, rng)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"{'numpy core':>10}: {size:>7} keywords, best of {repeat}: {best * 1000:10.1f} ms "
+          f"({size / best:,.0f} keywords/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000, help="Số keyword cho backend simulator")
+    parser.add_argument("--gemini-size", type=int, default=200, help="Số keyword cho backend Gemini")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_vectorized(args.size, args.repeat)
+    bench("simulator", args.size, args.repeat)
+    bench_full_path("simulator", args.size, args.repeat)
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("    gemini: skipped (GEMINI_API_KEY is not set)")
+        return
+    model_registry.configure(api_key)
+    bench("gemini", args.gemini_size, 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+import model_registry
+import resilience
+from answer_cache import AnswerCache
+from retrieval import BM25Index, build_index, select_context
+
+# Thư mục chứa tài liệu, mỗi file tu_lieu*.txt là một corpus:
+#   tu_lieu.txt -> "default", tu_lieu_hcm.txt -> "hcm", tu_lieu_vrn.txt -> "vrn"
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.dirname(os.path.abspath(__file__)))
+CORPUS_PREFIX = "tu_lieu"
+CORPUS_SUFFIX = ".txt"
+DEFAULT_CORPUS = "default"
+
+# Thời gian sống (giây) của context cache phía server; 0 để tắt
+CONTEXT_CACHE_TTL = int(os.getenv("CHAT_CONTEXT_CACHE_TTL", "3600"))
+# Sau khi tạo cache thất bại (ví dụ tài liệu quá ngắn), chờ bấy nhiêu giây mới thử lại
+CONTEXT_CACHE_RETRY_AFTER = 300
+# Nếu câu trả lời chưa về sau bấy nhiêu giây thì gửi thêm một request dự phòng (hedging); 0 để tắt
+CHAT_HEDGE_DELAY = float(os.getenv("CHAT_HEDGE_DELAY", "5"))
+
+SYSTEM_INSTRUCTION = (
+    'Bạn là một trợ lý AI. Nhiệm vụ của bạn là trả lời câu hỏi dựa duy nhất vào nội dung trong phần "Tài liệu tham khảo". '
+    "Nếu trong tài liệu không có thông tin để trả lời, hãy nói rõ: "
+    '"Tôi không tìm thấy thông tin trong tài liệu để trả lời câu hỏi này."'
+)
+
+
+class CorpusStore:
+    """
+    Kho tài liệu dùng chung, ánh xạ file vào bộ nhớ (mmap) ở lần đọc đầu tiên.
+    Các worker trên cùng máy dùng chung page cache thay vì mỗi module giữ một bản sao.
+    Khi file thay đổi (mtime/kích thước khác), file được ánh xạ lại và bản ánh xạ cũ được đóng.
+    """
+
+    def __init__(self):
+        # path -> (chữ ký, bản ánh xạ, nội dung đã decode của phiên bản này hoặc None)
+        self._maps: dict[str, tuple[tuple[int, int], mmap.mmap | bytes, str | None]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(path: str) -> tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _entry(self, path: str) -> tuple[tuple[int, int], mmap.mmap | bytes, str | None]:
+        signature = self.signature(path)
+        entry = self._maps.get(path)
+        if entry is None or entry[0] != signature:
+            with self._lock:
+                entry = self._maps.get(path)
+                if entry is None or entry[0] != signature:
+                    with open(path, "rb") as file:
+                        # mmap không ánh xạ được file rỗng
+                        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if signature[1] else b""
+                    if entry is not None:
+                        self._close(entry[1])
+                    entry = (signature, mapped, None)
+                    self._maps[path] = entry
+        return entry
+
+    @staticmethod
+    def _close(mapped: mmap.mmap | bytes):
+        if isinstance(mapped, mmap.mmap):
+            try:
+                mapped.close()
+            except BufferError:
+                # Vẫn còn memoryview trỏ vào bản cũ: mmap tự đóng khi view cuối cùng được giải phóng
+                pass
+
+    def read_bytes(self, path: str) -> memoryview:
+        """View chỉ đọc trên bản ánh xạ, không sao chép; giải phóng sớm (`with ... as view:`)."""
+        self._entry(path)
+        # Bản ánh xạ chỉ bị đóng (dưới lock) khi bị thay, nên bản đang nằm trong _maps luôn còn mở
+        with self._lock:
+            return memoryview(self._maps[path][1])
+
+    def read_text(self, path: str) -> str:
+        """Nội dung file, decode một lần cho mỗi phiên bản rồi dùng lại."""
+        text = self._entry(path)[2]
+        if text is None:
+            with self._lock:
+                signature, mapped, text = self._maps[path]
+                if text is None:
+                    text = str(mapped, "utf-8")
+                    self._maps[path] = (signature, mapped, text)
+        return text
+
+
+@dataclass
+class Corpus:
+    name: str
+    path: str
+    store: CorpusStore
+    _signature: tuple[int, int] | None = None
+    _version: str | None = None
+    _index: BM25Index | None = None
+
+    def _refresh(self):
+        signature = self.store.signature(self.path)
+        if signature != self._signature:
+            with self.store.read_bytes(self.path) as content:
+                self._version = hashlib.sha256(content).hexdigest()
+            self._index = None
+            self._signature = signature
+
+    @property
+    def version(self) -> str:
+        """Hash SHA-256 của nội dung file, thay đổi khi file .txt được sửa."""
+        self._refresh()
+        return self._version
+
+    @property
+    def text(self) -> str:
+        return self.store.read_text(self.path)
+
+    @property
+    def index(self) -> BM25Index:
+        # Chỉ dựng index khi corpus được hỏi lần đầu (hoặc sau khi file thay đổi)
+        self._refresh()
+        if self._index is None:
+            self._index = build_index(self.text)
+        return self._index
+
+
+class CorpusRegistry:
+    def __init__(self, directory: str = CORPUS_DIR, store: CorpusStore | None = None):
+        self.directory = directory
+        self.store = store or CorpusStore()
+        self._corpora: dict[str, Corpus] = {}
+        self._lock = threading.Lock()
+        self.discover()
+
+    @staticmethod
+    def corpus_name(filename: str) -> str:
+        stem = filename[:-len(CORPUS_SUFFIX)]
+        if stem == CORPUS_PREFIX:
+            return DEFAULT_CORPUS
+        return stem[len(CORPUS_PREFIX) + 1:]
+
+    def discover(self):
+        """Quét thư mục để tìm corpus. Chỉ liệt kê tên file, chưa đọc nội dung."""
+        found = {}
+        for entry in os.scandir(self.directory):
+            if (entry.is_file() and entry.name.startswith(CORPUS_PREFIX)
+                    and entry.name.endswith(CORPUS_SUFFIX)):
+                name = self.corpus_name(entry.name)
+                found[name] = self._corpora.get(name) or Corpus(name, entry.path, self.store)
+        with self._lock:
+            self._corpora = found
+
+    def names(self) -> list[str]:
+        return sorted(self._corpora)
+
+    def get(self, name: str) -> Corpus:
+        corpus = self._corpora.get(name)
+        if corpus is None:
+            raise KeyError(f"Unknown corpus: '{name}'")
+        return corpus
+
+
+registry = CorpusRegistry()
+
+
+class GeminiChatClient:
+    """Lớp bọc mỏng quanh Gemini, có thể thay bằng client giả khi kiểm thử."""
+
+    feature = "chat"
+
+    @property
+    def model_name(self) -> str:
+        return model_registry.model_name(self.feature)
+
+    def model(self):
+        return model_registry.get_model(self.feature)
+
+    def create_cached_context(self, display_name: str, document: str, ttl: int):
+        cached = model_registry.caching().CachedContent.create(
+            model=self.model_name,
+            display_name=display_name,
+            system_instruction=SYSTEM_INSTRUCTION,
+            contents=[f"--- Tài liệu tham khảo ---\n{document}\n---------------------------"],
+            ttl=timedelta(seconds=ttl),
+        )
+        return model_registry.from_cached_content(cached), cached
+
+    def delete_cached_context(self, cached):
+        cached.delete()
+
+    def generate(self, prompt: str, cached_model=None) -> str:
+        model = cached_model if cached_model is not None else self.model()
+
+        def attempt():
+            with model_registry.slot(self.feature, prompt):
+                return model.generate_content(prompt, request_options=model_registry.REQUEST_OPTIONS).text
+
+        return resilience.hedged(lambda: model_registry.call(self.feature, attempt), CHAT_HEDGE_DELAY)
+
+    def generate_stream(self, prompt: str, cached_model=None):
+        model = cached_model if cached_model is not None else self.model()
+        with model_registry.slot(self.feature, prompt):
+            response = model_registry.call(self.feature, lambda: model.generate_content(
+                prompt, stream=True, request_options=model_registry.REQUEST_OPTIONS))
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    async def generate_async(self, prompt: str, cached_model=None) -> str:
+        model = cached_model if cached_model is not None else self.model()
+
+        async def attempt():
+            async with model_registry.slot_async(self.feature, prompt):
+                response = await model.generate_content_async(prompt, request_options=model_registry.REQUEST_OPTIONS)
+            return response.text
+
+        return await resilience.hedged_async(lambda: model_registry.call_async(self.feature, attempt), CHAT_HEDGE_DELAY)
+
+    async def generate_stream_async(self, prompt: str, cached_model=None):
+        model = cached_model if cached_model is not None else self.model()
+        async with model_registry.slot_async(self.feature, prompt):
+            response = await model_registry.call_async(self.feature, lambda: model.generate_content_async(
+                prompt, stream=True, request_options=model_registry.REQUEST_OPTIONS))
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+
+@dataclass
+class CachedContext:
+    version: str
+    model: object
+    handle: object
+    expires_at: float
+
+
+class ContextCache:
+    """
+    Giữ tài liệu tham khảo (phần tĩnh của prompt) trong context cache phía server,
+    theo khóa là hash của file corpus. Khi file đổi nội dung, hash đổi nên cache
+    cũ bị bỏ và cache mới được tạo ở lần hỏi kế tiếp.
+    """
+
+    def __init__(self, client: GeminiChatClient, ttl: int = CONTEXT_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self._entries: dict[str, CachedContext] = {}
+        self._lock = threading.Lock()
+
+    def get(self, corpus: Corpus):
+        """Trả về model gắn với context cache của corpus, hoặc None nếu không dùng được cache."""
+        if self.ttl <= 0:
+            return None
+
+        version = corpus.version
+        entry = self._entries.get(corpus.name)
+        # Trừ hao một khoảng nhỏ để cache không hết hạn ngay giữa request
+        if entry is not None and entry.version == version and entry.expires_at > time.monotonic() + 30:
+            return entry.model
+
+        with self._lock:
+            entry = self._entries.get(corpus.name)
+            if entry is not None and entry.version == version and entry.expires_at > time.monotonic() + 30:
+                return entry.model
+
+            if entry is not None and entry.handle is not None:
+                try:
+                    self.client.delete_cached_context(entry.handle)
+                except Exception as e:
+                    print(f"Không xoá được context cache cũ của '{corpus.name}': {e}", file=sys.stderr)
+
+            try:
+                cached_model, handle = self.client.create_cached_context(
+                    f"{corpus.name}-{version[:16]}", corpus.text, self.ttl)
+                entry = CachedContext(version, cached_model, handle, time.monotonic() + self.ttl)
+            except Exception as e:
+                print(f"Không tạo được context cache cho '{corpus.name}', gửi tài liệu trực tiếp: {e}", file=sys.stderr)
+                entry = CachedContext(version, None, None, time.monotonic() + CONTEXT_CACHE_RETRY_AFTER)
+
+            self._entries[corpus.name] = entry
+            return entry.model
+
+
+client = GeminiChatClient()
+context_cache = ContextCache(client)
+answer_cache = AnswerCache()
+
+
+def build_prompt(reference_text: str | None, user_question: str) -> str:
+    if reference_text is None:
+        # Tài liệu đã nằm trong context cache, chỉ cần gửi câu hỏi
+        return f"Câu hỏi: {user_question}"
+
+    return f"""
+        {SYSTEM_INSTRUCTION}
+
+        --- Tài liệu tham khảo ---
+        {reference_text}
+        ---------------------------
+
+        Câu hỏi: {user_question}
+    """
+
+
+def prepare_prompt(corpus: Corpus, user_question: str):
+    """Trả về (prompt, model gắn context cache hoặc None)."""
+    reference_text = select_context(corpus.index, user_question)
+
+    cached_model = None
+    if reference_text is None:
+        # Cần toàn bộ tài liệu: dùng context cache nếu có, không thì gửi kèm như cũ
+        cached_model = context_cache.get(corpus)
+        if cached_model is None:
+            reference_text = corpus.text
+
+    return build_prompt(reference_text, user_question), cached_model
+
+
+def ask(corpus_name: str, user_question: str):
+    corpus = registry.get(corpus_name)
+    version = corpus.version
+
+    cached_answer = answer_cache.get(corpus_name, version, user_question)
+    if cached_answer is not None:
+        return {**cached_answer, "cached": True}
+
+    prompt, cached_model = prepare_prompt(corpus, user_question)
+    answer = {"answer": client.generate(prompt, cached_model)}
+    answer_cache.put(corpus_name, version, user_question, answer)
+    return {**answer, "cached": False}
+
+
+def ask_stream(corpus_name: str, user_question: str):
+    """
+    Giống ask() nhưng trả về từng đoạn văn bản ngay khi Gemini sinh ra.
+    Phần tử cuối cùng là dict kết quả đầy đủ (kèm cờ "cached").
+    """
+    corpus = registry.get(corpus_name)
+    version = corpus.version
+
+    cached_answer = answer_cache.get(corpus_name, version, user_question)
+    if cached_answer is not None:
+        yield cached_answer["answer"]
+        yield {**cached_answer, "cached": True}
+        return
+
+    prompt, cached_model = prepare_prompt(corpus, user_question)
+    parts = []
+    for text in client.generate_stream(prompt, cached_model):
+        parts.append(text)
+        yield text
+
+    answer = {"answer": "".join(parts)}
+    answer_cache.put(corpus_name, version, user_question, answer)
+    yield {**answer, "cached": False}
+
+
+async def ask_async(corpus_name: str, user_question: str):
+    corpus = registry.get(corpus_name)
+    version = corpus.version
+
+    cached_answer = answer_cache.get(corpus_name, version, user_question)
+    if cached_answer is not None:
+        return {**cached_answer, "cached": True}
+
+    # Dựng index / tạo context cache có thể chặn, nên chạy trong thread riêng
+    prompt, cached_model = await asyncio.to_thread(prepare_prompt, corpus, user_question)
+    answer = {"answer": await client.generate_async(prompt, cached_model)}
+    answer_cache.put(corpus_name, version, user_question, answer)
+    return {**answer, "cached": False}
+
+
+async def ask_stream_async(corpus_name: str, user_question: str):
+    corpus = registry.get(corpus_name)
+    version = corpus.version
+
+    cached_answer = answer_cache.get(corpus_name, version, user_question)
+    if cached_answer is not None:
+        yield cached_answer["answer"]
+        yield {**cached_answer, "cached": True}
+        return
+
+    prompt, cached_model = await asyncio.to_thread(prepare_prompt, corpus, user_question)
+    parts = []
+    async for text in client.generate_stream_async(prompt, cached_model):
+        parts.append(text)
+        yield text
+
+    answer = {"answer": "".join(parts)}
+    answer_cache.put(corpus_name, version, user_question, answer)
+    yield {**answer, "cached": False}
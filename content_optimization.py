@@ -1,9 +1,14 @@
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+import asyncio
 import json
 import requests
 from pydantic import BaseModel
 from typing import Optional
-import google.generativeai as genai
+
+import model_registry
+import outbox
+from http_client import backend_request
+from response_schema import json_config
 from datetime import datetime, timezone
 import urllib3
 
@@ -17,8 +22,8 @@ import urllib3
 # Localhost API
 EXTERNAL_API_URL = "https://localhost:7144/api/ContentOptimizations"
 
-# Gemini model setup
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Gemini model setup (model cụ thể lấy từ model_registry)
+FEATURE = "content_optimization"
 
 
 @dataclass
@@ -35,14 +40,18 @@ class ContentOptimizationRequest:
 
 @dataclass
 class ContentOptimizationResponse:
-    optimized_content: str
-    seo_score: int
-    readability: int
-    engagement: int
-    originality: int
-
-
-def optimize_content(request: ContentOptimizationRequest):
+    optimized_content: str = field(metadata={"description": "The fully rewritten and optimized content."})
+    seo_score: int = field(metadata={
+        "description": "How well the content is optimized for the keyword and general SEO practices (0-100)."})
+    readability: int = field(metadata={
+        "description": "Ease of understanding for the desired readability level (0-100)."})
+    engagement: int = field(metadata={
+        "description": "How likely users are to interact with the content, e.g. time on page, clicks (0-100)."})
+    originality: int = field(metadata={
+        "description": "Uniqueness of the content's perspective compared to common online content on the topic (0-100)."})
+
+
+def build_prompt(request: ContentOptimizationRequest) -> str:
     # Chuyển đổi đối tượng ContentOptimizationRequest thành dict để dễ dàng đưa vào prompt
     request_as_dict = asdict(request)
 
@@ -69,33 +78,29 @@ def optimize_content(request: ContentOptimizationRequest):
         f"  - Level 4 (Expert): Comprehensive keyword strategy, advanced semantic SEO, user intent optimization, competitive analysis implied.\n"
         f"  - Level 5 (Aggressive): Very strong focus on keyword density (while maintaining readability), highly competitive LSI/topic coverage, potentially controversial or highly opinionated if aligns with original content and keyword strategy.\n\n"
         f"For 'Readability Level', adjust vocabulary, sentence structure, and paragraph length accordingly.\n\n"
-        f"**Your response must be in strict JSON format**, as a single object, with the following fields:\n"
-        f"- `optimized_content` (string): The fully rewritten and optimized content.\n"
-        f"- `seo_score` (integer): An estimated SEO score from 0-100, reflecting how well the content is optimized for the keyword and general SEO practices.\n"
-        f"- `readability_score` (integer): An estimated readability score from 0-100, reflecting the ease of understanding for the desired readability level.\n"
-        f"- `engagement_score` (integer): An estimated engagement score from 0-100, reflecting how likely users are to interact with the content (e.g., time on page, clicks).\n"
-        f"- `originality_score` (integer): An estimated originality score from 0-100, reflecting the uniqueness and freshness of the content's perspective or approach compared to common online content on the topic."
+        f"All scores are estimates from 0-100."
     )
+    return prompt
+
 
-    # --- Điều chỉnh gemini_response_schema để khớp với ContentOptimizationResponse ---
-    gemini_response_schema = {
-        "type": "OBJECT",  # <-- Thay đổi thành OBJECT vì bạn muốn 1 đối tượng duy nhất
-        "properties": {
-            "optimized_content": {"type": "STRING"},
-            "seo_score": {"type": "INTEGER"},
-            "readability": {"type": "INTEGER"},
-            "engagement": {"type": "INTEGER"},
-            "originality": {"type": "INTEGER"}
-        },
-        "required": ["optimized_content", "seo_score", "readability", "engagement", "originality"]
+generation_config = json_config(ContentOptimizationResponse)
+
+
+def build_result(my_optimized_content: ContentOptimizationResponse, external_api_status: dict) -> dict:
+    # Backend được ghi ở nền (outbox) nên kết quả Gemini được trả luôn trong response,
+    # client không phải đọc lại từ backend (có thể chưa kịp cập nhật)
+    return {
+        "message": "Content optimized and queued for the external API.",
+        **asdict(my_optimized_content),
+        "external_api_status": external_api_status
     }
 
-    gemini_response = model.generate_content(
-        contents=prompt,
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": gemini_response_schema,
-        },
+
+def optimize_content(request: ContentOptimizationRequest):
+    gemini_response = model_registry.generate_content(
+        FEATURE,
+        contents=build_prompt(request),
+        generation_config=generation_config,
     )
 
     # Đổi tên biến cho rõ ràng hơn
@@ -103,16 +108,72 @@ def optimize_content(request: ContentOptimizationRequest):
     my_optimized_content: ContentOptimizationResponse = ContentOptimizationResponse(
         **raw_response_data)
 
-    external_api_results = []
+    return build_result(my_optimized_content, send_optimized_content(request, my_optimized_content))
+
+
+def optimize_content_stream(request: ContentOptimizationRequest):
+    """
+    Phiên bản streaming: trả về từng đoạn JSON thô ngay khi Gemini sinh ra,
+    phần tử cuối cùng là dict chứa điểm số đã parse và trạng thái gửi API ngoài.
+    """
+    gemini_response = model_registry.stream_content(
+        FEATURE,
+        contents=build_prompt(request),
+        generation_config=generation_config,
+    )
+
+    parts = []
+    for chunk in gemini_response:
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
 
+    my_optimized_content = ContentOptimizationResponse(**json.loads("".join(parts)))
+
+    yield build_result(my_optimized_content, send_optimized_content(request, my_optimized_content))
+
+
+async def optimize_content_async(request: ContentOptimizationRequest):
+    gemini_response = await model_registry.generate_content_async(
+        FEATURE,
+        contents=build_prompt(request),
+        generation_config=generation_config,
+    )
+
+    my_optimized_content = ContentOptimizationResponse(**json.loads(gemini_response.text))
+
+    return build_result(
+        my_optimized_content, await asyncio.to_thread(send_optimized_content, request, my_optimized_content))
+
+
+async def optimize_content_stream_async(request: ContentOptimizationRequest):
+    gemini_response = model_registry.stream_content_async(
+        FEATURE,
+        contents=build_prompt(request),
+        generation_config=generation_config,
+    )
+
+    parts = []
+    async for chunk in gemini_response:
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
+
+    my_optimized_content = ContentOptimizationResponse(**json.loads("".join(parts)))
+
+    yield build_result(
+        my_optimized_content, await asyncio.to_thread(send_optimized_content, request, my_optimized_content))
+
+
+def build_payload(request: ContentOptimizationRequest, my_optimized_content: ContentOptimizationResponse) -> dict:
     utc_now = datetime.now(timezone.utc)
     formatted = utc_now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
 
     # Payload cho API ngoài
-    payload = {
+    return {
         "id": request.id,
         "userId": request.user_id,
-        "model": "gemini-2.5-flash",
+        "model": model_registry.model_name(FEATURE),
         "keyword": request.keyword,
         "originalContent": request.content,
         "contentLenght": request.content_length,
@@ -127,26 +188,23 @@ def optimize_content(request: ContentOptimizationRequest):
         "createdAt": formatted
     }
 
+
+def put_optimized_content(payload: dict) -> str | None:
+    """Gửi kết quả tối ưu sang backend; trả về None nếu thành công, ngược lại là thông báo lỗi."""
     try:
-        api_response = requests.put(EXTERNAL_API_URL, json=payload, verify=False)
+        api_response = backend_request("PUT", EXTERNAL_API_URL, json=payload, verify=False)
         if api_response.ok:
-            status = "success"
-            message = f"Status Code: {api_response.status_code}"
-        else:
-            status = "failure"
-            message = f"Status Code: {api_response.status_code}, Error: {api_response.text}"
+            return None
+        return f"Status Code: {api_response.status_code}, Error: {api_response.text}"
     except requests.exceptions.RequestException as req_err:
-        status = "failure"
-        message = f"Network/Connection Error: {req_err}"
+        return f"Network/Connection Error: {req_err}"
     except Exception as api_exc:
-        status = "failure"
-        message = f"Unexpected Error: {api_exc}"
+        return f"Unexpected Error: {api_exc}"
 
-    external_api_results.append({
-        "status": status,
-        "message": message
-    })
-    return {
-        "message": "Keywords generated and sent successfully.",
-        "external_api_status": external_api_results
-    }
+
+outbox.register_handler(FEATURE, lambda payloads: [put_optimized_content(payload) for payload in payloads])
+
+
+def send_optimized_content(request: ContentOptimizationRequest, my_optimized_content: ContentOptimizationResponse):
+    """Ghi kết quả vào outbox; thread nền sẽ gửi sang backend."""
+    return outbox.enqueue(FEATURE, [build_payload(request, my_optimized_content)], labels=[request.id])
@@ -1,16 +1,305 @@
-# --- Hàm tiện ích chung để deserialize dictionary thành dataclass (GIỮ NGUYÊN) ---
-from dataclasses import field
+# --- Hàm tiện ích chung để deserialize dictionary thành dataclass ---
+"""
+Bộ chuyển đổi dict -> dataclass được "biên dịch" một lần cho mỗi kiểu rồi dùng lại.
+
+compile_converter(tp) duyệt annotation của kiểu (dataclass lồng nhau, `X | None`,
+Optional[X], list[X], dict[K, V], Literal[...], kiểu nguyên thuỷ) và dựng sẵn một hàm chuyển đổi
+chuyên biệt, được cache theo kiểu. Lỗi dữ liệu được báo kèm đường dẫn tới trường
+bị lỗi, ví dụ: "failed_elements[3].important: expected int, got dict".
+
+Khác cách làm cũ (giữ nguyên mọi giá trị lá), giá trị lá được kiểm tra kiểu:
+- số trong trường str được đổi thành chuỗi ("42"), chuỗi số trong trường int/float được
+  đổi thành số, nên các payload số/chuỗi số mà bản cũ nhận vẫn được nhận;
+- bị từ chối: object/list ở trường nguyên thuỷ, chuỗi không phải số ở trường int/float,
+  true/false ở trường số, giá trị không phải bool ở trường bool, giá trị ngoài Literal,
+  null ở trường không phải Optional.
+"""
+import threading
+import types
+import typing
+from dataclasses import MISSING, field, fields, is_dataclass
+
+_NoneType = type(None)
+
+
+class DeserializationError(ValueError):
+    """
+    Lỗi dữ liệu kèm đường dẫn tới trường bị lỗi. Đường dẫn được ghép dần từ trong ra ngoài
+    khi lỗi đi qua các converter cha, nên đường chạy bình thường không tốn chi phí dựng chuỗi.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        self.segments: list[str] = []
+        super().__init__(message)
+
+    def prefixed(self, segment: str) -> "DeserializationError":
+        self.segments.append(segment)
+        return self
+
+    @property
+    def path(self) -> str:
+        path = ""
+        for segment in reversed(self.segments):
+            path += segment if segment.startswith("[") or not path else f".{segment}"
+        return path
+
+    def __str__(self):
+        return f"{self.path or '<root>'}: {self.message}"
+
+
+def _describe(tp) -> str:
+    return getattr(tp, "__name__", None) or str(tp)
+
+
+def _identity(value):
+    return value
+
+
+def _primitive(tp):
+    name = tp.__name__
+
+    if tp is float:
+        def convert(value):
+            # JSON không phân biệt 1 và 1.0
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+            if isinstance(value, str):
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+            raise DeserializationError(f"expected float, got {type(value).__name__}")
+    elif tp is int:
+        def convert(value):
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+            if isinstance(value, str):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+            raise DeserializationError(f"expected int, got {type(value).__name__}")
+    elif tp is str:
+        def convert(value):
+            if isinstance(value, str):
+                return value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return str(value)
+            raise DeserializationError(f"expected str, got {type(value).__name__}")
+    else:
+        def convert(value):
+            if isinstance(value, tp):
+                return value
+            raise DeserializationError(f"expected {name}, got {type(value).__name__}")
+    return convert
+
+
+def _literal(values):
+    allowed = frozenset(values)
+
+    def convert(value):
+        if value in allowed:
+            return value
+        raise DeserializationError(f"expected one of {sorted(map(str, values))}, got {value!r}")
+    return convert
+
+
+def _optional(inner):
+    def convert(value):
+        if value is None:
+            return None
+        return inner(value)
+    return convert
+
+
+def _union(options, description):
+    def convert(value):
+        for option in options:
+            try:
+                return option(value)
+            except DeserializationError:
+                continue
+        raise DeserializationError(f"expected {description}, got {type(value).__name__}")
+    return convert
+
+
+def _list(item):
+    def check(value):
+        if not isinstance(value, list):
+            raise DeserializationError(f"expected list, got {type(value).__name__}")
+
+    if item is _identity:
+        def convert(value):
+            check(value)
+            return value
+        return convert
+
+    def convert(value):
+        check(value)
+        try:
+            return [item(element) for element in value]
+        except DeserializationError as e:
+            # Chỉ khi có lỗi mới tìm lại vị trí phần tử hỏng để ghi vào đường dẫn
+            for index, element in enumerate(value):
+                try:
+                    item(element)
+                except DeserializationError:
+                    raise e.prefixed(f"[{index}]")
+            raise
+    return convert
+
+
+def _dict(key, item):
+    def check(value):
+        if not isinstance(value, dict):
+            raise DeserializationError(f"expected dict, got {type(value).__name__}")
+
+    if key is _identity and item is _identity:
+        def convert(value):
+            check(value)
+            return value
+        return convert
+
+    def convert(value):
+        check(value)
+        result = {}
+        for k, v in value.items():
+            try:
+                result[key(k)] = item(v)
+            except DeserializationError as e:
+                raise e.prefixed(str(k))
+        return result
+    return convert
+
+
+def _dataclass(cls):
+    specs = []
+
+    def convert(value):
+        if not isinstance(value, dict):
+            raise DeserializationError(f"expected object for {cls.__name__}, got {type(value).__name__}")
+        init_args = {}
+        for name, converter, default, default_factory in specs:
+            if name in value:
+                try:
+                    init_args[name] = converter(value[name])
+                except DeserializationError as e:
+                    raise e.prefixed(name)
+            elif default is not MISSING:
+                init_args[name] = default
+            elif default_factory is not MISSING:
+                init_args[name] = default_factory()
+            else:
+                raise DeserializationError(f"missing required field for {cls.__name__}").prefixed(name)
+        return cls(**init_args)
+
+    # Dataclass đệ quy: converter (chưa đủ specs) chỉ được đặt vào _staged, nơi chỉ thread
+    # đang giữ _compile_lock nhìn thấy; nó được công bố khi lần biên dịch ngoài cùng xong
+    _staged[cls] = convert
+    _fill_specs(cls, specs)
+    return convert
+
+
+def _fill_specs(cls, specs: list):
+    hints = typing.get_type_hints(cls)
+    for f in fields(cls):
+        if not f.init:
+            continue
+        tp = hints.get(f.name, f.type)
+        default, default_factory = f.default, f.default_factory
+        # Trường Optional không có giá trị mặc định được phép vắng mặt (coi như None)
+        if default is MISSING and default_factory is MISSING and _is_optional(tp):
+            default = None
+        specs.append((f.name, compile_converter(tp), default, default_factory))
+
+
+def _is_optional(tp) -> bool:
+    origin = typing.get_origin(tp)
+    return (origin is typing.Union or origin is types.UnionType) and _NoneType in typing.get_args(tp)
+
+
+# Chỉ chứa converter đã dựng xong hoàn toàn; đọc không cần khóa
+_converters: dict = {}
+# Converter của lần biên dịch đang diễn ra (kể cả dataclass đang dựng dở); chỉ dùng dưới
+# _compile_lock và chỉ được chuyển sang _converters khi lần biên dịch ngoài cùng thành công
+_staged: dict = {}
+_compile_depth = 0
+_compile_lock = threading.RLock()
+
+
+def compile_converter(tp):
+    """Trả về hàm convert(value) cho kiểu `tp`, dựng một lần rồi cache."""
+    converter = _converters.get(tp)
+    if converter is not None:
+        return converter
+
+    global _compile_depth
+    with _compile_lock:
+        converter = _converters.get(tp) or _staged.get(tp)
+        if converter is not None:
+            return converter
+
+        _compile_depth += 1
+        completed = False
+        try:
+            converter = _staged[tp] = _build(tp)
+            completed = True
+        finally:
+            _compile_depth -= 1
+            if _compile_depth == 0:
+                if completed:
+                    _converters.update(_staged)
+                _staged.clear()
+        return converter
+
+
+def _build(tp):
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+
+    if is_dataclass(tp) and isinstance(tp, type):
+        return _dataclass(tp)
+
+    if tp is typing.Any or tp is object:
+        converter = _identity
+    elif origin is typing.Union or origin is types.UnionType:
+        options = [arg for arg in args if arg is not _NoneType]
+        inner = compile_converter(options[0]) if len(options) == 1 else _union(
+            [compile_converter(option) for option in options], " | ".join(_describe(option) for option in options))
+        converter = _optional(inner) if len(options) < len(args) else inner
+    elif origin is typing.Literal:
+        converter = _literal(args)
+    elif tp is list or origin is list:
+        converter = _list(compile_converter(args[0]) if args else _identity)
+    elif tp is dict or origin is dict:
+        converter = _dict(*(compile_converter(arg) for arg in args)) if args else _dict(_identity, _identity)
+    elif tp in (str, int, float, bool):
+        converter = _primitive(tp)
+    else:
+        converter = _identity
+    return converter
+
 
 def deserialize_to_dataclass(cls, data_dict):
     """
-    Recursively deserializes a dictionary into a dataclass instance,
-    handling nested dataclasses and lists of dataclasses.
+    Deserializes a dictionary into a dataclass instance (nested dataclasses, lists,
+    dicts and optional fields included) using the cached converter for `cls`.
+    Raises DeserializationError (a ValueError) with the path of the offending field.
+    """
+    return compile_converter(cls)(data_dict)
+
+
+def legacy_deserialize_to_dataclass(cls, data_dict):
+    """
+    Cách làm cũ (duyệt lại annotation ở mỗi lần gọi), chỉ còn được giữ để so sánh
+    trong benchmarks/bench_deserialize.py.
     """
     if not isinstance(data_dict, dict):
         raise TypeError(f"Expected dictionary for dataclass {cls.__name__}, got {type(data_dict)}")
 
     dataclass_fields = {f.name: f for f in cls.__dataclass_fields__.values()}
-    
+
     init_args = {}
     for field_name, field_def in dataclass_fields.items():
         if field_name not in data_dict:
@@ -40,12 +329,12 @@ def deserialize_to_dataclass(cls, data_dict):
         if hasattr(actual_type, '__origin__') and actual_type.__origin__ is list:
             item_type = actual_type.__args__[0]
             if hasattr(item_type, '__dataclass_fields__'):
-                init_args[field_name] = [deserialize_to_dataclass(item_type, item_data) for item_data in value]
+                init_args[field_name] = [legacy_deserialize_to_dataclass(item_type, item_data) for item_data in value]
             else:
                 init_args[field_name] = value
         elif hasattr(actual_type, '__dataclass_fields__'):
-            init_args[field_name] = deserialize_to_dataclass(actual_type, value)
+            init_args[field_name] = legacy_deserialize_to_dataclass(actual_type, value)
         else:
             init_args[field_name] = value
 
-    return cls(**init_args)
\ No newline at end of file
+    return cls(**init_args)
@@ -0,0 +1,19 @@
+# Cấu hình production: gunicorn quản lý tiến trình, uvicorn chạy ASGI app trong asgi.py.
+# Chạy bằng lệnh: gunicorn   (gunicorn tự đọc file gunicorn.conf.py trong thư mục hiện tại)
+import os
+
+wsgi_app = "asgi:app"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Mỗi worker là một event loop giữ được hàng trăm request đang chờ Gemini/backend,
+# nên chỉ cần ít worker (thường bằng số CPU)
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+# Câu trả lời dài của Gemini có thể mất vài chục giây
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,64 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import resilience
+
+# Giới hạn kết nối tới backend dùng chung cho cả tiến trình
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "100"))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "15"))
+BACKEND_VERIFY_TLS = os.getenv("BACKEND_VERIFY_TLS", "true").lower() not in ("0", "false", "no")
+# Số request tới backend được gửi song song trong một lần fan-out (đường Flask)
+BACKEND_FANOUT_WORKERS = int(os.getenv("BACKEND_FANOUT_WORKERS", "10"))
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+# Các method được phép tự động thử lại (gửi lại không làm thay đổi kết quả)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_executor = ThreadPoolExecutor(max_workers=BACKEND_FANOUT_WORKERS, thread_name_prefix="backend-fanout")
+
+
+def get_session() -> requests.Session:
+    """
+    Session requests dùng chung: giữ kết nối keep-alive tới backend thay vì
+    mở kết nối TLS mới cho mỗi request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.verify = BACKEND_VERIFY_TLS
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BACKEND_MAX_CONNECTIONS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def upstream_name(url: str) -> str:
+    """Mỗi host backend có circuit breaker riêng."""
+    return f"backend:{urlsplit(url).netloc}"
+
+
+def backend_request(method: str, url: str, idempotent: bool | None = None, **kwargs) -> requests.Response:
+    """
+    Gửi request tới backend qua session dùng chung, luôn có timeout, đi qua circuit
+    breaker của host và thử lại lỗi tạm thời nếu method idempotent
+    (hoặc khi caller khẳng định idempotent=True, ví dụ PATCH ghi giá trị tuyệt đối).
+    """
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    kwargs.setdefault("timeout", BACKEND_TIMEOUT)
+    return resilience.call(upstream_name(url), lambda: get_session().request(method, url, **kwargs),
+                           idempotent=idempotent)
+
+
+def fan_out(func, items) -> list:
+    """Gọi func cho từng phần tử trên thread pool dùng chung, giữ nguyên thứ tự kết quả."""
+    return list(_executor.map(func, items))
@@ -0,0 +1,86 @@
+"""
+Cache bền vững (SQLite) cho kết quả nghiên cứu keyword.
+
+Khóa là (seed keyword đã chuẩn hoá, model). Mỗi mục có hạn dùng riêng
+(KEYWORD_CACHE_TTL); khi số mục vượt KEYWORD_CACHE_MAX_ENTRIES, các mục lâu
+không được dùng nhất bị xoá (LRU). File cache sống qua các lần khởi động lại
+và được dùng chung giữa các worker.
+"""
+import json
+import os
+import time
+import unicodedata
+
+import metrics
+from sqlite_store import SQLiteStore
+
+KEYWORD_CACHE_DB = os.getenv(
+    "KEYWORD_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyword_cache.sqlite3"))
+KEYWORD_CACHE_TTL = int(os.getenv("KEYWORD_CACHE_TTL", "604800"))
+KEYWORD_CACHE_MAX_ENTRIES = int(os.getenv("KEYWORD_CACHE_MAX_ENTRIES", "10000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keyword_cache (
+    seed TEXT NOT NULL,
+    model TEXT NOT NULL,
+    keywords TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (seed, model)
+);
+CREATE INDEX IF NOT EXISTS keyword_cache_lru ON keyword_cache (last_used_at);
+"""
+
+_store = SQLiteStore(KEYWORD_CACHE_DB, SCHEMA)
+
+
+def normalize_seed(seed: str) -> str:
+    """'  SEO   Tools ' -> 'seo tools'. Giữ nguyên dấu: 'bán hàng' và 'bàn hàng' là hai keyword khác nhau."""
+    return " ".join(unicodedata.normalize("NFC", seed).lower().split())
+
+
+def get(seed: str, model: str) -> list[dict] | None:
+    if KEYWORD_CACHE_MAX_ENTRIES <= 0:
+        return None
+
+    now = time.time()
+    key = (normalize_seed(seed), model)
+    conn = _store.connect()
+    row = conn.execute(
+        "SELECT keywords FROM keyword_cache WHERE seed = ? AND model = ? AND expires_at > ?", (*key, now)).fetchone()
+    if row is None:
+        metrics.incr("keyword_cache_misses")
+        return None
+
+    conn.execute("UPDATE keyword_cache SET last_used_at = ? WHERE seed = ? AND model = ?", (now, *key))
+    metrics.incr("keyword_cache_hits")
+    return json.loads(row["keywords"])
+
+
+def put(seed: str, model: str, keywords: list[dict], ttl: int = KEYWORD_CACHE_TTL):
+    if KEYWORD_CACHE_MAX_ENTRIES <= 0:
+        return
+
+    now = time.time()
+    conn = _store.connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO keyword_cache (seed, model, keywords, created_at, expires_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (normalize_seed(seed), model, json.dumps(keywords, ensure_ascii=False), now, now + ttl, now))
+        conn.execute("DELETE FROM keyword_cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM keyword_cache WHERE rowid IN ("
+            "SELECT rowid FROM keyword_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (KEYWORD_CACHE_MAX_ENTRIES,))
+
+
+def hit_rate() -> float:
+    hits = metrics.get("keyword_cache_hits")
+    total = hits + metrics.get("keyword_cache_misses")
+    return round(hits / total, 4) if total else 0.0
+
+
+metrics.register_gauge("keyword_cache_hit_rate", hit_rate)
@@ -1,8 +1,16 @@
+import asyncio
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from pydantic import BaseModel
 from typing import Optional
-import google.generativeai as genai
+
+import keyword_cache
+import model_registry
+import outbox
+from http_client import BACKEND_TIMEOUT, backend_request, fan_out
+from response_schema import json_config
 
 # External API
 EXTERNAL_API_URL = "https://seoboostaiapi-e2bycxbjc4fmgggz.southeastasia-01.azurewebsites.net/api/Keywords"
@@ -10,8 +18,15 @@ EXTERNAL_API_URL = "https://seoboostaiapi-e2bycxbjc4fmgggz.southeastasia-01.azur
 # Localhost API
 # EXTERNAL_API_URL = "https://localhost:7144/api/Keywords"
 
-# Gemini model setup
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Gemini model setup (model cụ thể lấy từ model_registry)
+FEATURE = "keywords"
+
+# Endpoint batch: số seed gộp chung một prompt, số prompt chạy song song, số seed tối đa mỗi request
+KEYWORD_BATCH_SEEDS_PER_PROMPT = int(os.getenv("KEYWORD_BATCH_SEEDS_PER_PROMPT", "5"))
+KEYWORD_BATCH_PARALLELISM = int(os.getenv("KEYWORD_BATCH_PARALLELISM", "4"))
+KEYWORD_BATCH_MAX_SEEDS = int(os.getenv("KEYWORD_BATCH_MAX_SEEDS", "500"))
+
+_batch_executor = ThreadPoolExecutor(max_workers=KEYWORD_BATCH_PARALLELISM, thread_name_prefix="keyword-batch")
 
 # Pydantic model
 class Keyword(BaseModel):
@@ -24,82 +39,221 @@ class Keyword(BaseModel):
     trending: bool
     rank: int
 
-# Generate keywords and call external API
-def generate_and_send_keywords(input_keyword: str):
-    prompt = (
+# Nhiều seed trong một prompt: mỗi seed một object kèm danh sách keyword của nó
+class SeedKeywords(BaseModel):
+    seed: str
+    keywords: list[Keyword]
+
+generation_config = json_config(list[Keyword])
+batch_generation_config = json_config(list[SeedKeywords])
+
+
+def build_prompt(input_keyword: str) -> str:
+    return (
         f"List 10 keywords related to '{input_keyword}' with search volume, difficulty, CPC, "
-        "competition, intent, trending status and rank. Ensure all requested fields are always present. "
+        "competition, intent, trending status and rank. "
         "Provide realistic but synthetic data for all fields."
     )
 
-    gemini_response_schema = {
-        "type": "ARRAY",
-        "items": {
-            "type": "OBJECT",
-            "properties": {
-                "keyword_name": {"type": "STRING"},
-                "searchVolume": {"type": "INTEGER"},
-                "difficulty": {"type": "INTEGER"},
-                "cpc": {"type": "NUMBER"},
-                "competition": {"type": "STRING"},
-                "intent": {"type": "STRING"},
-                "trending": {"type": "BOOLEAN"},
-                "rank": {"type": "INTEGER"}
-            },
-            "required": ["keyword_name", "searchVolume", "difficulty", "cpc", "competition", "intent", "trending", "rank"]
-        }
+
+def build_batch_prompt(seeds: list[str]) -> str:
+    return (
+        f"For each seed keyword in this JSON list: {json.dumps(seeds, ensure_ascii=False)}, "
+        "list 10 keywords related to it with search volume, difficulty, CPC, competition, intent, "
+        "trending status and rank. Return one object per seed with 'seed' copied exactly from the list. "
+        "Provide realistic but synthetic data for all fields."
+    )
+
+
+def parse_keywords(response_text: str) -> list[Keyword]:
+    raw_keywords_data = json.loads(response_text)
+    return [Keyword(**item) for item in raw_keywords_data]
+
+
+def build_payload(input_keyword: str, keyword: Keyword) -> dict:
+    return {
+        "searchKeyword": input_keyword,
+        "keyword1": keyword.keyword_name,
+        "model": model_registry.model_name(FEATURE),
+        "searchVolume": keyword.searchVolume,
+        "difficulty": keyword.difficulty if keyword.difficulty is not None else 0,
+        "cpc": keyword.cpc if keyword.cpc is not None else 0.0,
+        "competition": keyword.competition if keyword.competition is not None else "N/A",
+        "intent": keyword.intent if keyword.intent is not None else "N/A",
+        "trend": "True" if keyword.trending else "False",
+        "rank": keyword.rank if keyword.rank is not None else 0
     }
 
-    gemini_response = model.generate_content(
-        contents=prompt,
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": gemini_response_schema,
-        },
+
+# Keyword lấy từ cache đã được gửi sang backend ở lần nghiên cứu trước, không gửi lại
+CACHED_STATUS = {"status": "cached", "message": "Keywords served from cache; already sent to the external API."}
+
+
+def build_result(my_keywords: list[Keyword], external_api_status: dict) -> dict:
+    cached = external_api_status is CACHED_STATUS
+    return {
+        "message": "Keywords served from cache." if cached else "Keywords generated and queued for the external API.",
+        "generated_keywords_count": len(my_keywords),
+        "cached": cached,
+        "external_api_status": external_api_status
+    }
+
+
+def post_keyword(payload: dict) -> str | None:
+    """Gửi một keyword sang backend; trả về None nếu thành công, ngược lại là thông báo lỗi."""
+    try:
+        api_response = backend_request("POST", EXTERNAL_API_URL, json=payload)
+        if api_response.ok:
+            return None
+        return f"Status Code: {api_response.status_code}, Error: {api_response.text}"
+    except requests.exceptions.Timeout as timeout_err:
+        return f"Timeout after {BACKEND_TIMEOUT}s: {timeout_err}"
+    except requests.exceptions.RequestException as req_err:
+        return f"Network/Connection Error: {req_err}"
+    except Exception as api_exc:
+        return f"Unexpected Error: {api_exc}"
+
+
+def deliver_keywords(payloads: list[dict]) -> list[str | None]:
+    # Gửi các keyword song song qua connection pool dùng chung
+    return fan_out(post_keyword, payloads)
+
+
+outbox.register_handler(FEATURE, deliver_keywords)
+
+
+def queue_keywords(input_keyword: str, my_keywords: list[Keyword]) -> dict:
+    """Ghi các keyword vào outbox; thread nền sẽ gửi sang backend."""
+    return outbox.enqueue(FEATURE, [build_payload(input_keyword, keyword) for keyword in my_keywords],
+                          labels=[keyword.keyword_name for keyword in my_keywords])
+
+
+def cached_keywords(input_keyword: str) -> list[Keyword] | None:
+    cached = keyword_cache.get(input_keyword, model_registry.model_name(FEATURE))
+    return None if cached is None else [Keyword(**item) for item in cached]
+
+
+def store_and_queue(input_keyword: str, my_keywords: list[Keyword]) -> dict:
+    keyword_cache.put(input_keyword, model_registry.model_name(FEATURE), [keyword.model_dump() for keyword in my_keywords])
+    return queue_keywords(input_keyword, my_keywords)
+
+
+def research_keywords(input_keyword: str) -> tuple[list[Keyword], dict]:
+    """
+    Trả về (keywords, trạng thái gửi backend). Ưu tiên keyword cache; khi phải gọi Gemini,
+    các request đồng thời cho cùng input_keyword dùng chung một lời gọi, một lần ghi cache
+    và một lần ghi outbox.
+    """
+    my_keywords = cached_keywords(input_keyword)
+    if my_keywords is not None:
+        return my_keywords, CACHED_STATUS
+
+    prompt = build_prompt(input_keyword)
+
+    def generate():
+        gemini_response = model_registry.generate_content(
+            FEATURE,
+            contents=prompt,
+            generation_config=generation_config,
+        )
+        my_keywords = parse_keywords(gemini_response.text)
+        return my_keywords, store_and_queue(input_keyword, my_keywords)
+
+    return model_registry.coalesce(FEATURE, prompt, generation_config, generate)
+
+
+async def research_keywords_async(input_keyword: str) -> tuple[list[Keyword], dict]:
+    my_keywords = await asyncio.to_thread(cached_keywords, input_keyword)
+    if my_keywords is not None:
+        return my_keywords, CACHED_STATUS
+
+    prompt = build_prompt(input_keyword)
+
+    async def generate():
+        gemini_response = await model_registry.generate_content_async(
+            FEATURE,
+            contents=prompt,
+            generation_config=generation_config,
+        )
+        my_keywords = parse_keywords(gemini_response.text)
+        return my_keywords, await asyncio.to_thread(store_and_queue, input_keyword, my_keywords)
+
+    return await model_registry.coalesce_async(FEATURE, prompt, generation_config, generate)
+
+
+# Generate keywords and call external API
+def generate_and_send_keywords(input_keyword: str):
+    return build_result(*research_keywords(input_keyword))
+
+
+async def generate_and_send_keywords_async(input_keyword: str):
+    """Phiên bản asyncio: gọi Gemini bằng client async, đọc/ghi SQLite trên thread riêng."""
+    return build_result(*await research_keywords_async(input_keyword))
+
+
+def research_seed_group(seeds: list[str]) -> dict[str, list[Keyword]]:
+    """Một lời gọi Gemini cho cả nhóm seed; trả về dict seed đã chuẩn hoá -> keywords."""
+    gemini_response = model_registry.generate_content(
+        FEATURE,
+        contents=build_batch_prompt(seeds),
+        generation_config=batch_generation_config,
+        priority="batch",
     )
+    return {
+        keyword_cache.normalize_seed(item["seed"]): [Keyword(**keyword) for keyword in item["keywords"]]
+        for item in json.loads(gemini_response.text)
+    }
+
 
-    raw_keywords_data = json.loads(gemini_response.text)
-    my_keywords: list[Keyword] = [Keyword(**item) for item in raw_keywords_data]
-
-    external_api_results = []
-
-    for keyword in my_keywords:
-        payload = {
-            "searchKeyword": input_keyword,
-            "keyword1": keyword.keyword_name,
-            "model": "gemini-2.5-flash",
-            "searchVolume": keyword.searchVolume,
-            "difficulty": keyword.difficulty if keyword.difficulty is not None else 0,
-            "cpc": keyword.cpc if keyword.cpc is not None else 0.0,
-            "competition": keyword.competition if keyword.competition is not None else "N/A",
-            "intent": keyword.intent if keyword.intent is not None else "N/A",
-            "trend": "True" if keyword.trending else "False",
-            "rank": keyword.rank if keyword.rank is not None else 0
-        }
+def generate_keywords_batch(input_keywords: list[str]):
+    """
+    Nghiên cứu keyword cho nhiều seed. Seed đã có trong keyword cache được trả về ngay;
+    các seed còn lại được gộp KEYWORD_BATCH_SEEDS_PER_PROMPT seed mỗi prompt và chạy song song
+    (tối đa KEYWORD_BATCH_PARALLELISM prompt). Generator yield kết quả từng seed ngay khi
+    nhóm của nó xong, phần tử cuối là dict tổng kết có "done": true.
+    """
+    seeds: dict[str, str] = {}
+    for seed in input_keywords:
+        if isinstance(seed, str) and seed.strip():
+            seeds.setdefault(keyword_cache.normalize_seed(seed), seed.strip())
 
+    summary = {"done": True, "total": len(seeds), "succeeded": 0, "failed": 0, "cached": 0}
+
+    def success(seed: str, my_keywords: list[Keyword], external_api_status: dict) -> dict:
+        summary["succeeded"] += 1
+        return {"seed": seed, "status": "success", **build_result(my_keywords, external_api_status),
+                "keywords": [keyword.model_dump() for keyword in my_keywords]}
+
+    def failure(seed: str, error: str) -> dict:
+        summary["failed"] += 1
+        return {"seed": seed, "status": "failure", "error": error}
+
+    pending = []
+    for seed in seeds.values():
+        my_keywords = cached_keywords(seed)
+        if my_keywords is None:
+            pending.append(seed)
+        else:
+            summary["cached"] += 1
+            yield success(seed, my_keywords, CACHED_STATUS)
+
+    size = max(1, KEYWORD_BATCH_SEEDS_PER_PROMPT)
+    groups = [pending[i:i + size] for i in range(0, len(pending), size)]
+    futures = {_batch_executor.submit(research_seed_group, group): group for group in groups}
+    for future in as_completed(futures):
+        group = futures[future]
         try:
-            api_response = requests.post(EXTERNAL_API_URL, json=payload)
-            if api_response.ok:
-                status = "success"
-                message = f"Status Code: {api_response.status_code}"
+            results = future.result()
+        except Exception as e:
+            for seed in group:
+                yield failure(seed, f"API Error: {e}")
+            continue
+
+        for seed in group:
+            my_keywords = results.get(keyword_cache.normalize_seed(seed))
+            if my_keywords:
+                yield success(seed, my_keywords, store_and_queue(seed, my_keywords))
             else:
-                status = "failure"
-                message = f"Status Code: {api_response.status_code}, Error: {api_response.text}"
-        except requests.exceptions.RequestException as req_err:
-            status = "failure"
-            message = f"Network/Connection Error: {req_err}"
-        except Exception as api_exc:
-            status = "failure"
-            message = f"Unexpected Error: {api_exc}"
-
-        external_api_results.append({
-            "keyword": keyword.keyword_name,
-            "status": status,
-            "message": message
-        })
+                yield failure(seed, "No keywords returned by Gemini for this seed.")
 
-    return {
-        "message": "Keywords generated and sent successfully.",
-        "generated_keywords_count": len(my_keywords),
-        "external_api_status": external_api_results
-    }
\ No newline at end of file
+    yield summary
@@ -0,0 +1,190 @@
+"""
+Bộ lập lịch phía client cho quota Gemini.
+
+Mỗi model có hai token bucket: số request mỗi phút (RPM) và số token mỗi phút (TPM).
+Trước mỗi lời gọi, số token của prompt được ước lượng; request phải chờ tới khi cả
+hai bucket đủ chỗ. Các request đang chờ được xếp theo độ ưu tiên (chat tương tác
+trước, cập nhật thứ hạng hàng loạt sau). Nếu thời gian chờ dự kiến vượt quá hạn chót
+của mức ưu tiên đó, request bị từ chối ngay bằng LLMOverloadedError (HTTP 503)
+thay vì để cả hệ thống cùng nhận lỗi 429 từ Gemini.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+
+import metrics
+
+# Mức ưu tiên: số nhỏ được phục vụ trước
+PRIORITIES = {
+    "interactive": 0,
+    "default": 1,
+    "batch": 2,
+}
+
+# Thời gian chờ tối đa (giây) trong hàng đợi trước khi bị từ chối
+QUEUE_DEADLINES = {
+    "interactive": float(os.getenv("LLM_QUEUE_DEADLINE_INTERACTIVE", "10")),
+    "default": float(os.getenv("LLM_QUEUE_DEADLINE_DEFAULT", "30")),
+    "batch": float(os.getenv("LLM_QUEUE_DEADLINE_BATCH", "120")),
+}
+
+DEFAULT_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+DEFAULT_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+
+# Khi không có waiter nào đánh thức, kiểm tra lại bucket sau tối đa bấy nhiêu giây
+POLL_INTERVAL = 0.05
+
+
+class LLMOverloadedError(Exception):
+    """Request bị từ chối sớm vì hàng đợi quota Gemini quá dài."""
+
+    def __init__(self, model_name: str, priority: str, expected_wait: float, deadline: float):
+        self.model_name = model_name
+        self.priority = priority
+        self.expected_wait = expected_wait
+        self.deadline = deadline
+        self.retry_after = expected_wait
+        super().__init__(
+            f"Gemini quota for '{model_name}' is saturated: expected queue wait {expected_wait:.1f}s "
+            f"exceeds the {deadline:.0f}s deadline for {priority} requests. Please retry later.")
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        # Request lớn hơn cả dung lượng bucket vẫn được phép chạy khi bucket đầy
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+def _env_suffix(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]", "_", name).upper()
+
+
+class ModelScheduler:
+    def __init__(self, model_name: str):
+        rpm = os.getenv(f"GEMINI_RPM_{_env_suffix(model_name)}")
+        tpm = os.getenv(f"GEMINI_TPM_{_env_suffix(model_name)}")
+        self.model_name = model_name
+        self.requests = TokenBucket(int(rpm) if rpm else DEFAULT_RPM)
+        self.tokens = TokenBucket(int(tpm) if tpm else DEFAULT_TPM)
+        self._cond = threading.Condition()
+        # heap các waiter: (mức ưu tiên, thứ tự đến, số token)
+        self._waiting: list[tuple[int, int, int]] = []
+        self._seq = itertools.count()
+
+    def _expected_wait(self, entry) -> float:
+        """Ước lượng thời gian chờ dựa trên các request đứng trước trong hàng đợi."""
+        ahead = [w for w in self._waiting if w <= entry]
+        ahead_tokens = sum(w[2] for w in ahead)
+        return max(
+            (len(ahead) - self.requests.tokens) / self.requests.rate,
+            (ahead_tokens - self.tokens.tokens) / self.tokens.rate,
+            0.0,
+        )
+
+    def _try_acquire(self, entry) -> float | None:
+        """Cấp quota nếu entry đứng đầu hàng và bucket đủ chỗ; nếu không trả về thời gian nên chờ."""
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if self._waiting[0] != entry:
+            return POLL_INTERVAL
+        wait = max(self.requests.time_until(1), self.tokens.time_until(entry[2]))
+        if wait > 0:
+            return wait
+        self.requests.tokens -= 1
+        self.tokens.tokens -= min(entry[2], self.tokens.capacity)
+        heapq.heappop(self._waiting)
+        return None
+
+    def _enqueue(self, tokens: int, priority: str):
+        entry = (PRIORITIES[priority], next(self._seq), tokens)
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        heapq.heappush(self._waiting, entry)
+
+        deadline = QUEUE_DEADLINES[priority]
+        expected = self._expected_wait(entry)
+        if expected > deadline:
+            self._dequeue(entry)
+            metrics.incr("llm_scheduler_shed")
+            raise LLMOverloadedError(self.model_name, priority, expected, deadline)
+        return entry, now + deadline
+
+    def _dequeue(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    def _shed(self, entry, priority: str, started: float):
+        self._dequeue(entry)
+        metrics.incr("llm_scheduler_shed")
+        raise LLMOverloadedError(self.model_name, priority, time.monotonic() - started, QUEUE_DEADLINES[priority])
+
+    def acquire(self, tokens: int, priority: str = "default"):
+        with self._cond:
+            entry, deadline_at = self._enqueue(tokens, priority)
+            started = time.monotonic()
+            try:
+                while True:
+                    wait = self._try_acquire(entry)
+                    if wait is None:
+                        metrics.incr("llm_scheduler_admitted")
+                        return
+                    remaining = deadline_at - time.monotonic()
+                    if remaining <= 0:
+                        self._shed(entry, priority, started)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._cond.notify_all()
+
+    async def acquire_async(self, tokens: int, priority: str = "default"):
+        with self._cond:
+            entry, deadline_at = self._enqueue(tokens, priority)
+        started = time.monotonic()
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(entry)
+                    if wait is None:
+                        self._cond.notify_all()
+                        metrics.incr("llm_scheduler_admitted")
+                        return
+                    remaining = deadline_at - time.monotonic()
+                    if remaining <= 0:
+                        self._shed(entry, priority, started)
+                await asyncio.sleep(min(wait, remaining, POLL_INTERVAL))
+        except asyncio.CancelledError:
+            with self._cond:
+                if entry in self._waiting:
+                    self._dequeue(entry)
+                self._cond.notify_all()
+            raise
+
+
+_schedulers: dict[str, ModelScheduler] = {}
+_lock = threading.Lock()
+
+
+def get_scheduler(model_name: str) -> ModelScheduler:
+    scheduler = _schedulers.get(model_name)
+    if scheduler is None:
+        with _lock:
+            scheduler = _schedulers.setdefault(model_name, ModelScheduler(model_name))
+    return scheduler
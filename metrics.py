@@ -0,0 +1,28 @@
+import threading
+
+# Bộ đếm dùng chung cho toàn bộ ứng dụng, xuất ra qua endpoint /metrics
+_counters: dict[str, int] = {}
+_gauges = {}
+_lock = threading.Lock()
+
+
+def incr(name: str, value: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get(name: str) -> int:
+    return _counters.get(name, 0)
+
+
+def register_gauge(name: str, func):
+    """Đăng ký một giá trị được tính tại thời điểm đọc metrics (ví dụ hit rate)."""
+    _gauges[name] = func
+
+
+def snapshot() -> dict:
+    with _lock:
+        result = dict(_counters)
+    for name, func in _gauges.items():
+        result[name] = func()
+    return result
@@ -0,0 +1,229 @@
+"""
+Registry dùng chung cho các client Gemini.
+
+- Model của từng tính năng lấy từ cấu hình (GEMINI_MODEL_<FEATURE>), không hard-code trong module.
+- Client được tạo lazily ở lần gọi đầu tiên và dùng lại cho mọi tính năng cùng model;
+  bản thân thư viện google.generativeai cũng chỉ được import khi cần, giúp khởi động nhanh hơn.
+- Mỗi model có giới hạn số request đồng thời riêng (GEMINI_MAX_CONCURRENCY[_<MODEL>]),
+  để một endpoint đang tải cao không chiếm hết quota của các endpoint khác.
+- Trước khi chiếm slot, request phải qua llm_scheduler (quota RPM/TPM theo độ ưu tiên).
+- Các request giống hệt nhau đang chạy cùng lúc có thể dùng chung một lời gọi (coalesce).
+- Mọi lời gọi có timeout (GEMINI_TIMEOUT), được thử lại khi gặp lỗi tạm thời và đi qua
+  circuit breaker riêng của model (xem resilience).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+import llm_scheduler
+import resilience
+from singleflight import Group
+from token_estimate import estimate_tokens
+
+# Model mặc định của từng tính năng
+FEATURE_MODELS = {
+    "chat": "gemini-2.0-flash",
+    "keywords": "gemini-2.5-flash",
+    "rank_tracking": "gemini-2.5-flash",
+    "content_optimization": "gemini-2.5-flash",
+    "seo_advisor": "gemini-2.0-flash",
+    "top_ranking": "gemini-2.0-flash",
+}
+
+# Độ ưu tiên mặc định trong hàng đợi quota (xem llm_scheduler.PRIORITIES)
+FEATURE_PRIORITIES = {
+    "chat": "interactive",
+    "keywords": "default",
+    "rank_tracking": "default",
+    "content_optimization": "default",
+    "seo_advisor": "default",
+    "top_ranking": "default",
+}
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+REQUEST_OPTIONS = {"timeout": GEMINI_TIMEOUT}
+
+_api_key: str | None = None
+_configured = False
+_models = {}
+_limits: dict[str, threading.BoundedSemaphore] = {}
+_async_limits: dict[str, asyncio.Semaphore] = {}
+_flights: dict[str, Group] = {}
+_lock = threading.Lock()
+
+
+def configure(api_key: str | None):
+    """Ghi nhận API key; genai.configure chỉ chạy khi client đầu tiên được tạo."""
+    global _api_key
+    _api_key = api_key
+
+
+def _genai():
+    global _configured
+    import google.generativeai as genai
+
+    if not _configured:
+        with _lock:
+            if not _configured:
+                genai.configure(api_key=_api_key or os.getenv("GEMINI_API_KEY"))
+                _configured = True
+    return genai
+
+
+def _env_suffix(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]", "_", name).upper()
+
+
+def model_name(feature: str) -> str:
+    return os.getenv(f"GEMINI_MODEL_{_env_suffix(feature)}") or FEATURE_MODELS[feature]
+
+
+def max_concurrency(name: str) -> int:
+    value = os.getenv(f"GEMINI_MAX_CONCURRENCY_{_env_suffix(name)}")
+    return int(value) if value else DEFAULT_MAX_CONCURRENCY
+
+
+def get_model(feature: str):
+    name = model_name(feature)
+    model = _models.get(name)
+    if model is None:
+        genai = _genai()
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = genai.GenerativeModel(name)
+                _models[name] = model
+    return model
+
+
+def from_cached_content(cached_content):
+    return _genai().GenerativeModel.from_cached_content(cached_content=cached_content)
+
+
+def caching():
+    from google.generativeai import caching as genai_caching
+
+    _genai()
+    return genai_caching
+
+
+@contextmanager
+def limit(name: str):
+    semaphore = _limits.get(name)
+    if semaphore is None:
+        with _lock:
+            semaphore = _limits.setdefault(name, threading.BoundedSemaphore(max_concurrency(name)))
+    with semaphore:
+        yield
+
+
+@asynccontextmanager
+async def limit_async(name: str):
+    semaphore = _async_limits.get(name)
+    if semaphore is None:
+        semaphore = _async_limits.setdefault(name, asyncio.Semaphore(max_concurrency(name)))
+    async with semaphore:
+        yield
+
+
+def prompt_tokens(contents) -> int:
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    return sum(estimate_tokens(part) for part in contents if isinstance(part, str))
+
+
+@contextmanager
+def slot(feature: str, contents, priority: str | None = None):
+    """Xin quota từ scheduler rồi chiếm một slot đồng thời của model."""
+    name = model_name(feature)
+    llm_scheduler.get_scheduler(name).acquire(prompt_tokens(contents), priority or FEATURE_PRIORITIES[feature])
+    with limit(name):
+        yield
+
+
+@asynccontextmanager
+async def slot_async(feature: str, contents, priority: str | None = None):
+    name = model_name(feature)
+    await llm_scheduler.get_scheduler(name).acquire_async(
+        prompt_tokens(contents), priority or FEATURE_PRIORITIES[feature])
+    async with limit_async(name):
+        yield
+
+
+def call(feature: str, func):
+    """Gọi func() qua circuit breaker của model, thử lại khi Gemini trả lỗi tạm thời."""
+    return resilience.call(f"gemini:{model_name(feature)}", func)
+
+
+async def call_async(feature: str, func):
+    return await resilience.call_async(f"gemini:{model_name(feature)}", func)
+
+
+def generate_content(feature: str, contents, generation_config=None, priority: str | None = None):
+    # Mỗi lần thử đều xin lại quota, vì Gemini tính cả request bị lỗi
+    def attempt():
+        with slot(feature, contents, priority):
+            return get_model(feature).generate_content(
+                contents=contents, generation_config=generation_config, request_options=REQUEST_OPTIONS)
+
+    return call(feature, attempt)
+
+
+def stream_content(feature: str, contents, generation_config=None, priority: str | None = None):
+    # Giữ slot đồng thời cho tới khi stream kết thúc; chỉ lời gọi mở stream được thử lại
+    with slot(feature, contents, priority):
+        yield from call(feature, lambda: get_model(feature).generate_content(
+            contents=contents, generation_config=generation_config, stream=True, request_options=REQUEST_OPTIONS))
+
+
+async def generate_content_async(feature: str, contents, generation_config=None, priority: str | None = None):
+    async def attempt():
+        async with slot_async(feature, contents, priority):
+            return await get_model(feature).generate_content_async(
+                contents=contents, generation_config=generation_config, request_options=REQUEST_OPTIONS)
+
+    return await call_async(feature, attempt)
+
+
+async def stream_content_async(feature: str, contents, generation_config=None, priority: str | None = None):
+    async with slot_async(feature, contents, priority):
+        response = await call_async(feature, lambda: get_model(feature).generate_content_async(
+            contents=contents, generation_config=generation_config, stream=True, request_options=REQUEST_OPTIONS))
+        async for chunk in response:
+            yield chunk
+
+
+def _flight(feature: str) -> Group:
+    flight = _flights.get(feature)
+    if flight is None:
+        with _lock:
+            flight = _flights.setdefault(feature, Group(feature))
+    return flight
+
+
+def coalesce_key(feature: str, contents, generation_config=None) -> tuple[str, str, str]:
+    """Khóa single-flight: (model, hash của prompt, hash của generation config)."""
+    prompt = contents if isinstance(contents, str) else json.dumps(contents, ensure_ascii=False, default=str)
+    config = json.dumps(generation_config, sort_keys=True, default=str)
+    return (
+        model_name(feature),
+        hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        hashlib.sha256(config.encode("utf-8")).hexdigest(),
+    )
+
+
+def coalesce(feature: str, contents, generation_config, func):
+    """
+    Chạy func() (thường là gọi Gemini rồi parse kết quả) một lần cho mọi request đồng thời
+    có cùng model, prompt và generation config; các request đến sau nhận chung kết quả đã parse.
+    """
+    return _flight(feature).do(coalesce_key(feature, contents, generation_config), func)
+
+
+async def coalesce_async(feature: str, contents, generation_config, func):
+    return await _flight(feature).do_async(coalesce_key(feature, contents, generation_config), func)
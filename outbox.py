@@ -0,0 +1,253 @@
+"""
+Outbox bền vững (SQLite) cho các lệnh ghi sang backend.
+
+Endpoint chỉ ghi bản ghi vào outbox rồi trả kết quả Gemini ngay; một thread nền
+lấy các bản ghi đến hạn theo lô và gửi đi bằng handler đã đăng ký cho từng loại
+(register_handler). Lần gửi lỗi được thử lại với backoff tăng dần; quá
+OUTBOX_MAX_ATTEMPTS lần thì bản ghi chuyển sang "failed" và được giữ lại để tra cứu.
+
+Nhiều tiến trình (gunicorn workers) có thể dùng chung một file: bản ghi được
+"nhận" bằng lease trong transaction IMMEDIATE nên không bị gửi trùng; nếu tiến trình
+chết giữa chừng, lease hết hạn và bản ghi được gửi lại (at-least-once).
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import metrics
+from sqlite_store import SQLiteStore
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox.sqlite3"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("OUTBOX_RETRY_BASE_DELAY", "2"))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", "600"))
+# Thời gian giữ quyền gửi một lô; quá hạn thì tiến trình khác được nhận lại. Lô đang gửi
+# được gia hạn mỗi OUTBOX_LEASE_SECONDS / 3 giây nên chỉ hết hạn khi tiến trình chết hoặc treo
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_batch ON outbox (batch_id);
+"""
+
+# kind -> handler(payloads: list[dict]) -> list[str | None]
+# (None = gửi thành công, chuỗi = thông báo lỗi; cùng thứ tự với payloads)
+_handlers = {}
+_store = SQLiteStore(OUTBOX_DB, SCHEMA)
+_worker_lock = threading.Lock()
+_worker: threading.Thread | None = None
+_wakeup = threading.Event()
+# id các bản ghi tiến trình này đang gửi, được thread heartbeat gia hạn lease
+_leased: set[int] = set()
+_leased_lock = threading.Lock()
+_heartbeat: threading.Thread | None = None
+
+
+def register_handler(kind: str, handler):
+    _handlers[kind] = handler
+
+
+def enqueue(kind: str, payloads: list[dict], labels: list | None = None) -> dict:
+    """Ghi các payload vào outbox (một transaction) và trả về thông tin để tra cứu trạng thái."""
+    if kind not in _handlers:
+        raise ValueError(f"No outbox handler registered for '{kind}'.")
+
+    batch_id = uuid.uuid4().hex
+    now = time.time()
+    labels = labels if labels is not None else [None] * len(payloads)
+    rows = [(batch_id, kind, None if label is None else str(label), json.dumps(payload, ensure_ascii=False),
+             now, now, now) for payload, label in zip(payloads, labels)]
+
+    conn = _store.connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO outbox (batch_id, kind, label, payload, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    metrics.incr("outbox_enqueued", len(rows))
+
+    start_worker()
+    _wakeup.set()
+    return {"status": "queued", "outbox_id": batch_id, "queued": len(rows)}
+
+
+def _claim(now: float) -> list[sqlite3.Row]:
+    conn = _store.connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT id, kind, payload, attempts FROM outbox "
+            "WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until <= ?) "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (now, now, OUTBOX_BATCH_SIZE)).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', lease_until = ?, updated_at = ? WHERE id = ?",
+                [(now + OUTBOX_LEASE_SECONDS, now, row["id"]) for row in rows])
+    return rows
+
+
+def _extend_leases():
+    while True:
+        time.sleep(OUTBOX_LEASE_SECONDS / 3)
+        with _leased_lock:
+            ids = list(_leased)
+        if not ids:
+            continue
+        try:
+            now = time.time()
+            conn = _store.connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "UPDATE outbox SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'sending'",
+                    [(now + OUTBOX_LEASE_SECONDS, now, row_id) for row_id in ids])
+        except Exception as e:
+            print(f"Outbox lease heartbeat error: {e}", file=sys.stderr)
+
+
+def _start_heartbeat():
+    global _heartbeat
+    if _heartbeat is None:
+        with _worker_lock:
+            if _heartbeat is None:
+                _heartbeat = threading.Thread(target=_extend_leases, name="outbox-lease-heartbeat", daemon=True)
+                _heartbeat.start()
+
+
+def retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+
+
+def _deliver(kind: str, rows: list[sqlite3.Row]) -> list[str | None]:
+    handler = _handlers.get(kind)
+    if handler is None:
+        return [f"No outbox handler registered for '{kind}'."] * len(rows)
+    try:
+        errors = handler([json.loads(row["payload"]) for row in rows])
+    except Exception as e:
+        return [f"Unexpected Error: {e}"] * len(rows)
+    return list(errors)
+
+
+def drain_once() -> int:
+    """Gửi một lô bản ghi đến hạn; trả về số bản ghi đã xử lý."""
+    now = time.time()
+    rows = _claim(now)
+    if not rows:
+        return 0
+
+    by_kind: dict[str, list[sqlite3.Row]] = {}
+    for row in rows:
+        by_kind.setdefault(row["kind"], []).append(row)
+
+    # Handler chậm (hàng trăm request tuần tự) có thể chạy lâu hơn lease: giữ lease trong lúc gửi
+    ids = {row["id"] for row in rows}
+    _start_heartbeat()
+    with _leased_lock:
+        _leased.update(ids)
+    try:
+        updates = []
+        for kind, kind_rows in by_kind.items():
+            for row, error in zip(kind_rows, _deliver(kind, kind_rows)):
+                attempts = row["attempts"] + 1
+                if error is None:
+                    updates.append(("delivered", attempts, now, None, row["id"]))
+                    metrics.incr("outbox_delivered")
+                elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                    updates.append(("failed", attempts, now, error, row["id"]))
+                    metrics.incr("outbox_failed")
+                else:
+                    updates.append(("pending", attempts, now + retry_delay(attempts), error, row["id"]))
+                    metrics.incr("outbox_retries")
+
+        finished = time.time()
+        conn = _store.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+                "lease_until = NULL, updated_at = ? WHERE id = ?",
+                [update[:4] + (finished, update[4]) for update in updates])
+    finally:
+        with _leased_lock:
+            _leased.difference_update(ids)
+    return len(rows)
+
+
+def _run():
+    while True:
+        try:
+            if drain_once():
+                continue
+        except Exception as e:
+            print(f"Outbox worker error: {e}", file=sys.stderr)
+        _wakeup.wait(OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_worker():
+    """Khởi động thread gửi nền (một lần cho mỗi tiến trình)."""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run, name="outbox-worker", daemon=True)
+                _worker.start()
+
+
+def batch_status(batch_id: str) -> dict | None:
+    rows = _store.connect().execute(
+        "SELECT label, status, attempts, last_error, updated_at FROM outbox WHERE batch_id = ? ORDER BY id",
+        (batch_id,)).fetchall()
+    if not rows:
+        return None
+
+    counts: dict[str, int] = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    return {
+        "outbox_id": batch_id,
+        "counts": counts,
+        "items": [{
+            "label": row["label"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "last_error": row["last_error"],
+        } for row in rows],
+    }
+
+
+def summary() -> dict:
+    rows = _store.connect().execute("SELECT kind, status, COUNT(*) AS n FROM outbox GROUP BY kind, status").fetchall()
+    result: dict[str, dict[str, int]] = {}
+    for row in rows:
+        result.setdefault(row["kind"], {})[row["status"]] = row["n"]
+    return result
+
+
+def pending_count() -> int:
+    return _store.connect().execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+
+
+metrics.register_gauge("outbox_pending", pending_count)
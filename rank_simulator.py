@@ -0,0 +1,36 @@
+import numpy as np
+
+# Mô phỏng dao động thứ hạng theo đúng các quy tắc trong prompt của update_rank_tracking:
+#   - old_rank = 0 (chưa xếp hạng): thứ hạng khởi tạo ngẫu nhiên trong [50, 200]
+#   - old_rank 1-20: thay đổi +/- 1 đến 3 bậc
+#   - old_rank 21-100: thay đổi +/- 5 đến 15 bậc
+#   - old_rank > 100: prompt không quy định; dùng +/- 5% đến 15% của thứ hạng hiện tại
+NEW_RANK_RANGE = (50, 200)
+HIGH_RANK_MAX = 20
+HIGH_RANK_STEP = (1, 3)
+MID_RANK_MAX = 100
+MID_RANK_STEP = (5, 15)
+LOW_RANK_STEP_RATIO = (0.05, 0.15)
+
+
+def simulate_ranks(old_ranks: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Tính thứ hạng mới cho cả mảng old_ranks cùng lúc (vectorized)."""
+    old_ranks = np.asarray(old_ranks, dtype=np.int64)
+    size = old_ranks.shape[0]
+
+    sign = rng.choice(np.array([-1, 1]), size=size)
+    high_step = rng.integers(HIGH_RANK_STEP[0], HIGH_RANK_STEP[1] + 1, size=size)
+    mid_step = rng.integers(MID_RANK_STEP[0], MID_RANK_STEP[1] + 1, size=size)
+    low_step = np.rint(old_ranks * rng.uniform(*LOW_RANK_STEP_RATIO, size=size)).astype(np.int64)
+
+    step = np.where(old_ranks <= HIGH_RANK_MAX, high_step,
+                    np.where(old_ranks <= MID_RANK_MAX, mid_step, low_step))
+    new_ranks = np.maximum(old_ranks + sign * step, 1)
+
+    unranked = old_ranks <= 0
+    new_ranks[unranked] = rng.integers(NEW_RANK_RANGE[0], NEW_RANK_RANGE[1] + 1, size=int(unranked.sum()))
+    return new_ranks
+
+
+def make_rng(seed: int | None = None) -> np.random.Generator:
+    return np.random.default_rng(seed)
@@ -1,10 +1,24 @@
 from dataclasses import asdict, dataclass
+import asyncio
 import json
 import requests
 from pydantic import BaseModel
 from typing import Optional
-import google.generativeai as genai
 from datetime import datetime, timezone
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import model_registry
+import outbox
+from http_client import backend_request, fan_out
+from rank_simulator import make_rng, simulate_ranks
+from response_schema import json_config
+from keyword_cache import normalize_seed
+from token_estimate import estimate_tokens
 
 # External API
 EXTERNAL_API_URL = "https://seoboostaiapi-e2bycxbjc4fmgggz.southeastasia-01.azurewebsites.net/api/RankTrackings"
@@ -12,8 +26,37 @@ EXTERNAL_API_URL = "https://seoboostaiapi-e2bycxbjc4fmgggz.southeastasia-01.azur
 # Localhost API
 # EXTERNAL_API_URL = "https://localhost:7144/api/RankTrackings"
 
-# Gemini model setup
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Loại bản ghi outbox cho các cập nhật thứ hạng hàng loạt
+RANK_UPDATE_KIND = "rank_update"
+
+# Số dòng tối đa trong một request ghi hàng loạt (PATCH cập nhật thứ hạng, POST rank tracking mới);
+# 1 = mỗi keyword một request như trước
+RANK_PATCH_BATCH_SIZE = int(os.getenv("RANK_PATCH_BATCH_SIZE", "100"))
+# Backend chỉ được xác nhận nhận từng object khi POST rank tracking mới; chỉ bật khi backend nhận cả mảng
+RANK_POST_ARRAYS = os.getenv("RANK_POST_ARRAYS", "false").lower() in ("1", "true", "yes")
+
+# Chia batch /update-rank-tracking thành các chunk theo ngân sách token
+RANK_CHUNK_TOKEN_BUDGET = int(os.getenv("RANK_CHUNK_TOKEN_BUDGET", "4000"))
+RANK_CHUNK_PARALLELISM = int(os.getenv("RANK_CHUNK_PARALLELISM", "4"))
+RANK_CHUNK_MAX_RETRIES = int(os.getenv("RANK_CHUNK_MAX_RETRIES", "2"))
+# Ước lượng token output cho mỗi dòng {"id", "keyword_name", "rank"}
+RANK_OUTPUT_TOKENS_PER_ITEM = 30
+# Số keyword tối đa trong một request /rank-tracking/batch
+RANK_TRACKING_MAX_KEYWORDS = int(os.getenv("RANK_TRACKING_MAX_KEYWORDS", "1000"))
+
+_chunk_executor = ThreadPoolExecutor(max_workers=RANK_CHUNK_PARALLELISM, thread_name_prefix="rank-chunk")
+
+# "gemini": hỏi Gemini như trước (mặc định); "simulator": mô phỏng cục bộ bằng NumPy, thứ hạng là số giả lập,
+# chỉ bật khi triển khai chấp nhận điều đó (ví dụ môi trường thử nghiệm, benchmark)
+RANK_ESTIMATOR = os.getenv("RANK_ESTIMATOR", "gemini")
+# Đặt seed để kết quả mô phỏng lặp lại được (ví dụ khi kiểm thử)
+RANK_SIMULATOR_SEED = int(os.environ["RANK_SIMULATOR_SEED"]) if os.getenv("RANK_SIMULATOR_SEED") else None
+_simulator_rng = make_rng(RANK_SIMULATOR_SEED)
+# Generator của NumPy không an toàn khi dùng đồng thời từ nhiều thread
+_simulator_lock = threading.Lock()
+
+# Gemini model setup (model cụ thể lấy từ model_registry)
+FEATURE = "rank_tracking"
 
 # Pydantic model
 class RankTracking(BaseModel):
@@ -36,88 +79,210 @@ class RankTrackingResponse(BaseModel):
     keyword_name: str
     rank: int
 
-# Generate keywords and call external API
-def rank_tracking(input_keyword: str, userID: int):
-    prompt = (
-    f"You are an AI assistant that simulates realistic search engine rank tracking. "
-    "Given the keyword '{input_keyword}', provide its current estimated search engine rank. "
-    "Respond in JSON format as an object with two fields: 'keyword_name' (string) and 'rank' (integer). "
-    "The rank can range from 1 to several thousand. If the keyword is not ranked, set 'rank' to 0."
+def build_prompt(input_keywords: list[str]) -> str:
+    keywords_json = json.dumps(input_keywords, ensure_ascii=False)
+    return (
+    "You are an AI assistant that simulates realistic search engine rank tracking. "
+    f"Given the keywords in this JSON list: {keywords_json}, provide the current estimated search engine rank of each keyword. "
+    "Return exactly one object per keyword, with 'keyword_name' copied exactly from the list. "
+    "The rank can range from 1 to several thousand. If a keyword is not ranked, set its 'rank' to 0."
     )
 
 
-    gemini_response_schema = {
-        "type": "ARRAY",
-        "items": {
-            "type": "OBJECT",
-            "properties": {
-                "keyword_name": {"type": "STRING"},
-                "rank": {"type": "INTEGER"}
-            },
-            "required": ["keyword_name", "rank"]
-        }
-    }
+rank_tracking_config = json_config(list[RankTracking])
 
-    gemini_response = model.generate_content(
-        contents=prompt,
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": gemini_response_schema,
-        },
-    )
 
-    raw_keywords_data = json.loads(gemini_response.text)
-    my_keywords: list[RankTracking] = [RankTracking(**item) for item in raw_keywords_data]
+def utc_timestamp() -> str:
+    utc_now = datetime.now(timezone.utc)
+    return utc_now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
 
-    external_api_results = []
 
-    utc_now = datetime.now(timezone.utc)
-    formatted = utc_now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+def parse_rank_tracking(response_text: str) -> list[RankTracking]:
+    raw_keywords_data = json.loads(response_text)
+    return [RankTracking(**item) for item in raw_keywords_data]
 
-    for keyword in my_keywords:
-        payload = {
-            "userId": userID,
-            "model": "gemini-2.5-flash",
-            "keyword": input_keyword,
-            "rank": keyword.rank,
-            "createDate": formatted
-        }
 
-        try:
-            api_response = requests.post(EXTERNAL_API_URL, json=payload, verify=False)    
-            if api_response.ok:
-                status = "success"
-                message = f"Status Code: {api_response.status_code}"
-            else:
-                status = "failure"
-                message = f"Status Code: {api_response.status_code}, Error: {api_response.text}"
-        except requests.exceptions.RequestException as req_err:
-            status = "failure"
-            message = f"Network/Connection Error: {req_err}"
-        except Exception as api_exc:
-            status = "failure"
-            message = f"Unexpected Error: {api_exc}"
-
-        external_api_results.append({
-            "keyword": keyword.keyword_name,
-            "status": status,
-            "message": message
-        })
+def match_ranks(input_keywords: list[str], my_keywords: list[RankTracking]) -> dict[str, RankTracking]:
+    """
+    Ghép kết quả của Gemini với keyword đã hỏi (so khớp sau khi chuẩn hoá). Kết quả
+    mang đúng keyword_name của input; keyword lạ do mô hình tự thêm bị bỏ qua.
+    """
+    by_name = {normalize_seed(keyword.keyword_name): keyword for keyword in my_keywords}
+    if len(input_keywords) == 1 and len(my_keywords) == 1:
+        by_name = {normalize_seed(input_keywords[0]): my_keywords[0]}
+    return {
+        keyword: RankTracking(keyword_name=keyword, rank=by_name[normalize_seed(keyword)].rank)
+        for keyword in input_keywords
+        if normalize_seed(keyword) in by_name
+    }
+
+
+def build_payload(input_keyword: str, userID: int, keyword: RankTracking, formatted: str) -> dict:
+    return {
+        "userId": userID,
+        "model": model_registry.model_name(FEATURE),
+        "keyword": input_keyword,
+        "rank": keyword.rank,
+        "createDate": formatted
+    }
 
+
+def build_result(my_keywords: list, external_api_status: dict) -> dict:
     return {
-        "message": "Keywords generated and sent successfully.",
+        "message": "Keywords generated and queued for the external API.",
         "generated_keywords_count": len(my_keywords),
-        "external_api_status": external_api_results
+        "external_api_status": external_api_status
     }
 
-def update_rank_tracking(request_list_of_objects :list[UpdateRankTrackingRequest]):
+
+def post_rank_row(row: dict) -> str | None:
+    """Ghi một rank tracking mới (một object, như trước). Trả về None nếu thành công, không thì thông báo lỗi."""
+    try:
+        api_response = backend_request("POST", EXTERNAL_API_URL, json=row, verify=False)
+    except requests.exceptions.RequestException as req_err:
+        return f"Network/Connection Error: {req_err}"
+    except Exception as api_exc:
+        return f"Unexpected Error: {api_exc}"
+
+    if api_response.ok:
+        return None
+    return f"Status Code: {api_response.status_code}, Error: {api_response.text}"
+
+
+def post_rank_batch(rows: list[dict]) -> list[str | None]:
+    """
+    Ghi một lô rank tracking mới bằng một request POST gửi cả mảng (chỉ khi RANK_POST_ARRAYS).
+    Nếu backend từ chối lô, gửi lại từng dòng một để biết đúng các dòng lỗi (N + 1 request,
+    không chia đôi). Trả về None cho dòng thành công, thông báo lỗi cho dòng thất bại.
+    """
+    if len(rows) == 1:
+        return [post_rank_row(rows[0])]
+
+    try:
+        api_response = backend_request("POST", EXTERNAL_API_URL, json=rows, verify=False)
+    except requests.exceptions.RequestException as req_err:
+        return [f"Network/Connection Error: {req_err}"] * len(rows)
+    except Exception as api_exc:
+        return [f"Unexpected Error: {api_exc}"] * len(rows)
+
+    if api_response.ok:
+        return [None] * len(rows)
+    return [post_rank_row(row) for row in rows]
+
+
+def deliver_rank_tracking(rows: list[dict], batch_size: int = RANK_PATCH_BATCH_SIZE) -> list[str | None]:
+    if not RANK_POST_ARRAYS:
+        return fan_out(post_rank_row, rows)
+    batch_size = max(1, batch_size)
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    return [error for batch_errors in fan_out(post_rank_batch, batches) for error in batch_errors]
+
+
+outbox.register_handler(FEATURE, deliver_rank_tracking)
+
+
+def queue_rank_tracking(userID: int, my_keywords: list[RankTracking]) -> dict:
+    formatted = utc_timestamp()
+    return outbox.enqueue(FEATURE, [build_payload(keyword.keyword_name, userID, keyword, formatted)
+                                    for keyword in my_keywords],
+                          labels=[keyword.keyword_name for keyword in my_keywords])
+
+
+def chunk_keywords(input_keywords: list[str], token_budget: int = RANK_CHUNK_TOKEN_BUDGET) -> list[list[str]]:
+    return chunk_by_budget(input_keywords, lambda keyword: estimate_tokens(json.dumps(keyword, ensure_ascii=False)),
+                           token_budget)
+
+
+def estimate_keyword_ranks(input_keywords: list[str]) -> dict[str, RankTracking]:
+    """
+    Một prompt cho cả nhóm keyword; các request đồng thời với cùng nhóm dùng chung một lời gọi Gemini.
+    Trả về dict keyword -> kết quả (keyword Gemini bỏ sót không có trong dict).
+    """
+    prompt = build_prompt(input_keywords)
+
+    def generate():
+        gemini_response = model_registry.generate_content(
+            FEATURE,
+            contents=prompt,
+            generation_config=rank_tracking_config,
+        )
+        return match_ranks(input_keywords, parse_rank_tracking(gemini_response.text))
+
+    return model_registry.coalesce(FEATURE, prompt, rank_tracking_config, generate)
+
+
+async def estimate_keyword_ranks_async(input_keywords: list[str]) -> dict[str, RankTracking]:
+    prompt = build_prompt(input_keywords)
+
+    async def generate():
+        gemini_response = await model_registry.generate_content_async(
+            FEATURE,
+            contents=prompt,
+            generation_config=rank_tracking_config,
+        )
+        return match_ranks(input_keywords, parse_rank_tracking(gemini_response.text))
+
+    return await model_registry.coalesce_async(FEATURE, prompt, rank_tracking_config, generate)
+
+
+# Generate keywords and call external API
+def rank_tracking(input_keyword: str, userID: int):
+    my_keywords = list(estimate_keyword_ranks([input_keyword]).values())
+    return build_result(my_keywords, queue_rank_tracking(userID, my_keywords))
+
+
+async def rank_tracking_async(input_keyword: str, userID: int):
+    my_keywords = list((await estimate_keyword_ranks_async([input_keyword])).values())
+    return build_result(my_keywords, await asyncio.to_thread(queue_rank_tracking, userID, my_keywords))
+
+
+def _estimate_chunk_safely(chunk: list[str]):
+    try:
+        return estimate_keyword_ranks(chunk), None
+    except Exception as e:
+        return None, e
+
+
+def track_keywords(input_keywords: list[str], userID: int) -> dict:
+    """
+    Theo dõi thứ hạng của nhiều keyword cho một user: gộp keyword vào các prompt theo
+    ngân sách token (thường chỉ một prompt), ghép kết quả theo keyword và ghi sang
+    backend theo lô qua outbox.
+    """
+    unique: dict[str, str] = {}
+    for keyword in input_keywords:
+        if isinstance(keyword, str) and keyword.strip():
+            unique.setdefault(normalize_seed(keyword), keyword.strip())
+    keywords = list(unique.values())
+
+    ranks: dict[str, RankTracking] = {}
+    errors: dict[str, str] = {}
+    chunks = chunk_keywords(keywords)
+    for chunk, (result, error) in zip(chunks, _chunk_executor.map(_estimate_chunk_safely, chunks)):
+        if error is None:
+            ranks.update(result)
+        else:
+            errors.update((keyword, f"API Error: {error}") for keyword in chunk)
+
+    my_keywords = [ranks[keyword] for keyword in keywords if keyword in ranks]
+    missing = [{"keyword": keyword, "status": "failure",
+                "message": errors.get(keyword, "No rank estimate returned by Gemini.")}
+               for keyword in keywords if keyword not in ranks]
+
+    result = build_result(my_keywords, queue_rank_tracking(userID, my_keywords))
+    result["ranks"] = [keyword.model_dump() for keyword in my_keywords]
+    result["missing"] = missing
+    result["chunks"] = len(chunks)
+    return result
+
+def build_update_prompt(chunk: list[UpdateRankTrackingRequest]) -> str:
     # Chuyển đổi list[UpdateRankTrackingRequest] thành list[dict]
-    # để json.dumps có thể serialize
-    request_as_dicts = [asdict(item) for item in request_list_of_objects]
+    # để json.dumps có thể serialize (dạng gọn, không thụt lề, để tiết kiệm token)
+    request_as_dicts = [asdict(item) for item in chunk]
 
-    json_string = json.dumps(request_as_dicts, indent=2, ensure_ascii=False)
+    json_string = json.dumps(request_as_dicts, ensure_ascii=False, separators=(",", ":"))
 
-    prompt = (
+    return (
     f"You are an AI assistant that simulates realistic search engine rank tracking. "
     f"Given the following list of keywords, each with its current rank (`old_rank`), in JSON format:\n\n"
     f"```json\n{json_string}\n```\n\n"
@@ -126,68 +291,208 @@ def update_rank_tracking(request_list_of_objects :list[UpdateRankTrackingRequest
     f"2.  **For high ranks (e.g., 1-20),** the change must be very small, typically +/- 1 to 3 positions. A large, unrealistic jump like from rank 3 to 300 is **strictly forbidden**.\n"
     f"3.  **For mid-range ranks (e.g., 21-100),** the change can be more moderate, such as +/- 5 to 15 positions.\n"
     f"4.  **If `old_rank` is 0,** provide a realistic initial rank for a newly discovered keyword, for example, between 50 and 200.\n\n"
-    f"Ensure the `id` and `keyword_name` from the input are preserved in the output. "
-    f"Respond strictly in JSON format as an array of objects, where each object has 'id' (string), 'keyword_name' (string), and 'rank' (integer)."
+    f"Ensure the `id` and `keyword_name` from the input are preserved in the output."
     )
 
-    gemini_response_schema = {
-        "type": "ARRAY",
-        "items": {
-            "type": "OBJECT",
-            "properties": {
-                "id": {"type": "STRING"},
-                "keyword_name": {"type": "STRING"},
-                "rank": {"type": "INTEGER"}
-            },
-            "required": ["id", "keyword_name", "rank"]
-        }
-    }
 
-    gemini_response = model.generate_content(
-        contents=prompt,
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": gemini_response_schema,
-        },
+update_rank_config = json_config(list[RankTrackingResponse])
+
+
+def chunk_update_requests(items: list[UpdateRankTrackingRequest],
+                          token_budget: int = RANK_CHUNK_TOKEN_BUDGET) -> list[list[UpdateRankTrackingRequest]]:
+    return chunk_by_budget(items, lambda item: estimate_tokens(json.dumps(asdict(item), ensure_ascii=False)),
+                           token_budget)
+
+
+def chunk_by_budget(items: list, input_tokens, token_budget: int = RANK_CHUNK_TOKEN_BUDGET) -> list[list]:
+    """
+    Chia danh sách thành các chunk sao cho tổng token ước lượng (input + output)
+    của mỗi chunk không vượt quá `token_budget`.
+    """
+    chunks, current, used = [], [], 0
+    for item in items:
+        cost = input_tokens(item) + RANK_OUTPUT_TOKENS_PER_ITEM
+        if current and used + cost > token_budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def estimate_chunk(chunk: list[UpdateRankTrackingRequest]) -> list[RankTrackingResponse]:
+    # Cập nhật hàng loạt nhường quota cho các request tương tác
+    gemini_response = model_registry.generate_content(
+        FEATURE,
+        contents=build_update_prompt(chunk),
+        generation_config=update_rank_config,
+        priority="batch",
     )
 
     raw_keywords_data = json.loads(gemini_response.text)
+    my_keywords = [RankTrackingResponse(**item) for item in raw_keywords_data]
 
-    my_keywords: list[RankTrackingResponse] = [RankTrackingResponse(**item) for item in raw_keywords_data]
+    # Một chunk bị cắt cụt hoặc thiếu id được coi là thất bại để thử lại
+    missing = {str(item.id) for item in chunk} - {keyword.id for keyword in my_keywords}
+    if missing:
+        raise ValueError(f"Gemini response is missing {len(missing)} id(s)")
+    return my_keywords
 
-    external_api_results = []
-    utc_now = datetime.now(timezone.utc)
-    formatted = utc_now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
 
-    for keyword in my_keywords:
-        payload = [{
-            "id":  int(keyword.id),
-            "rank": keyword.rank,
-            "updatedDate": formatted
-        }]
+def estimate_ranks(request_list_of_objects: list[UpdateRankTrackingRequest]):
+    """
+    Ước lượng thứ hạng mới theo từng chunk, chạy song song (tối đa RANK_CHUNK_PARALLELISM).
+    Chỉ các chunk lỗi được thử lại. Trả về (dict id -> (keyword_name, rank), báo cáo từng chunk).
+    """
+    chunks = chunk_update_requests(request_list_of_objects)
+    reports = [{"chunk": index, "size": len(chunk), "attempts": 0, "duration_ms": 0.0, "status": "pending"}
+               for index, chunk in enumerate(chunks)]
+    results: dict[str, tuple[str, int]] = {}
 
+    def run(index: int):
+        started = time.perf_counter()
         try:
-            api_response = requests.patch(EXTERNAL_API_URL, json=payload, verify=False)    
-            if api_response.ok:
-                status = "success"
-                message = f"Status Code: {api_response.status_code}"
+            return estimate_chunk(chunks[index]), None
+        except Exception as e:
+            return None, e
+        finally:
+            reports[index]["attempts"] += 1
+            reports[index]["duration_ms"] += round((time.perf_counter() - started) * 1000, 1)
+
+    pending = list(range(len(chunks)))
+    for _ in range(1 + RANK_CHUNK_MAX_RETRIES):
+        if not pending:
+            break
+        failed = []
+        for index, (my_keywords, error) in zip(pending, _chunk_executor.map(run, pending)):
+            if error is None:
+                reports[index]["status"] = "success"
+                reports[index].pop("error", None)
+                for keyword in my_keywords:
+                    results[keyword.id] = (keyword.keyword_name, keyword.rank)
             else:
-                status = "failure"
-                message = f"Status Code: {api_response.status_code}, Error: {api_response.text}"
-        except requests.exceptions.RequestException as req_err: 
-            status = "failure"
-            message = f"Network/Connection Error: {req_err}"
-        except Exception as api_exc:
-            status = "failure"
-            message = f"Unexpected Error: {api_exc}"
-
-        external_api_results.append({
-            "status": status,
-            "message": message
-        })
+                reports[index]["status"] = "failure"
+                reports[index]["error"] = str(error)
+                failed.append(index)
+        pending = failed
 
-    return {
-        "message": "Keywords generated and sent successfully.",
-        "generated_keywords_count": len(my_keywords),
-        "external_api_status": external_api_results
-    }
\ No newline at end of file
+    return results, reports
+
+
+def simulate_rank_updates(request_list_of_objects: list[UpdateRankTrackingRequest]):
+    """
+    Backend cục bộ: áp dụng cùng các quy tắc dao động thứ hạng trên mảng NumPy,
+    không gọi Gemini. Trả về cùng dạng (dict id -> (keyword_name, rank), báo cáo) như estimate_ranks.
+    """
+    started = time.perf_counter()
+    old_ranks = np.fromiter((item.old_rank for item in request_list_of_objects), dtype=np.int64,
+                            count=len(request_list_of_objects))
+    with _simulator_lock:
+        new_ranks = simulate_ranks(old_ranks, _simulator_rng)
+
+    # Dựng thẳng tuple từ mảng, không tạo RankTrackingResponse cho từng dòng
+    results = dict(zip(
+        (str(item.id) for item in request_list_of_objects),
+        zip((item.input_keyword for item in request_list_of_objects), new_ranks.tolist()),
+    ))
+    reports = [{
+        "chunk": 0,
+        "size": len(request_list_of_objects),
+        "attempts": 1,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "status": "success",
+    }]
+    return results, reports
+
+
+# Các backend ước lượng thứ hạng, chọn bằng biến môi trường RANK_ESTIMATOR
+RANK_ESTIMATORS = {
+    "gemini": estimate_ranks,
+    "simulator": simulate_rank_updates,
+}
+
+
+def assemble_rank_rows(request_list_of_objects: list[UpdateRankTrackingRequest], results: dict[str, tuple[str, int]]):
+    """
+    Gộp kết quả ước lượng theo id, giữ thứ tự của request.
+    Trả về (các dòng gửi backend, thứ hạng trả trong response, các id không có kết quả).
+    """
+    formatted = utc_timestamp()
+    rows = []
+    ranks = []
+    missing_results = []
+    seen_ids = set()
+    for item in request_list_of_objects:
+        item_id = str(item.id)
+        if item_id in seen_ids:
+            continue
+        seen_ids.add(item_id)
+        estimate = results.get(item_id)
+        if estimate is None:
+            missing_results.append({"id": item.id, "status": "failure",
+                                    "message": "No rank estimate returned by Gemini."})
+            continue
+        keyword_name, rank = estimate
+        row = {"id": int(item_id), "rank": rank, "updatedDate": formatted}
+        rows.append(row)
+        ranks.append({**row, "keyword_name": keyword_name})
+    return rows, ranks, missing_results
+
+
+def update_rank_tracking(request_list_of_objects :list[UpdateRankTrackingRequest], estimator: str = RANK_ESTIMATOR):
+    results, chunk_reports = RANK_ESTIMATORS[estimator](request_list_of_objects)
+    rows, ranks, missing_results = assemble_rank_rows(request_list_of_objects, results)
+
+    result = build_result(rows, outbox.enqueue(RANK_UPDATE_KIND, rows, labels=[row["id"] for row in rows]))
+    # Backend được cập nhật ở nền nên thứ hạng mới được trả luôn trong response
+    result["ranks"] = ranks
+    result["missing"] = missing_results
+    result["estimator"] = estimator
+    result["chunks"] = chunk_reports
+    return result
+
+
+def patch_rank_batch(rows: list[dict]) -> list[dict]:
+    """
+    Gửi một lô cập nhật bằng một request PATCH. Nếu backend từ chối cả lô,
+    chia đôi lô và gửi lại từng nửa để tìm ra đúng các dòng lỗi.
+    """
+    try:
+        # PATCH ghi giá trị thứ hạng tuyệt đối nên gửi lại an toàn
+        api_response = backend_request("PATCH", EXTERNAL_API_URL, idempotent=True, json=rows, verify=False)
+    except requests.exceptions.RequestException as req_err:
+        return [{"id": row["id"], "status": "failure", "message": f"Network/Connection Error: {req_err}"}
+                for row in rows]
+    except Exception as api_exc:
+        return [{"id": row["id"], "status": "failure", "message": f"Unexpected Error: {api_exc}"}
+                for row in rows]
+
+    if api_response.ok:
+        return [{"id": row["id"], "status": "success", "message": f"Status Code: {api_response.status_code}"}
+                for row in rows]
+
+    if len(rows) > 1:
+        middle = len(rows) // 2
+        return patch_rank_batch(rows[:middle]) + patch_rank_batch(rows[middle:])
+
+    return [{
+        "id": rows[0]["id"],
+        "status": "failure",
+        "message": f"Status Code: {api_response.status_code}, Error: {api_response.text}"
+    }]
+
+
+def send_rank_updates(rows: list[dict], batch_size: int = RANK_PATCH_BATCH_SIZE) -> list[dict]:
+    """Gộp các cập nhật thành các lô PATCH tối đa `batch_size` dòng, gửi song song các lô."""
+    batch_size = max(1, batch_size)
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    return [result for batch_results in fan_out(patch_rank_batch, batches) for result in batch_results]
+
+
+def deliver_rank_updates(rows: list[dict]) -> list[str | None]:
+    return [None if result["status"] == "success" else result["message"] for result in send_rank_updates(rows)]
+
+
+outbox.register_handler(RANK_UPDATE_KIND, deliver_rank_updates)
@@ -0,0 +1,289 @@
+"""
+Lớp chịu lỗi cho các lời gọi ra ngoài (Gemini và backend Azure).
+
+- Thử lại với exponential backoff + jitter, chỉ cho lỗi tạm thời (timeout, mất kết nối,
+  HTTP 429/5xx) và chỉ cho lời gọi idempotent.
+- Circuit breaker theo từng upstream: sau BREAKER_FAILURE_THRESHOLD lỗi liên tiếp,
+  mọi lời gọi tới upstream đó bị từ chối ngay (CircuitOpenError) trong BREAKER_RESET_TIMEOUT
+  giây, rồi cho một request thử đi qua để kiểm tra upstream đã hồi phục chưa.
+- Hedged request: nếu lời gọi chưa xong sau `delay` giây, gửi thêm một bản sao và
+  lấy kết quả nào về trước (dùng cho chat, nơi độ trễ đuôi ảnh hưởng trực tiếp tới người dùng).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import httpx
+import requests
+
+import metrics
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Mã HTTP được coi là lỗi tạm thời của upstream
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Số bản sao hedged chạy đồng thời tối đa (mỗi bản sao tốn thêm quota Gemini)
+HEDGE_MAX_IN_FLIGHT = max(1, int(os.getenv("HEDGE_MAX_IN_FLIGHT", "2")))
+# Số bản chính chạy đồng thời tối đa trong hedged(); vượt quá thì bản chính xếp hàng
+HEDGE_PRIMARY_WORKERS = max(1, int(os.getenv("HEDGE_PRIMARY_WORKERS", "32")))
+
+# Pool đủ chỗ cho mọi bản sao được phép nên bản sao không bao giờ phải xếp hàng
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_IN_FLIGHT, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_MAX_IN_FLIGHT)
+_primary_executor = ThreadPoolExecutor(max_workers=HEDGE_PRIMARY_WORKERS, thread_name_prefix="hedge-primary")
+
+
+class CircuitOpenError(Exception):
+    """Upstream đang bị ngắt mạch, lời gọi bị từ chối mà không gửi đi."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(f"Upstream '{upstream}' is unavailable (circuit open), retry in {retry_after:.0f}s.")
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        # Token của request thử half-open đang chạy (None nếu không có)
+        self._probe: object | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> object | None:
+        """
+        Ném CircuitOpenError nếu mạch đang mở; ở trạng thái half-open chỉ cho một request thử.
+        Với request thử, trả về token của lượt thử (None với lời gọi thường): chỉ người giữ
+        token mới kết thúc được lượt thử, bằng cách truyền lại nó cho record_failure/release.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return None
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and self._probe is None:
+                self._probe = object()
+                return self._probe
+        metrics.incr("circuit_open_rejections")
+        raise CircuitOpenError(self.name, max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = None
+
+    def release(self, probe: object | None = None):
+        """Lời gọi kết thúc bằng lỗi không phải do upstream: trả lại lượt thử (nếu giữ) mà không đổi trạng thái."""
+        with self._lock:
+            if probe is not None and self._probe is probe:
+                self._probe = None
+
+    def record_failure(self, probe: object | None = None):
+        with self._lock:
+            # Lượt thử có thể đã kết thúc (mạch được đóng bởi lời gọi thành công khác) trong lúc nó chạy
+            probe = probe is not None and self._probe is probe
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                if self.opened_at is None or probe:
+                    metrics.incr("circuit_opened")
+                self.opened_at = time.monotonic()
+            if probe:
+                self._probe = None
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(upstream, CircuitBreaker(upstream))
+    return breaker
+
+
+def open_circuits() -> int:
+    return sum(1 for breaker in list(_breakers.values()) if breaker.state != "closed")
+
+
+metrics.register_gauge("circuit_breakers_open", open_circuits)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter: chờ ngẫu nhiên trong [0, base * 2^attempt], tối đa RETRY_MAX_DELAY."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                        httpx.TimeoutException, httpx.NetworkError, TimeoutError, ConnectionError)):
+        return True
+    # Lỗi của google.api_core mang mã HTTP trong thuộc tính `code`
+    return getattr(exc, "code", None) in RETRYABLE_STATUS
+
+
+def _status(result) -> int | None:
+    status = getattr(result, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def call(upstream: str, func, idempotent: bool = True, attempts: int = RETRY_MAX_ATTEMPTS):
+    """
+    Gọi func() qua circuit breaker của upstream. Lỗi tạm thời (exception hoặc response
+    HTTP 429/5xx) được thử lại nếu lời gọi idempotent; hết lượt thì trả về response
+    cuối cùng hoặc ném exception cuối cùng.
+    """
+    breaker = get_breaker(upstream)
+    attempts = max(1, attempts if idempotent else 1)
+    for attempt in range(attempts):
+        probe = breaker.allow()
+        last_try = attempt == attempts - 1
+        try:
+            result = func()
+        except BaseException as exc:
+            # Kể cả huỷ (CancelledError): lượt thử half-open không được bị giữ mãi
+            if not isinstance(exc, Exception) or not is_transient(exc):
+                breaker.release(probe)
+                raise
+            breaker.record_failure(probe)
+            if last_try:
+                raise
+        else:
+            if _status(result) not in RETRYABLE_STATUS:
+                breaker.record_success()
+                return result
+            breaker.record_failure(probe)
+            if last_try:
+                return result
+        metrics.incr("resilience_retries")
+        time.sleep(backoff_delay(attempt))
+
+
+async def call_async(upstream: str, func, idempotent: bool = True, attempts: int = RETRY_MAX_ATTEMPTS):
+    """Phiên bản asyncio của call(): func là hàm trả về coroutine."""
+    breaker = get_breaker(upstream)
+    attempts = max(1, attempts if idempotent else 1)
+    for attempt in range(attempts):
+        probe = breaker.allow()
+        last_try = attempt == attempts - 1
+        try:
+            result = await func()
+        except BaseException as exc:
+            # Kể cả huỷ (CancelledError): lượt thử half-open không được bị giữ mãi
+            if not isinstance(exc, Exception) or not is_transient(exc):
+                breaker.release(probe)
+                raise
+            breaker.record_failure(probe)
+            if last_try:
+                raise
+        else:
+            if _status(result) not in RETRYABLE_STATUS:
+                breaker.record_success()
+                return result
+            breaker.record_failure(probe)
+            if last_try:
+                return result
+        metrics.incr("resilience_retries")
+        await asyncio.sleep(backoff_delay(attempt))
+
+
+def _acquire_hedge_slot() -> bool:
+    """Giữ chỗ cho một bản sao; hết chỗ thì bỏ qua hedging thay vì xếp hàng."""
+    if _hedge_slots.acquire(blocking=False):
+        return True
+    metrics.incr("hedges_skipped")
+    return False
+
+
+def hedged(func, delay: float):
+    """
+    Chạy func(); nếu sau `delay` giây chưa xong thì chạy thêm một bản sao và trả về
+    kết quả thành công đầu tiên. delay <= 0 tắt hedging.
+
+    Bản chính chạy trên pool riêng (HEDGE_PRIMARY_WORKERS thread) để thread gọi vẫn trả về
+    được ngay khi bản sao thắng; đồng hồ `delay` chỉ bắt đầu khi bản chính thực sự chạy,
+    nên thời gian xếp hàng trong pool không sinh bản sao. Số bản sao đang chạy bị giới hạn
+    bởi HEDGE_MAX_IN_FLIGHT.
+    """
+    if delay <= 0:
+        return func()
+
+    started = threading.Event()
+
+    def run_primary():
+        started.set()
+        return func()
+
+    primary = _primary_executor.submit(run_primary)
+    started.wait()
+    done, pending = wait({primary}, timeout=delay)
+    if not done and _acquire_hedge_slot():
+        metrics.incr("hedged_requests")
+
+        def run_hedge():
+            try:
+                return func()
+            finally:
+                _hedge_slots.release()
+
+        pending.add(_hedge_executor.submit(run_hedge))
+
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                # Lời gọi đồng bộ đang chạy không huỷ được; bản còn lại chạy nốt, kết quả bị bỏ qua
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+async def hedged_async(func, delay: float):
+    """Phiên bản asyncio của hedged(): bản sao chậm hơn bị huỷ khi có kết quả."""
+    if delay <= 0:
+        return await func()
+
+    tasks = {asyncio.ensure_future(func())}
+    done, tasks = await asyncio.wait(tasks, timeout=delay)
+    if not done and _acquire_hedge_slot():
+        metrics.incr("hedged_requests")
+        hedge = asyncio.ensure_future(func())
+        hedge.add_done_callback(lambda _: _hedge_slots.release())
+        tasks.add(hedge)
+
+    error = None
+    try:
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not tasks:
+                raise error
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,94 @@
+"""
+Sinh response_schema cho Gemini trực tiếp từ kiểu dữ liệu đầu ra (dataclass hoặc
+pydantic BaseModel, list[...] của chúng), thay cho schema viết tay và khuôn JSON
+trong prompt.
+
+- str/int/float/bool -> STRING/INTEGER/NUMBER/BOOLEAN, list[X] -> ARRAY,
+  Literal["a", "b"] -> STRING với "enum".
+- `X | None` / Optional[X] -> "nullable": True. Mọi trường đều nằm trong "required":
+  Gemini phải trả đủ khóa, trường optional được phép là null.
+- Mô tả trường lấy từ field(metadata={"description": ...}) của dataclass hoặc
+  Field(description=...) của pydantic.
+- dict tự do (không có cấu trúc cố định) bị bỏ qua vì Gemini không nhận OBJECT rỗng;
+  các trường đó được điền cục bộ.
+
+Schema được sinh một lần cho mỗi kiểu rồi cache; không sửa dict trả về.
+"""
+import types
+import typing
+from dataclasses import fields, is_dataclass
+
+from pydantic import BaseModel
+
+_NoneType = type(None)
+
+PRIMITIVES = {str: "STRING", int: "INTEGER", float: "NUMBER", bool: "BOOLEAN"}
+
+_schemas: dict = {}
+
+
+def _unwrap_optional(tp):
+    origin = typing.get_origin(tp)
+    if origin is typing.Union or origin is types.UnionType:
+        args = [arg for arg in typing.get_args(tp) if arg is not _NoneType]
+        if len(args) == 1:
+            return args[0], len(args) < len(typing.get_args(tp))
+        raise TypeError(f"Unsupported union type for response schema: {tp}")
+    return tp, False
+
+
+def _is_free_form(tp) -> bool:
+    return tp is dict or typing.get_origin(tp) is dict or tp is typing.Any
+
+
+def _fields(cls) -> list[tuple[str, object, str | None]]:
+    """(tên, kiểu, mô tả) của các trường, theo thứ tự khai báo."""
+    if is_dataclass(cls):
+        hints = typing.get_type_hints(cls)
+        return [(f.name, hints.get(f.name, f.type), f.metadata.get("description"))
+                for f in fields(cls) if f.init]
+    return [(name, info.annotation, info.description) for name, info in cls.model_fields.items()]
+
+
+def _object_schema(cls) -> dict:
+    properties = {}
+    for name, tp, description in _fields(cls):
+        if _is_free_form(_unwrap_optional(tp)[0]):
+            continue
+        prop = dict(response_schema(tp))
+        if description:
+            prop["description"] = description
+        properties[name] = prop
+    return {"type": "OBJECT", "properties": properties, "required": list(properties)}
+
+
+def response_schema(tp) -> dict:
+    """Trả về schema Gemini (dạng dict) cho kiểu `tp`, dựng một lần rồi cache."""
+    schema = _schemas.get(tp)
+    if schema is not None:
+        return schema
+
+    inner, nullable = _unwrap_optional(tp)
+    if nullable:
+        schema = {**response_schema(inner), "nullable": True}
+    elif typing.get_origin(inner) is typing.Literal:
+        schema = {"type": "STRING", "enum": [str(value) for value in typing.get_args(inner)]}
+    elif inner in PRIMITIVES:
+        schema = {"type": PRIMITIVES[inner]}
+    elif inner is list or typing.get_origin(inner) is list:
+        args = typing.get_args(inner)
+        if not args:
+            raise TypeError("list needs an item type for a response schema, e.g. list[str]")
+        schema = {"type": "ARRAY", "items": response_schema(args[0])}
+    elif isinstance(inner, type) and (is_dataclass(inner) or issubclass(inner, BaseModel)):
+        schema = _object_schema(inner)
+    else:
+        raise TypeError(f"Unsupported type for response schema: {tp}")
+
+    _schemas[tp] = schema
+    return schema
+
+
+def json_config(tp, **generation_config) -> dict:
+    """generation_config trả JSON theo schema của `tp`, kèm các tham số khác nếu có."""
+    return {**generation_config, "response_mime_type": "application/json", "response_schema": response_schema(tp)}
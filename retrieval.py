@@ -0,0 +1,162 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+
+# --- Cấu hình retrieval (ghi đè bằng biến môi trường) ---
+# "retrieval": chỉ gửi top-k đoạn liên quan; "full": gửi toàn bộ tài liệu như trước
+CHAT_CONTEXT_MODE = os.getenv("CHAT_CONTEXT_MODE", "retrieval")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "1200"))
+
+# Tham số chuẩn của BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Các từ xuất hiện ở hầu hết mọi đoạn, bỏ qua để index gọn hơn
+STOPWORDS = {
+    "và", "của", "là", "các", "những", "có", "được", "trong", "cho", "với",
+    "này", "đó", "một", "thì", "mà", "để", "đã", "sẽ", "đang", "về", "từ",
+    "khi", "như", "cũng", "ra", "vào", "lại", "nào", "gì", "hay", "hoặc",
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'Công nhân' -> 'Cong nhan'."""
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Tách token cho tiếng Việt. Một từ tiếng Việt thường gồm nhiều âm tiết
+    ("giai cấp", "công nhân"), nên ngoài từng âm tiết ta thêm cả cặp âm tiết
+    liền kề (bigram). Âm tiết bỏ dấu cũng được thêm vào để câu hỏi gõ không dấu
+    vẫn khớp với tài liệu có dấu.
+    """
+    syllables = _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+    tokens = []
+    for i, syllable in enumerate(syllables):
+        if syllable not in STOPWORDS:
+            tokens.append(syllable)
+            folded = fold_diacritics(syllable)
+            if folded != syllable:
+                tokens.append("~" + folded)
+        if i + 1 < len(syllables):
+            tokens.append(syllable + "_" + syllables[i + 1])
+    return tokens
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> list[str]:
+    """
+    Chia tài liệu thành các đoạn (passage) có độ dài tối đa `max_chars`.
+    Ưu tiên cắt theo đoạn văn, sau đó theo dòng, cuối cùng theo câu.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if len(line) <= max_chars:
+                pieces.append(line)
+                continue
+            for sentence in _SENTENCE_RE.split(line):
+                while len(sentence) > max_chars:
+                    pieces.append(sentence[:max_chars])
+                    sentence = sentence[max_chars:]
+                if sentence.strip():
+                    pieces.append(sentence.strip())
+
+    # Gộp các mảnh nhỏ liền kề để mỗi passage đủ ngữ cảnh
+    passages = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            passages.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+@dataclass
+class BM25Index:
+    passages: list[str]
+    term_freqs: list[Counter] = field(default_factory=list)
+    doc_freqs: Counter = field(default_factory=Counter)
+    doc_lengths: list[int] = field(default_factory=list)
+    avg_length: float = 0.0
+
+    @classmethod
+    def build(cls, passages: list[str]) -> "BM25Index":
+        index = cls(passages=passages)
+        for passage in passages:
+            tf = Counter(tokenize(passage))
+            index.term_freqs.append(tf)
+            index.doc_lengths.append(sum(tf.values()))
+            index.doc_freqs.update(tf.keys())
+        index.avg_length = (sum(index.doc_lengths) / len(passages)) if passages else 0.0
+        return index
+
+    def idf(self, term: str) -> float:
+        n = len(self.passages)
+        df = self.doc_freqs.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> list[tuple[int, float]]:
+        """Trả về danh sách (vị trí passage, điểm) theo thứ tự điểm giảm dần."""
+        query_terms = [t for t in set(tokenize(query)) if t in self.doc_freqs]
+        if not query_terms:
+            return []
+
+        idfs = {t: self.idf(t) for t in query_terms}
+        scores = []
+        for i, tf in enumerate(self.term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[i] / self.avg_length)
+            score = 0.0
+            for term in query_terms:
+                freq = tf.get(term)
+                if freq:
+                    score += idfs[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            if score > 0:
+                scores.append((i, score))
+
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:top_k]
+
+
+def build_index(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> BM25Index:
+    return BM25Index.build(split_passages(text, max_chars))
+
+
+def select_context(index: BM25Index, question: str, top_k: int = RETRIEVAL_TOP_K,
+                   mode: str = CHAT_CONTEXT_MODE) -> str | None:
+    """
+    Chọn phần tài liệu gửi kèm câu hỏi. Trả về None khi cần dùng toàn bộ tài liệu
+    như cách làm cũ: ở chế độ "full" hoặc khi không tìm thấy đoạn nào liên quan.
+    """
+    if mode == "full":
+        return None
+
+    hits = index.search(question, top_k)
+    if not hits:
+        return None
+
+    # Giữ thứ tự xuất hiện trong tài liệu để mô hình đọc mạch lạc hơn
+    selected = sorted(i for i, _ in hits)
+    return "\n\n...\n\n".join(index.passages[i] for i in selected)
@@ -1,23 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field, asdict 
+import hashlib
 import json
+import os
 import sys
+from typing import Literal
 from jsonschema import ValidationError
-import google.generativeai as genai
 
-from deserialize import deserialize_to_dataclass
+import advisor_cache
+import advisor_history
+import metrics
+import model_registry
+from deserialize import DeserializationError, deserialize_to_dataclass
+from response_schema import json_config
+from token_estimate import estimate_tokens
 
 # External API
 EXTERNAL_API_URL = "https://seoboostaiapi-e2bycxbjc4fmgggz.southeastasia-01.azurewebsites.net/api/RankTrackings"
 
-# Gemini model setup
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Gemini model setup (model cụ thể lấy từ model_registry)
+FEATURE = "seo_advisor"
+
+# Số nhóm lỗi được hỏi Gemini song song
+SEO_ADVISOR_PARALLELISM = int(os.getenv("SEO_ADVISOR_PARALLELISM", "4"))
+# Số nhóm tối đa gửi cho Gemini mỗi audit; các nhóm còn lại chỉ được tổng hợp cục bộ
+SEO_ADVISOR_MAX_GROUPS = int(os.getenv("SEO_ADVISOR_MAX_GROUPS", "40"))
+SEO_ADVISOR_MAX_AFFECTED_URLS = int(os.getenv("SEO_ADVISOR_MAX_AFFECTED_URLS", "20"))
+SEO_ADVISOR_SAMPLE_URLS = 5
+SEO_ADVISOR_SAMPLE_VALUES = 3
+# Nhóm lỗi được Gemini phân loại; khi không có lời khuyên từ Gemini (lỗi hoặc quá SEO_ADVISOR_MAX_GROUPS)
+# thì phân loại theo `important`: >= CRITICAL -> critical_issues, >= WARNING -> warnings, còn lại opportunities
+SEO_ADVISOR_CRITICAL_IMPORTANCE = int(os.getenv("SEO_ADVISOR_CRITICAL_IMPORTANCE", "3"))
+SEO_ADVISOR_WARNING_IMPORTANCE = int(os.getenv("SEO_ADVISOR_WARNING_IMPORTANCE", "2"))
+# Số dòng được serialize để ước lượng kích thước prompt cũ (chỉ dùng cho báo cáo token)
+SEO_ADVISOR_SAVINGS_SAMPLE_ROWS = 200
+SEO_ADVISOR_GROUP_OUTPUT_TOKENS = 512
+
+_group_executor = ThreadPoolExecutor(max_workers=SEO_ADVISOR_PARALLELISM, thread_name_prefix="seo-advisor")
 
 @dataclass
 class Elements:
     id: int
     url: str
     element: str
-    current_value: str
+    # null khi phần tử bị thiếu hẳn (ví dụ: không có thẻ <title>)
+    current_value: str | None
     status: str
     important: int
     description: str
@@ -64,144 +91,265 @@ class SEOAdvisorResponse:
     advice: AdviceSection
     next_steps_message: str
 
-def seo_advisor(request_data: AuditRequestModel) -> SEOAdvisorResponse:
-
-    # Chuẩn bị `failed_elements` thành chuỗi JSON để đưa vào prompt
-    failed_elements_dicts = [asdict(el) for el in request_data.failed_elements]
-    json_failed_elements_string = json.dumps(failed_elements_dicts, indent=2, ensure_ascii=False)
-
-    # Prompt đã được tinh gọn, không còn mô tả cấu trúc JSON nữa
-    # Vì cấu trúc đã được định nghĩa trong response_schema
-    prompt = (
-        f"""
-        Bạn là một chuyên gia tư vấn SEO và phân tích kỹ thuật. Dưới đây là dữ liệu kiểm tra SEO cho một trang web.
-
-        **Thông tin tổng quan:**
-        - URL: {request_data.url}
-        - Điểm tổng thể: {request_data.overall_score}
-        - Số lỗi Nghiêm trọng (Critical Issues): {request_data.critical_issue}
-        - Số Cảnh báo (Warnings): {request_data.warning}
-        - Số Cơ hội cải thiện (Opportunities): {request_data.opportunity}
-
-        **Chi tiết các phần tử không đạt kiểm tra (failed_elements):**
-        {json_failed_elements_string}
-
-        **Nhiệm vụ:** Dựa trên các thông tin trên, hãy phân tích và cung cấp lời khuyên cụ thể, dễ hiểu để khắc phục các vấn đề SEO.
-
-        **Hãy trả lời DUY NHẤT dưới dạng JSON theo cấu trúc sau. Đảm bảo tất cả các khóa và giá trị đều tuân thủ định dạng JSON hợp lệ, không có bất kỳ văn bản giải thích nào khác bên ngoài JSON.**
-
-        **Cấu trúc JSON mong muốn (TUÂN THỦ CHÍNH XÁC CÁC TRƯỜNG VÀ KIỂU DỮ LIỆU NÀY):**
-        ```json
-        {{
-          "summary": {{
-            "url": "{request_data.url}",
-            "overall_score": {request_data.overall_score},
-            "critical_issues_count": {request_data.critical_issue},
-            "warning_count": {request_data.warning},
-            "opportunity_count": {request_data.opportunity}
-          }},
-          "advice": {{
-            "critical_issues": [
-              {{
-                "issue_type": "Tên lỗi hoặc loại phần tử bị ảnh hưởng (Ví dụ: Thẻ <meta> bị thiếu nội dung)",
-                "importance": "Giải thích ngắn gọn tại sao lỗi này quan trọng và ảnh hưởng đến SEO (ngôn ngữ đơn giản).",
-                "fix_steps": [
-                  "Bước 1: Hướng dẫn hành động cụ thể và dễ hiểu.",
-                  "Bước 2: Hướng dẫn tiếp theo.",
-                  "...",
-                  "Gom nhóm các lỗi giống nhau lại và chỉ đưa ra một hướng dẫn chung cho loại lỗi đó."
-                ],
-                "affected_urls": [
-                  "Liệt kê các URL cụ thể bị ảnh hưởng bởi lỗi này. Nếu quá nhiều, có thể ghi 'Xem chi tiết trong báo cáo đầy đủ' hoặc chỉ liệt kê một vài ví dụ hàng đầu.",
-                  "..."
-                ],
-                "example_error_detail": {{
-                   // (TUỲ CHỌN) Sao chép chi tiết một lỗi cụ thể từ "failed_elements" để làm ví dụ minh họa
-                   // ví dụ: {{ "id": 7, "element": "meta", "description": "Thẻ <meta> không có thuộc tính content hoặc nội dung bị rỗng." }}
-                }}
-              }}
-            ],
-            "warnings": [
-              {{
-                "issue_type": "Tên lỗi hoặc loại phần tử bị ảnh hưởng (Ví dụ: Thẻ <script> không có src)",
-                "importance": "Giải thích ngắn gọn tầm quan trọng của cảnh báo này.",
-                "fix_steps": [
-                  "Bước 1: Hướng dẫn khắc phục cụ thể và dễ hiểu.",
-                  "...",
-                  "Gom nhóm các lỗi giống nhau lại."
-                ],
-                "affected_urls": [
-                  "Liệt kê các URL bị ảnh hưởng."
-                ]
-              }}
-            ],
-            "opportunities": [
-              {{
-                "issue_type": "Tên cơ hội cải thiện (Ví dụ: Thẻ <button> không có nội dung)",
-                "importance": "Giải thích tại sao đây là một cơ hội để tối ưu hóa.",
-                "fix_steps": [
-                  "Bước 1: Hướng dẫn cải thiện cụ thể và dễ hiểu.",
-                  "...",
-                  "Gom nhóm các lỗi giống nhau lại."
-                ],
-                "affected_urls": [
-                  "Liệt kê các URL bị ảnh hưởng."
-                ]
-              }}
-            ]
-          }},
-          "next_steps_message": "Sau khi bạn đã thực hiện các chỉnh sửa này, hãy chạy lại công cụ kiểm tra SEO của chúng tôi để xem điểm số của bạn đã cải thiện như thế nào và xác nhận các lỗi đã được khắc phục. Chúng tôi sẽ giúp bạn theo dõi tiến độ!"
-        }}
-        ```
-
-        **LƯU Ý QUAN TRỌNG:**
-        -   Đối với mỗi loại lỗi (critical_issues, warnings, opportunities), nếu không có lỗi nào thuộc loại đó, hãy trả về một mảng rỗng (ví dụ: `"critical_issues": []`).
-        -   Hãy cố gắng gom nhóm các lỗi có cùng `element` và `description` vào cùng một mục `issue_type` để người dùng dễ theo dõi.
-        -   Sắp xếp thứ tự các lỗi trong mỗi danh mục dựa trên `important` (nếu có) hoặc mức độ phổ biến.
-        -   Hãy thay thế các giá trị placeholder như `"Tên lỗi hoặc loại phần tử..."` bằng nội dung thực tế dựa trên dữ liệu `failed_elements`.
-        """
+NEXT_STEPS_MESSAGE = (
+    "Sau khi bạn đã thực hiện các chỉnh sửa này, hãy chạy lại công cụ kiểm tra SEO của chúng tôi để xem điểm số "
+    "của bạn đã cải thiện như thế nào và xác nhận các lỗi đã được khắc phục. Chúng tôi sẽ giúp bạn theo dõi tiến độ!"
+)
+
+
+# Nhóm trong AdviceSection
+Category = Literal["critical_issues", "warnings", "opportunities"]
+
+
+@dataclass
+class GroupAdvice:
+    category: Category = field(metadata={
+        "description": "Phân loại: critical_issues (lỗi nghiêm trọng, ảnh hưởng trực tiếp tới index/xếp hạng), "
+                       "warnings (nên sửa sớm), opportunities (cơ hội cải thiện thêm)."})
+    issue_type: str = field(metadata={
+        "description": "Tên lỗi hoặc loại phần tử bị ảnh hưởng (ví dụ: Thẻ <meta> bị thiếu nội dung)."})
+    importance: str = field(metadata={
+        "description": "Giải thích ngắn gọn tại sao lỗi này quan trọng và ảnh hưởng đến SEO (ngôn ngữ đơn giản)."})
+    fix_steps: list[str] = field(default_factory=list, metadata={
+        "description": "Các bước hành động cụ thể, áp dụng chung cho mọi URL trong nhóm."})
+
+
+# Đổi khi GroupAdvice thay đổi để lời khuyên cũ trong advisor_history được hỏi lại
+GROUP_ADVICE_VERSION = 2
+
+# Mỗi nhóm lỗi chỉ cần phân loại và lời khuyên; URL và ví dụ được ghép cục bộ
+group_generation_config = json_config(
+    GroupAdvice, candidate_count=1, max_output_tokens=SEO_ADVISOR_GROUP_OUTPUT_TOKENS, temperature=0.7)
+
+@dataclass
+class ElementGroup:
+    """
+    Tổng hợp các failed_elements cùng (element, description, status): số lần gặp,
+    các URL bị ảnh hưởng (theo thứ tự xuất hiện) và vài giá trị mẫu. Các dòng trùng
+    hệt nhau (chỉ khác id) được gộp và đếm vào `duplicates`.
+    """
+    element: str
+    description: str
+    status: str
+    important: int
+    count: int = 0
+    duplicates: int = 0
+    urls: list[str] = field(default_factory=list)
+    sample_values: list[str | None] = field(default_factory=list)
+    example: dict | None = None
+    _seen_rows: set = field(default_factory=set, repr=False)
+    _seen_urls: set = field(default_factory=set, repr=False)
+
+    @property
+    def default_category(self) -> Category:
+        """Phân loại cục bộ theo `important`, chỉ dùng khi không có phân loại từ Gemini."""
+        if self.important >= SEO_ADVISOR_CRITICAL_IMPORTANCE:
+            return "critical_issues"
+        if self.important >= SEO_ADVISOR_WARNING_IMPORTANCE:
+            return "warnings"
+        return "opportunities"
+
+    def add(self, element: Elements):
+        row = (element.url, element.current_value, element.important)
+        if row in self._seen_rows:
+            self.duplicates += 1
+            return
+        self._seen_rows.add(row)
+        self.count += 1
+        self.important = max(self.important, element.important)
+        if element.url not in self._seen_urls:
+            self._seen_urls.add(element.url)
+            self.urls.append(element.url)
+        value = element.current_value[:200] if element.current_value is not None else None
+        if len(self.sample_values) < SEO_ADVISOR_SAMPLE_VALUES and value not in self.sample_values:
+            self.sample_values.append(value)
+        if self.example is None:
+            self.example = asdict(element)
+            self.example.pop("audit_repost_id", None)
+
+    @property
+    def key(self) -> str:
+        return json.dumps([self.element, self.description, self.status], ensure_ascii=False)
+
+    def signature(self) -> str:
+        """Chữ ký phần tóm tắt gửi cho Gemini: giống nhau thì lời khuyên cũ vẫn dùng được."""
+        return hashlib.sha256(f"{GROUP_ADVICE_VERSION}:{self.condensed()}".encode("utf-8")).hexdigest()[:32]
+
+    def condensed(self) -> str:
+        """Phần dữ liệu của nhóm được đưa vào prompt (JSON gọn)."""
+        return json.dumps({
+            "element": self.element,
+            "description": self.description,
+            "status": self.status,
+            "important": self.important,
+            "occurrences": self.count,
+            "affected_url_count": len(self.urls),
+            "sample_urls": self.urls[:SEO_ADVISOR_SAMPLE_URLS],
+            "sample_current_values": self.sample_values,
+        }, ensure_ascii=False, separators=(",", ":"))
+
+
+def aggregate_elements(failed_elements: list[Elements]) -> list[ElementGroup]:
+    """
+    Tiền xử lý cục bộ, tất định: gom nhóm theo (element, description, status), bỏ dòng
+    trùng, rồi sắp xếp theo `important` (cao trước), cùng mức thì nhóm gặp nhiều hơn trước.
+    """
+    groups: dict[tuple, ElementGroup] = {}
+    for element in failed_elements:
+        key = (element.element, element.description, element.status)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ElementGroup(element.element, element.description, element.status, element.important)
+        group.add(element)
+    return sorted(groups.values(), key=lambda group: (-group.important, -group.count))
+
+
+def prompt_token_savings(failed_elements: list[Elements], groups: list[ElementGroup]) -> dict:
+    """
+    So sánh số token (ước lượng) của dữ liệu audit nếu đưa nguyên failed_elements vào
+    prompt như trước với phần tóm tắt thực sự được gửi cho Gemini. Kích thước prompt cũ
+    được ngoại suy từ một mẫu dòng rải đều, không serialize cả audit.
+    """
+    raw = 0
+    if failed_elements:
+        sample = failed_elements[::max(1, len(failed_elements) // SEO_ADVISOR_SAVINGS_SAMPLE_ROWS)]
+        sample_tokens = estimate_tokens(
+            json.dumps([asdict(element) for element in sample], indent=2, ensure_ascii=False))
+        raw = round(sample_tokens * len(failed_elements) / len(sample))
+    condensed = sum(estimate_tokens(group.condensed()) for group in groups)
+    return {"raw_tokens": raw, "condensed_tokens": condensed, "tokens_saved": raw - condensed}
+
+
+def build_group_prompt(request_data: AuditRequestModel, group: ElementGroup) -> str:
+    return f"""
+    Bạn là một chuyên gia tư vấn SEO và phân tích kỹ thuật. Trang web {request_data.url} (điểm tổng thể {request_data.overall_score}) có một nhóm lỗi SEO giống nhau sau (đã được tổng hợp sẵn):
+    {group.condensed()}
+
+    **Nhiệm vụ:** Viết lời khuyên cụ thể, dễ hiểu cho nhóm lỗi này.
+    """
+
+
+def advise_group(request_data: AuditRequestModel, group: ElementGroup) -> GroupAdvice:
+    gemini_response = model_registry.generate_content(
+        FEATURE, contents=build_group_prompt(request_data, group), generation_config=group_generation_config)
+    return deserialize_to_dataclass(GroupAdvice, json.loads(gemini_response.text))
+
+
+def build_issue(group: ElementGroup, advice: GroupAdvice) -> IssueDetail:
+    return IssueDetail(
+        issue_type=advice.issue_type,
+        importance=advice.importance,
+        fix_steps=advice.fix_steps,
+        affected_urls=group.urls[:SEO_ADVISOR_MAX_AFFECTED_URLS],
+        example_error_detail=group.example,
     )
 
-    if 'model' not in globals():
-        raise RuntimeError(
-            "Google Gemini model not initialized. Please ensure 'genai.configure' and 'model = genai.GenerativeModel(...)' are set up.")
-
-    try:
-        gemini_response = model.generate_content(
-            contents=prompt,
-            generation_config=genai.types.GenerationConfig(
-                candidate_count=1,
-                max_output_tokens=2048,
-                temperature=0.7
-            )
-        )
-
-        advisor_text = ""
-        if gemini_response and gemini_response.candidates:
-            advisor_text = gemini_response.candidates[0].content.parts[0].text
-        elif gemini_response and hasattr(gemini_response, 'text'):
-            advisor_text = gemini_response.text
-
-        # Cần làm sạch chuỗi JSON nếu nó kèm theo markdown code block
-        json_str = advisor_text.strip()
-        if json_str.startswith("```json") and json_str.endswith("```"):
-            json_str = json_str[len("```json"):-len("```")].strip()
-        
-        # Dùng json.loads để parse chuỗi JSON thành dictionary
-        response_data = json.loads(json_str)
-
-        # Sử dụng hàm deserialize_to_dataclass để chuyển đổi dictionary thành SEOAdvisorResponse
-        response_entity = deserialize_to_dataclass(SEOAdvisorResponse, response_data)
-
-        return response_entity
-
-    except json.JSONDecodeError as e:
-        print(f"Lỗi JSONDecodeError từ phản hồi của Gemini (có thể do AI trả về JSON không hợp lệ): {e}", file=sys.stderr)
-        print(f"Phản hồi thô từ Gemini: {advisor_text}", file=sys.stderr)
-        raise # Ném lại ngoại lệ
-
-    except Exception as e:
-        print(f"Đã xảy ra lỗi không mong đợi khi gọi Gemini API hoặc xử lý phản hồi (sau JSONDecodeError): {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
-        raise
\ No newline at end of file
+
+def fallback_issue(group: ElementGroup) -> IssueDetail:
+    """Mục tạo cục bộ khi nhóm không được gửi cho Gemini (quá SEO_ADVISOR_MAX_GROUPS) hoặc Gemini lỗi."""
+    return IssueDetail(
+        issue_type=f"{group.element}: {group.description}",
+        importance=f"Gặp {group.count} lần trên {len(group.urls)} URL.",
+        fix_steps=[],
+        affected_urls=group.urls[:SEO_ADVISOR_MAX_AFFECTED_URLS],
+        example_error_detail=group.example,
+    )
+
+
+def serialize_response(response: SEOAdvisorResponse) -> str:
+    return json.dumps(asdict(response), ensure_ascii=False)
+
+
+def stored_advice(previous: dict[str, tuple[str, dict]]) -> dict[str, GroupAdvice]:
+    """
+    Dựng lại GroupAdvice từ lịch sử. Mục không còn khớp GroupAdvice hiện tại (lưu bởi phiên bản
+    cũ, ví dụ chưa có `category`) bị bỏ khỏi `previous`, tức là coi như chưa từng tư vấn nhóm đó.
+    """
+    advice = {}
+    for key, (_, data) in list(previous.items()):
+        try:
+            advice[key] = deserialize_to_dataclass(GroupAdvice, data)
+        except DeserializationError as e:
+            print(f"SEO advisor: dropping incompatible history for group {key}: {e}", file=sys.stderr)
+            del previous[key]
+    return advice
+
+
+def seo_advisor(request_data: AuditRequestModel, cache_key: str | None = None) -> SEOAdvisorResponse:
+    """
+    Map-reduce: gom nhóm failed_elements cục bộ, hỏi Gemini song song cho từng nhóm
+    (prompt và output nhỏ, không phụ thuộc kích thước audit) rồi ghép lại. Summary,
+    affected_urls và next_steps_message được tính cục bộ.
+
+    Tư vấn tăng dần theo (user_id, url): nhóm có cùng chữ ký với lần audit trước dùng lại
+    lời khuyên đã lưu trong advisor_history, chỉ nhóm mới hoặc thay đổi được gửi cho Gemini.
+
+    Với `cache_key` (advisor_cache.fingerprint), kết quả đầy đủ được lưu vào
+    advisor_cache; kết quả có nhóm phải dùng bản dự phòng vì Gemini lỗi thì không lưu.
+    """
+    groups = aggregate_elements(request_data.failed_elements)
+    advised = groups[:SEO_ADVISOR_MAX_GROUPS]
+
+    previous = advisor_history.load(request_data.user_id, request_data.url)
+    stored = stored_advice(previous)
+    signatures = {group.key: group.signature() for group in advised}
+    changed = [group for group in advised if previous.get(group.key, (None,))[0] != signatures[group.key]]
+    metrics.incr("seo_advisor_groups_reused", len(advised) - len(changed))
+    metrics.incr("seo_advisor_groups_advised", len(changed))
+
+    savings = prompt_token_savings(request_data.failed_elements, changed)
+    metrics.incr("seo_advisor_prompt_tokens_raw", savings["raw_tokens"])
+    metrics.incr("seo_advisor_prompt_tokens_condensed", savings["condensed_tokens"])
+    metrics.incr("seo_advisor_prompt_tokens_saved", max(0, savings["tokens_saved"]))
+    print(f"SEO advisor: audit {request_data.id}: {len(request_data.failed_elements)} elements -> "
+          f"{len(groups)} groups ({len(advised) - len(changed)} reused), ~{savings['tokens_saved']} prompt tokens saved "
+          f"({savings['raw_tokens']} -> {savings['condensed_tokens']})", file=sys.stderr)
+
+    def run(group: ElementGroup):
+        try:
+            return advise_group(request_data, group), None
+        except Exception as e:
+            return None, e
+
+    results = dict(zip((group.key for group in changed), _group_executor.map(run, changed)))
+
+    # Không nhóm nào có lời khuyên (mới hay cũ): báo lỗi để route trả 503/500 thay vì một kết quả rỗng
+    errors = [error for _, error in results.values() if error is not None]
+    if changed and len(errors) == len(changed) and not any(group.key in previous for group in advised):
+        raise errors[0]
+
+    advice = AdviceSection()
+    history: dict[str, tuple[str, dict]] = {}
+    for group in advised:
+        group_advice, error = results.get(group.key, (None, None))
+        if group.key not in results:
+            history[group.key] = previous[group.key]
+            group_advice = stored[group.key]
+        elif error is None:
+            history[group.key] = (signatures[group.key], asdict(group_advice))
+        else:
+            print(f"SEO advisor: group '{group.element}/{group.description}' failed: {error}", file=sys.stderr)
+            # Giữ lời khuyên cũ (chữ ký cũ, để lần sau hỏi lại) nếu có, không thì dùng bản dự phòng
+            if group.key in previous:
+                history[group.key] = previous[group.key]
+                group_advice = stored[group.key]
+        issue = build_issue(group, group_advice) if group_advice is not None else fallback_issue(group)
+        category = group_advice.category if group_advice is not None else group.default_category
+        getattr(advice, category).append(issue)
+
+    advisor_history.save(request_data.user_id, request_data.url, history)
+
+    for group in groups[SEO_ADVISOR_MAX_GROUPS:]:
+        getattr(advice, group.default_category).append(fallback_issue(group))
+
+    summary = SummaryOutput(
+        url=request_data.url,
+        overall_score=request_data.overall_score,
+        critical_issues_count=request_data.critical_issue,
+        warning_count=request_data.warning,
+        opportunity_count=request_data.opportunity,
+    )
+    response = SEOAdvisorResponse(summary=summary, advice=advice, next_steps_message=NEXT_STEPS_MESSAGE)
+    if cache_key is not None and not errors:
+        advisor_cache.cache.put(cache_key, serialize_response(response))
+    return response
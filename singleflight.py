@@ -0,0 +1,75 @@
+"""
+Single-flight: các lời gọi đồng thời cùng khóa dùng chung một lần thực thi.
+
+Lời gọi đầu tiên (leader) chạy hàm; các lời gọi đến trong lúc leader đang chạy
+chỉ chờ và nhận cùng kết quả (hoặc cùng exception). Khi leader xong, khóa được
+giải phóng nên lời gọi sau đó sẽ chạy lại từ đầu.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+
+class Group:
+    """`name` dùng cho bộ đếm singleflight_deduplicated_<name> trong /metrics."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[object, Future] = {}
+        self._async_calls: dict[object, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Chạy func() cho khóa `key`, hoặc chờ lần chạy đang diễn ra của cùng khóa."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            self._count_shared()
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, func):
+        """
+        Phiên bản asyncio: func là hàm trả về coroutine. Lần chạy dùng chung là một task
+        riêng; leader và các follower đều chờ qua shield, nên request bị huỷ (client ngắt
+        kết nối) chỉ huỷ chính nó, không huỷ lần gọi của các request khác.
+        """
+        task = self._async_calls.get(key)
+        if task is not None:
+            self._count_shared()
+        else:
+            task = asyncio.get_running_loop().create_task(func())
+            self._async_calls[key] = task
+            task.add_done_callback(lambda done: self._finish_async(key, done))
+        return await asyncio.shield(task)
+
+    def _finish_async(self, key, task: asyncio.Task):
+        if self._async_calls.get(key) is task:
+            del self._async_calls[key]
+        # Tránh cảnh báo "exception was never retrieved" khi mọi người chờ đã bị huỷ
+        if not task.cancelled():
+            task.exception()
+
+    def _count_shared(self):
+        metrics.incr("singleflight_deduplicated")
+        metrics.incr(f"singleflight_deduplicated_{self.name}")
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._async_calls)
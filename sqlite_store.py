@@ -0,0 +1,32 @@
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    File SQLite dùng chung giữa các thread (mỗi thread một connection) và giữa các
+    tiến trình (WAL). Connection ở chế độ autocommit; transaction ghi mở bằng
+    "BEGIN IMMEDIATE" bên trong `with conn:`.
+    """
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    conn.executescript(self.schema)
+                    self._initialized = True
+        return conn
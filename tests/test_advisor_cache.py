@@ -0,0 +1,63 @@
+import time
+
+from advisor_cache import AdvisorCache, fingerprint
+
+MODEL = "gemini-test"
+
+
+def make_audit(**overrides) -> dict:
+    audit = {
+        "id": 10, "user_id": 7, "url": "https://example.com", "overall_score": 60, "critical_issue": 1,
+        "warning": 1, "opportunity": 0, "passed_check": "",
+        "failed_elements": [
+            {"id": 1, "url": "https://example.com/a", "element": "title", "current_value": None, "status": "failed",
+             "important": 3, "description": "Thiếu title", "audit_repost_id": 10},
+            {"id": 2, "url": "https://example.com/b", "element": "meta", "current_value": "ngắn", "status": "failed",
+             "important": 2, "description": "Meta quá ngắn", "audit_repost_id": 10},
+        ],
+    }
+    return {**audit, **overrides}
+
+
+def test_resubmitted_audit_has_the_same_fingerprint():
+    audit = make_audit()
+    resubmitted = make_audit(id=11, failed_elements=[
+        {**element, "id": element["id"] + 100, "audit_repost_id": 11}
+        for element in reversed(audit["failed_elements"])
+    ])
+
+    assert fingerprint(audit, MODEL) == fingerprint(resubmitted, MODEL)
+
+
+def test_content_user_and_model_change_the_fingerprint():
+    key = fingerprint(make_audit(), MODEL)
+    changed_element = make_audit()
+    changed_element["failed_elements"][1]["current_value"] = "dài hơn"
+
+    assert fingerprint(changed_element, MODEL) != key
+    assert fingerprint(make_audit(user_id=8), MODEL) != key
+    assert fingerprint(make_audit(overall_score=61), MODEL) != key
+    assert fingerprint(make_audit(), "gemini-other") != key
+
+
+def test_malformed_audit_is_not_cached():
+    assert fingerprint([], MODEL) is None
+    assert fingerprint(make_audit(failed_elements={"id": 1}), MODEL) is None
+    assert fingerprint(make_audit(failed_elements=["title"]), MODEL) is None
+
+
+def test_cache_evicts_least_recently_used_and_expires():
+    cache = AdvisorCache(max_entries=2, ttl=60)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+    short = AdvisorCache(max_entries=2, ttl=0.01)
+    short.put("a", "A")
+    time.sleep(0.02)
+    assert short.get("a") is None
+    assert len(short) == 0
@@ -0,0 +1,26 @@
+from answer_cache import AnswerCache
+
+QUESTION = "Hội nghị Trung ương 8 năm 1941 có nội dung gì?"
+
+
+def make_cache() -> AnswerCache:
+    cache = AnswerCache(max_entries=10, ttl=60, similarity=0.85)
+    cache.put("hcm", "v1", QUESTION, {"answer": "Hội nghị lần thứ 8"})
+    return cache
+
+
+def test_near_duplicate_question_hits():
+    cache = make_cache()
+    assert cache.get("hcm", "v1", "  hội nghị trung ương 8 năm 1941 có nội dung gì ") == {"answer": "Hội nghị lần thứ 8"}
+    assert cache.get("hcm", "v1", "Hội nghị Trung ương 8 năm 1941 có nội dung gì vậy?") == {"answer": "Hội nghị lần thứ 8"}
+
+
+def test_question_differing_only_by_number_misses():
+    cache = make_cache()
+    assert cache.get("hcm", "v1", QUESTION.replace("8", "6")) is None
+    assert cache.get("hcm", "v1", QUESTION.replace("1941", "1945")) is None
+
+
+def test_other_corpus_version_misses():
+    cache = make_cache()
+    assert cache.get("hcm", "v2", QUESTION) is None
@@ -0,0 +1,92 @@
+import pytest
+
+import chat_engine
+from answer_cache import AnswerCache
+from chat_engine import ContextCache, CorpusRegistry
+from token_estimate import estimate_tokens
+
+QUESTION_MARKER = "Câu hỏi:"
+
+
+class FakeModel:
+    def __init__(self, handle):
+        self.handle = handle
+
+
+class FakeChatClient:
+    """Thay GeminiChatClient: ghi lại context cache được tạo/xoá và số token tiền tố mỗi request."""
+
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+        self.prefix_tokens = []
+        self.cached_models = []
+
+    def create_cached_context(self, display_name: str, document: str, ttl: int):
+        handle = {"name": display_name, "document": document}
+        self.created.append(handle)
+        return FakeModel(handle), handle
+
+    def delete_cached_context(self, cached):
+        self.deleted.append(cached)
+
+    def generate(self, prompt: str, cached_model=None) -> str:
+        # Tiền tố = mọi thứ gửi kèm trước câu hỏi (hướng dẫn hệ thống + tài liệu)
+        prefix = prompt[:prompt.rindex(QUESTION_MARKER)].strip()
+        self.prefix_tokens.append(estimate_tokens(prefix) if prefix else 0)
+        self.cached_models.append(cached_model)
+        return "answer"
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    document = tmp_path / "tu_lieu_test.txt"
+    document.write_text("Chủ tịch Hồ Chí Minh sinh năm 1890 tại Nghệ An.\n" * 200, encoding="utf-8")
+
+    client = FakeChatClient()
+    monkeypatch.setattr(chat_engine, "registry", CorpusRegistry(str(tmp_path)))
+    monkeypatch.setattr(chat_engine, "client", client)
+    monkeypatch.setattr(chat_engine, "context_cache", ContextCache(client, ttl=3600))
+    monkeypatch.setattr(chat_engine, "answer_cache", AnswerCache(max_entries=0))
+    # Luôn cần toàn bộ tài liệu, tức là luôn đi qua context cache
+    monkeypatch.setattr(chat_engine, "select_context", lambda index, question: None)
+    return client, document
+
+
+def test_cache_hit_sends_only_the_question(chat):
+    client, _ = chat
+
+    chat_engine.ask("test", "Bác Hồ sinh năm nào?")
+    chat_engine.ask("test", "Bác Hồ sinh ở đâu?")
+
+    assert len(client.created) == 1
+    assert client.prefix_tokens == [0, 0]
+    assert all(model is not None and model.handle is client.created[0] for model in client.cached_models)
+
+
+def test_editing_corpus_creates_new_cache_and_deletes_old(chat):
+    client, document = chat
+
+    chat_engine.ask("test", "Bác Hồ sinh năm nào?")
+    old_handle = client.created[0]
+
+    document.write_text("Chủ tịch Hồ Chí Minh sinh ngày 19/5/1890 tại làng Kim Liên.\n" * 300, encoding="utf-8")
+    chat_engine.ask("test", "Bác Hồ sinh năm nào?")
+
+    assert len(client.created) == 2
+    assert client.deleted == [old_handle]
+    assert "Kim Liên" in client.created[1]["document"]
+    assert client.cached_models[-1].handle is client.created[1]
+    assert client.prefix_tokens == [0, 0]
+
+
+def test_without_context_cache_the_document_is_sent_every_time(chat, monkeypatch):
+    client, _ = chat
+    monkeypatch.setattr(chat_engine, "context_cache", ContextCache(client, ttl=0))
+
+    chat_engine.ask("test", "Bác Hồ sinh năm nào?")
+    chat_engine.ask("test", "Bác Hồ sinh ở đâu?")
+
+    assert client.created == []
+    assert len(client.prefix_tokens) == 2
+    assert all(tokens > 1000 for tokens in client.prefix_tokens)
@@ -0,0 +1,32 @@
+import os
+
+from chat_engine import CorpusStore
+
+
+def write(path, text: str, mtime_ns: int):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_text_is_decoded_once_per_version(tmp_path):
+    document = tmp_path / "tu_lieu_test.txt"
+    write(document, "Hồ Chí Minh\n" * 10, 1_000_000_000)
+    store = CorpusStore()
+
+    assert store.read_text(str(document)) is store.read_text(str(document))
+    with store.read_bytes(str(document)) as content:
+        assert isinstance(content, memoryview)
+        assert bytes(content[:3]) == "Hồ".encode("utf-8")[:3]
+
+
+def test_changed_file_is_remapped_and_old_map_closed(tmp_path):
+    document = tmp_path / "tu_lieu_test.txt"
+    write(document, "phiên bản 1\n", 1_000_000_000)
+    store = CorpusStore()
+    store.read_text(str(document))
+    old_map = store._maps[str(document)][1]
+
+    write(document, "phiên bản 2 dài hơn\n", 2_000_000_000)
+
+    assert store.read_text(str(document)) == "phiên bản 2 dài hơn\n"
+    assert old_map.closed
@@ -0,0 +1,87 @@
+from dataclasses import dataclass, field
+from typing import Literal
+
+import pytest
+
+from deserialize import DeserializationError, deserialize_to_dataclass
+from seo_advisor import AuditRequestModel, GroupAdvice
+
+
+def make_element(**overrides) -> dict:
+    element = {"id": 1, "url": "https://example.com", "element": "title", "current_value": "Trang chủ",
+               "status": "failed", "important": 3, "description": "Thẻ title quá ngắn", "audit_repost_id": None}
+    return {**element, **overrides}
+
+
+def make_audit(*elements) -> dict:
+    return {"id": 1, "user_id": 7, "url": "https://example.com", "overall_score": 60, "critical_issue": 1,
+            "warning": 0, "opportunity": 0, "passed_check": "", "failed_elements": list(elements)}
+
+
+def test_valid_audit_is_converted():
+    audit = deserialize_to_dataclass(AuditRequestModel, make_audit(make_element(), make_element(current_value=None)))
+
+    assert len(audit.failed_elements) == 2
+    assert audit.failed_elements[1].current_value is None
+
+
+def test_optional_field_may_be_missing():
+    element = make_element()
+    del element["audit_repost_id"]
+
+    audit = deserialize_to_dataclass(AuditRequestModel, make_audit(element))
+    assert audit.failed_elements[0].audit_repost_id is None
+
+
+def test_numbers_and_numeric_strings_are_coerced_like_before():
+    audit = deserialize_to_dataclass(AuditRequestModel, make_audit(make_element(current_value=42, important="3")))
+
+    assert audit.failed_elements[0].current_value == "42"
+    assert audit.failed_elements[0].important == 3
+
+
+@pytest.mark.parametrize("overrides, path", [
+    ({"important": "cao"}, "failed_elements[0].important"),
+    ({"important": True}, "failed_elements[0].important"),
+    ({"important": {"level": 3}}, "failed_elements[0].important"),
+    ({"current_value": ["a", "b"]}, "failed_elements[0].current_value"),
+    ({"url": None}, "failed_elements[0].url"),
+])
+def test_rejected_leaf_values_report_their_path(overrides, path):
+    with pytest.raises(DeserializationError) as excinfo:
+        deserialize_to_dataclass(AuditRequestModel, make_audit(make_element(), make_element(**overrides)))
+
+    assert excinfo.value.path == path.replace("[0]", "[1]")
+
+
+def test_missing_required_field_is_rejected():
+    element = make_element()
+    del element["important"]
+
+    with pytest.raises(DeserializationError, match="failed_elements\\[0\\].important: missing required field"):
+        deserialize_to_dataclass(AuditRequestModel, make_audit(element))
+
+
+def test_literal_accepts_only_listed_values():
+    advice = {"category": "warnings", "issue_type": "x", "importance": "y", "fix_steps": ["z"]}
+    assert deserialize_to_dataclass(GroupAdvice, advice).category == "warnings"
+
+    with pytest.raises(DeserializationError, match="category: expected one of"):
+        deserialize_to_dataclass(GroupAdvice, {**advice, "category": "urgent"})
+
+
+@dataclass
+class Node:
+    name: str
+    kind: Literal["leaf", "branch"] = "leaf"
+    children: list["Node"] = field(default_factory=list)
+
+
+def test_recursive_dataclass():
+    tree = deserialize_to_dataclass(Node, {"name": "root", "kind": "branch", "children": [
+        {"name": "a"}, {"name": "b", "kind": "branch", "children": [{"name": "c"}]}]})
+
+    assert tree.children[1].children[0] == Node("c")
+    with pytest.raises(DeserializationError) as excinfo:
+        deserialize_to_dataclass(Node, {"name": "root", "children": [{"name": "a", "kind": "trunk"}]})
+    assert excinfo.value.path == "children[0].kind"
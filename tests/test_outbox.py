@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+import outbox
+from sqlite_store import SQLiteStore
+
+KIND = "test"
+
+
+@pytest.fixture
+def box(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox, "_store", SQLiteStore(str(tmp_path / "outbox.sqlite3"), outbox.SCHEMA))
+    # drain_once được gọi trực tiếp trong test, không chạy thread gửi nền
+    monkeypatch.setattr(outbox, "start_worker", lambda: None)
+    monkeypatch.setattr(outbox, "_heartbeat", None)
+    monkeypatch.setattr(outbox, "_handlers", {})
+    return outbox
+
+
+def statuses(batch_id: str) -> list[str]:
+    return [item["status"] for item in outbox.batch_status(batch_id)["items"]]
+
+
+def test_delivered_rows_are_marked_delivered(box):
+    sent = []
+    box.register_handler(KIND, lambda payloads: sent.extend(payloads) or [None] * len(payloads))
+
+    batch = box.enqueue(KIND, [{"n": 1}, {"n": 2}], labels=["a", "b"])
+
+    assert box.drain_once() == 2
+    assert sent == [{"n": 1}, {"n": 2}]
+    assert statuses(batch["outbox_id"]) == ["delivered", "delivered"]
+    assert box.drain_once() == 0
+
+
+def test_failed_rows_are_retried_then_kept_as_failed(box, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE_DELAY", 0)
+    box.register_handler(KIND, lambda payloads: ["backend down" if payload["n"] == 2 else None
+                                                 for payload in payloads])
+
+    batch = box.enqueue(KIND, [{"n": 1}, {"n": 2}])
+
+    assert box.drain_once() == 2
+    assert statuses(batch["outbox_id"]) == ["delivered", "pending"]
+    assert box.drain_once() == 1
+    items = box.batch_status(batch["outbox_id"])["items"]
+    assert [item["status"] for item in items] == ["delivered", "failed"]
+    assert items[1]["attempts"] == 2 and items[1]["last_error"] == "backend down"
+
+
+def test_expired_lease_is_claimed_again(box):
+    box.register_handler(KIND, lambda payloads: [None] * len(payloads))
+    box.enqueue(KIND, [{"n": 1}])
+
+    now = time.time()
+    assert len(box._claim(now)) == 1
+    # Tiến trình giữ lease đã chết: trước khi hết hạn không ai nhận được, sau đó thì được
+    assert box._claim(now + 1) == []
+    assert len(box._claim(now + outbox.OUTBOX_LEASE_SECONDS + 1)) == 1
+
+
+def test_heartbeat_keeps_lease_during_slow_batch(box, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE_SECONDS", 0.6)
+    claimed_by_others = []
+    handler_started = threading.Event()
+
+    def slow_handler(payloads):
+        handler_started.set()
+        time.sleep(1.5)
+        return [None] * len(payloads)
+
+    box.register_handler(KIND, slow_handler)
+    batch = box.enqueue(KIND, [{"n": 1}, {"n": 2}])
+
+    drainer = threading.Thread(target=box.drain_once)
+    drainer.start()
+    handler_started.wait(5)
+    # Một tiến trình khác thử nhận lô sau khi lease ban đầu đã hết hạn
+    time.sleep(1.0)
+    claimed_by_others.extend(box._claim(time.time()))
+    drainer.join(5)
+
+    assert claimed_by_others == []
+    assert statuses(batch["outbox_id"]) == ["delivered", "delivered"]
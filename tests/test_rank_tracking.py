@@ -0,0 +1,84 @@
+import pytest
+
+import rank_tracking
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = "rejected" if not self.ok else ""
+
+
+class FakeBackend:
+    """Thay backend_request: ghi lại body của từng POST; từ chối mảng nếu accepts_arrays=False."""
+
+    def __init__(self, accepts_arrays: bool, bad_keywords=()):
+        self.accepts_arrays = accepts_arrays
+        self.bad_keywords = set(bad_keywords)
+        self.bodies = []
+
+    def __call__(self, method, url, json=None, **kwargs):
+        self.bodies.append(json)
+        if isinstance(json, list):
+            return FakeResponse(200 if self.accepts_arrays else 400)
+        return FakeResponse(400 if json["keyword"] in self.bad_keywords else 200)
+
+
+def make_rows(count: int) -> list[dict]:
+    return [{"userId": 1, "model": "m", "keyword": f"keyword {i}", "rank": i, "createDate": "now"}
+            for i in range(count)]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    def install(accepts_arrays: bool, post_arrays: bool, bad_keywords=()):
+        fake = FakeBackend(accepts_arrays, bad_keywords)
+        monkeypatch.setattr(rank_tracking, "backend_request", fake)
+        monkeypatch.setattr(rank_tracking, "RANK_POST_ARRAYS", post_arrays)
+        return fake
+    return install
+
+
+def test_rows_are_posted_one_object_each_by_default(backend):
+    fake = backend(accepts_arrays=False, post_arrays=False)
+
+    errors = rank_tracking.deliver_rank_tracking(make_rows(5), batch_size=100)
+
+    assert errors == [None] * 5
+    assert len(fake.bodies) == 5
+    assert all(isinstance(body, dict) for body in fake.bodies)
+
+
+def test_arrays_are_posted_when_enabled(backend):
+    fake = backend(accepts_arrays=True, post_arrays=True)
+
+    errors = rank_tracking.deliver_rank_tracking(make_rows(5), batch_size=100)
+
+    assert errors == [None] * 5
+    assert fake.bodies == [make_rows(5)]
+
+
+def test_rejected_array_falls_back_to_one_post_per_row(backend):
+    fake = backend(accepts_arrays=False, post_arrays=True, bad_keywords={"keyword 3"})
+
+    errors = rank_tracking.deliver_rank_tracking(make_rows(8), batch_size=100)
+
+    assert len(fake.bodies) == 1 + 8
+    assert [error is not None for error in errors] == [i == 3 for i in range(8)]
+
+
+def test_simulator_path_returns_ranks_in_request_order(monkeypatch):
+    queued = []
+    monkeypatch.setattr(rank_tracking.outbox, "enqueue",
+                        lambda kind, rows, labels=None: queued.append(rows) or {"queued": len(rows)})
+    requests_list = [rank_tracking.UpdateRankTrackingRequest(input_keyword=f"keyword {i}", id=str(i), old_rank=i)
+                     for i in (3, 1, 3, 2)]
+
+    result = rank_tracking.update_rank_tracking(requests_list, estimator="simulator")
+
+    assert result["estimator"] == "simulator"
+    assert [row["id"] for row in result["ranks"]] == [3, 1, 2]
+    assert [row["keyword_name"] for row in result["ranks"]] == ["keyword 3", "keyword 1", "keyword 2"]
+    assert queued == [[{key: row[key] for key in ("id", "rank", "updatedDate")} for row in result["ranks"]]]
+    assert result["missing"] == []
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError
+
+
+def open_breaker(reset_timeout: float = 0.05) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = open_breaker(reset_timeout=60)
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = open_breaker()
+    time.sleep(0.06)
+
+    probe = breaker.allow()
+    assert probe is not None
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_release_by_non_owner_keeps_the_probe():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    probe = breaker.allow()
+
+    breaker.release(None)
+    breaker.release(object())
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.release(probe)
+    assert breaker.allow() is not None
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.record_failure(breaker.allow())
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() is None
+
+
+def test_cancelled_probe_is_released(monkeypatch):
+    breaker = open_breaker()
+    monkeypatch.setitem(resilience._breakers, "cancel-test", breaker)
+    time.sleep(0.06)
+
+    async def main():
+        task = asyncio.create_task(resilience.call_async("cancel-test", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.allow() is not None
+
+
+def test_fast_call_is_not_hedged():
+    calls = []
+
+    def work():
+        calls.append(1)
+        return "ok"
+
+    assert resilience.hedged(work, delay=0.5) == "ok"
+    assert len(calls) == 1
+
+
+def test_slow_primary_is_hedged_and_first_result_wins():
+    calls = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return "slow" if first else "hedge"
+
+    started = time.perf_counter()
+    assert resilience.hedged(work, delay=0.1) == "hedge"
+    assert time.perf_counter() - started < 0.5
+    assert len(calls) == 2
+
+
+def test_primaries_run_on_a_bounded_pool(monkeypatch):
+    monkeypatch.setattr(resilience, "_primary_executor",
+                        resilience.ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge-primary-test"))
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return "ok"
+
+    callers = [threading.Thread(target=resilience.hedged, args=(work, 10)) for _ in range(6)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(5)
+
+    assert max(peak) <= 2
+    assert len(peak) == 6
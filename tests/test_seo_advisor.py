@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+import advisor_history
+import seo_advisor
+from seo_advisor import AuditRequestModel, Elements, GroupAdvice, aggregate_elements
+from sqlite_store import SQLiteStore
+
+TITLE = ("title", "Thẻ title bị thiếu", "failed")
+META = ("meta", "Meta description quá ngắn", "failed")
+
+
+class FakeAdvisor:
+    """Thay advise_group: ghi lại các nhóm được gửi cho Gemini, có thể làm lỗi một số nhóm."""
+
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+
+    def __call__(self, request_data, group):
+        self.calls.append(group.element)
+        if group.element in self.failing:
+            raise RuntimeError("Gemini unavailable")
+        return GroupAdvice(category="warnings", issue_type=f"{group.element} advice",
+                           importance="Quan trọng", fix_steps=[f"Sửa {group.element}"])
+
+
+def make_request(*groups, url="https://example.com") -> AuditRequestModel:
+    elements = [
+        Elements(id=i, url=f"{url}/page-{i}", element=element, current_value=None, status=status,
+                 important=3, description=description, audit_repost_id=None)
+        for i, (element, description, status) in enumerate(groups)
+    ]
+    return AuditRequestModel(id=1, user_id=7, url=url, overall_score=60, critical_issue=1, warning=1,
+                             opportunity=0, passed_check="", failed_elements=elements)
+
+
+@pytest.fixture
+def advisor(tmp_path, monkeypatch):
+    monkeypatch.setattr(advisor_history, "_store",
+                        SQLiteStore(str(tmp_path / "history.sqlite3"), advisor_history.SCHEMA))
+    fake = FakeAdvisor()
+    monkeypatch.setattr(seo_advisor, "advise_group", fake)
+    return fake
+
+
+def issue_types(response) -> list[str]:
+    advice = response.advice
+    return [issue.issue_type for issue in advice.critical_issues + advice.warnings + advice.opportunities]
+
+
+def test_unchanged_groups_reuse_stored_advice(advisor):
+    seo_advisor.seo_advisor(make_request(TITLE, META))
+    assert sorted(advisor.calls) == ["meta", "title"]
+
+    advisor.calls.clear()
+    response = seo_advisor.seo_advisor(make_request(TITLE, META))
+    assert advisor.calls == []
+    assert sorted(issue_types(response)) == ["meta advice", "title advice"]
+
+
+def test_only_changed_group_is_re_advised(advisor):
+    seo_advisor.seo_advisor(make_request(TITLE, META))
+    advisor.calls.clear()
+
+    seo_advisor.seo_advisor(make_request(TITLE, META, META))
+    assert advisor.calls == ["meta"]
+
+
+def test_failed_group_keeps_previous_advice(advisor):
+    seo_advisor.seo_advisor(make_request(TITLE, META))
+    advisor.failing.add("meta")
+
+    response = seo_advisor.seo_advisor(make_request(TITLE, META, META))
+    assert sorted(issue_types(response)) == ["meta advice", "title advice"]
+
+
+def test_incompatible_history_falls_back_instead_of_failing(advisor):
+    request_data = make_request(TITLE, META)
+    # Lời khuyên lưu bởi phiên bản cũ, khi GroupAdvice chưa có `category`
+    old_advice = {"issue_type": "old advice", "importance": "Quan trọng", "fix_steps": []}
+    advisor_history.save(request_data.user_id, request_data.url, {
+        group.key: (group.signature(), old_advice) for group in aggregate_elements(request_data.failed_elements)
+    })
+    advisor.failing.add("meta")
+
+    response = seo_advisor.seo_advisor(request_data)
+
+    assert sorted(advisor.calls) == ["meta", "title"]
+    assert sorted(issue_types(response)) == ["meta: Meta description quá ngắn", "title advice"]
+    # Mục không dùng được không bị giữ lại trong lịch sử
+    stored = advisor_history.load(request_data.user_id, request_data.url)
+    assert all("category" in advice for _, advice in stored.values())
+    assert json.dumps(old_advice, ensure_ascii=False) not in json.dumps(
+        [advice for _, advice in stored.values()], ensure_ascii=False)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import Group
+
+
+def test_concurrent_calls_share_one_execution():
+    group = Group("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(group.do, "key", work)
+        started.wait(5)
+        followers = [executor.submit(group.do, "key", work) for _ in range(3)]
+        # Cho các follower kịp vào chờ trước khi leader xong
+        time.sleep(0.2)
+        release.set()
+        results = [leader.result(5)] + [future.result(5) for future in followers]
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert group.in_flight() == 0
+
+
+def test_exception_is_shared_and_key_is_released():
+    group = Group("test")
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        group.do("key", fail)
+    assert group.do("key", lambda: "again") == "again"
+
+
+def test_async_calls_share_one_execution():
+    group = Group("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(group.do_async("key", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(calls) == 1
+    assert group.in_flight() == 0
+
+
+def test_cancelling_the_leader_does_not_cancel_followers():
+    group = Group("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        leader = asyncio.create_task(group.do_async("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(group.do_async("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "result"
+    assert len(calls) == 1
+    assert group.in_flight() == 0
+
+
+def test_async_exception_reaches_every_caller():
+    group = Group("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(group.do_async("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert group.in_flight() == 0
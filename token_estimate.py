@@ -0,0 +1,8 @@
+# Ước lượng nhanh số token của một prompt mà không cần gọi count_tokens (mất một round trip).
+# Gemini trung bình ~4 byte UTF-8 cho mỗi token; tiếng Việt có dấu tốn nhiều byte hơn
+# nên ước lượng theo byte sát hơn theo ký tự.
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // BYTES_PER_TOKEN + 1
@@ -1,11 +1,28 @@
+import asyncio
+import hashlib
 import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
 import requests
 from pydantic import BaseModel
 from typing import Optional
-import google.generativeai as genai
 
-# Gemini model setup
-model = genai.GenerativeModel('gemini-2.0-flash')
+import model_registry
+from response_schema import json_config
+from singleflight import Group
+
+# Gemini model setup (model cụ thể lấy từ model_registry)
+FEATURE = "top_ranking"
+
+# Danh sách được làm mới ở nền sau mỗi TOP_RANKING_REFRESH_INTERVAL giây. Bản cũ vẫn được
+# trả về (stale-while-revalidate) cho tới TOP_RANKING_MAX_STALE giây; quá hạn đó request
+# phải chờ bản mới.
+TOP_RANKING_REFRESH_INTERVAL = int(os.getenv("TOP_RANKING_REFRESH_INTERVAL", "3600"))
+TOP_RANKING_MAX_STALE = int(os.getenv("TOP_RANKING_MAX_STALE", "86400"))
 
 # Pydantic model
 class TopRanking(BaseModel):
@@ -13,40 +30,141 @@ class TopRanking(BaseModel):
     rank: int
     search_volume: int
 
-# Generate keywords and call external API
-def top_ranking():
-    prompt = (
-    f"Act as an SEO analytics assistant. Without requiring any user input, provide a list of the top 10 trending keywords in the SEO or digital marketing domain."
-    "Respond in JSON format as an object with 3 fields: 'keyword_name' (string), 'rank' (integer) and 'search_volume' (integer)."
-    "Respond only in JSON format, as an array of objects with the three fields above."
-    )
+prompt = (
+    f"Act as an SEO analytics assistant. Without requiring any user input, provide a list of the top 10 trending keywords in the SEO or digital marketing domain, "
+    "with their rank and search volume."
+)
 
-    gemini_response_schema = {
-        "type": "ARRAY",
-        "items": {
-            "type": "OBJECT",
-            "properties": {
-                "keyword_name": {"type": "STRING"},
-                "rank": {"type": "INTEGER"},
-                "search_volume": {"type": "INTEGER"}
-            },
-            "required": ["keyword_name", "rank", "search_volume"]
-        }
-    }
+generation_config = json_config(list[TopRanking])
 
-    gemini_response = model.generate_content(
-        contents=prompt,
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": gemini_response_schema,
-        },
-    )
 
-    raw_keywords_data = json.loads(gemini_response.text)
+def build_result(response_text: str) -> dict:
+    raw_keywords_data = json.loads(response_text)
     my_keywords: list[TopRanking] = [TopRanking(**item) for item in raw_keywords_data]
 
     return {
         "message": "Keywords generated and sent successfully.",
         "generated_keywords_count": len(my_keywords),
         "items": raw_keywords_data
-    }
\ No newline at end of file
+    }
+
+
+def generate_top_ranking() -> dict:
+    gemini_response = model_registry.generate_content(
+        FEATURE,
+        contents=prompt,
+        generation_config=generation_config,
+    )
+    return build_result(gemini_response.text)
+
+
+@dataclass
+class Snapshot:
+    result: dict
+    etag: str
+    generated_at: float
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.generated_at, usegmt=True)
+
+    def age(self, now: float) -> float:
+        return now - self.generated_at
+
+    def not_modified(self, if_none_match: str | None, if_modified_since: str | None) -> bool:
+        """Kiểm tra điều kiện của conditional GET (If-None-Match được ưu tiên)."""
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= int(self.generated_at)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class TopRankingCache:
+    """
+    Giữ kết quả /top-ranking trong bộ nhớ và làm mới ở nền. Các request đồng thời khi
+    chưa có dữ liệu (hoặc dữ liệu quá cũ) chỉ tạo ra một lời gọi Gemini (single-flight).
+    """
+
+    def __init__(self, generate=generate_top_ranking, interval: int = TOP_RANKING_REFRESH_INTERVAL,
+                 max_stale: int = TOP_RANKING_MAX_STALE):
+        self.generate = generate
+        self.interval = interval
+        self.max_stale = max_stale
+        self.snapshot: Snapshot | None = None
+        self._flight = Group(FEATURE)
+        self._refresher: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def _regenerate(self) -> Snapshot:
+        result = self.generate()
+        body = json.dumps(result, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        self.snapshot = Snapshot(result, hashlib.sha256(body).hexdigest()[:32], time.time())
+        return self.snapshot
+
+    def refresh(self) -> Snapshot:
+        return self._flight.do(FEATURE, self._regenerate)
+
+    def _refresh_in_background(self):
+        if self._flight.in_flight():
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Top ranking refresh failed: {e}", file=sys.stderr)
+
+        threading.Thread(target=run, name="top-ranking-revalidate", daemon=True).start()
+
+    def _run_refresher(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Top ranking refresh failed: {e}", file=sys.stderr)
+
+    def start_refresher(self):
+        if self._refresher is None and self.interval > 0:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._run_refresher, name="top-ranking-refresher",
+                                                       daemon=True)
+                    self._refresher.start()
+
+    def get(self) -> Snapshot:
+        self.start_refresher()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return self.refresh()
+
+        age = snapshot.age(time.time())
+        if age > self.max_stale:
+            return self.refresh()
+        if age > self.interval:
+            # Trả bản cũ ngay, làm mới ở nền
+            self._refresh_in_background()
+        return snapshot
+
+    async def get_async(self) -> Snapshot:
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.age(time.time()) <= self.interval:
+            return snapshot
+        # Lần đầu (hoặc khi cần làm mới) chạy trên thread để dùng chung single-flight với đường Flask
+        return await asyncio.to_thread(self.get)
+
+
+cache = TopRankingCache()
+
+
+def top_ranking() -> Snapshot:
+    return cache.get()
+
+
+async def top_ranking_async() -> Snapshot:
+    return await cache.get_async()